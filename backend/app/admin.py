@@ -20,8 +20,8 @@ admin.site.register(ItemType, ItemTypeAdmin)
 
 
 class ItemAdmin(admin.ModelAdmin):
-    list_display = ["token", "user", "item_type", "rating"]
-    search_fields = ["token"]
+    list_display = ["token", "name", "user", "item_type", "rating"]
+    search_fields = ["token", "name"]
     list_filter = ["item_type", "user"]
 
 
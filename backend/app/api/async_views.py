@@ -0,0 +1,113 @@
+"""
+Async GETs of the hottest reads. ItemList and ActivityList are left to DRF: their filter backends and
+PaginationBase - page counts, keyset cursors, row estimates - query synchronously all the way down,
+and a copy of them here would drift from the original. Under ASGI they run on a thread each, like
+the writes
+"""
+
+import functools
+from typing import Callable
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.db.models import QuerySet
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.views import APIView
+
+from app.api.conditional import versioned
+from app.api.views import ActivityDetail, ItemDetails, ItemTypeList
+from app.models import Activity, Item, ItemType
+from app.serializers import (
+    ActivityDetailSerializer,
+    ItemDetailSerializer,
+    ItemTypeListSerializer,
+)
+
+
+def alogin_required(view: Callable) -> Callable:
+    """login_required for async views, leaving the user on request.user so nothing queries for it again"""
+
+    @functools.wraps(view)
+    async def wrapper(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def _drf_error(exc: NotAuthenticated | NotFound, status_code: int) -> JsonResponse:
+    # what backend.drf_helpers.exception_handler makes of it
+    return JsonResponse(
+        {"detail": str(exc.detail), "status_code": status_code}, status=status_code
+    )
+
+
+def _json(data) -> HttpResponse:
+    # DRF's rendering, so both paths send the same bytes
+    return HttpResponse(JSONRenderer().render(data), content_type="application/json")
+
+
+def drf_reads(drf_view: type[APIView], *kinds: str, cache: bool = False) -> Callable:
+    """
+    GETs of `drf_view` answered by the decorated async view, built on the async ORM, and every
+    other method by the DRF view itself on a worker thread. The async view sends JSON only, with
+    versioned(*kinds)'s ETags, and DRF's 403 when nobody is logged in
+    """
+
+    def decorator(read_view: Callable) -> Callable:
+        write_view = sync_to_async(drf_view.as_view())
+        read_view = versioned(*kinds, cache=cache)(read_view)
+
+        # DRF does its own csrf checks for the writes
+        @csrf_exempt
+        @functools.wraps(read_view)
+        async def view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+            if request.method not in {"GET", "HEAD"}:
+                return await write_view(request, *args, **kwargs)
+            request.user = await request.auser()
+            if not request.user.is_authenticated:
+                return _drf_error(NotAuthenticated(), status.HTTP_403_FORBIDDEN)
+            return await read_view(request, *args, **kwargs)
+
+        return view
+
+    return decorator
+
+
+async def _serialized_one(queryset: QuerySet, serializer_class) -> HttpResponse:
+    instance = await queryset.afirst()
+    if instance is None:
+        return _drf_error(NotFound(), status.HTTP_404_NOT_FOUND)
+    return _json(serializer_class(instance).data)
+
+
+@drf_reads(ItemTypeList, "item_type", cache=True)
+async def item_type_list(request: HttpRequest) -> HttpResponse:
+    item_types = [t async for t in ItemType.objects.filter(user=request.user)]
+    return _json(ItemTypeListSerializer(item_types, many=True).data)
+
+
+@drf_reads(ItemDetails, "library")
+async def item_details(request: HttpRequest, token: str) -> HttpResponse:
+    return await _serialized_one(
+        Item.objects.filter(user=request.user, token=token)
+        .select_related("item_type")
+        .with_ancestors(),
+        ItemDetailSerializer,
+    )
+
+
+@drf_reads(ActivityDetail, "library", "activity")
+async def activity_details(request: HttpRequest, token: str) -> HttpResponse:
+    return await _serialized_one(
+        Activity.objects.filter(user=request.user, token=token).select_related(
+            "item__item_type"
+        ),
+        ActivityDetailSerializer,
+    )
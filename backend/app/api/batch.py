@@ -0,0 +1,268 @@
+from typing import Any
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, transaction
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+
+from app.models import Activity, Item, ItemType, User
+from app.serializers import (
+    ActivityDetailSerializer,
+    ActivityListSerializer,
+    ItemDetailSerializer,
+    ItemListSerializer,
+)
+
+MAX_BATCH_OPERATIONS = 200
+# what activityDetails can set on a new activity
+ACTIVITY_DETAILS = {
+    "start_time",
+    "end_time",
+    "finished",
+    "pending",
+    "rating",
+    "notes",
+    "info",
+}
+
+
+class BatchError(Exception):
+    def __init__(self, detail: Any, status_code: int = status.HTTP_400_BAD_REQUEST):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def _object(data: dict[str, Any], key: str) -> dict[str, Any]:
+    value = data.get(key)
+    if not isinstance(value, dict):
+        raise BatchError(f"{key} must be an object")
+    return {**value}
+
+
+class BatchWriter:
+    """
+    Applies a list of item and activity writes for one user, each in its own savepoint of one transaction.
+
+    An operation is `{"op": "create" | "update" | "delete", "model": "activity" | "item", "token", "data"}`,
+    where `data` is what the matching single endpoint takes - ActivityList.create, ActivityDetail,
+    ItemList.create or ItemDetails. The user's item types and every item and activity the operations
+    mention are loaded once up front, rather than once per operation
+    """
+
+    def __init__(self, user: User, operations: list[dict[str, Any]]):
+        self.user = user
+        self.operations = operations
+        self.rating_max = user.settings.get("ratingMax", 5)
+        self.item_types = {t.slug: t for t in ItemType.objects.filter(user=user)}
+
+        # only a guess at what's needed - malformed operations are turned down when they're applied
+        item_tokens, activity_tokens = [], []
+        for operation in operations:
+            data = operation.get("data")
+            data = data if isinstance(data, dict) else {}
+            if operation.get("model") == "activity":
+                activity_tokens.append(operation.get("token"))
+                item_details = data.get("itemDetails")
+                item_details = item_details if isinstance(item_details, dict) else {}
+                item_tokens += [
+                    item_details.get("token"),
+                    item_details.get("parent_token"),
+                ]
+            else:
+                item_tokens += [
+                    operation.get("token"),
+                    data.get("parent_token"),
+                    data.get("setAsParentTo"),
+                ]
+        self.items = {
+            i.token: i
+            for i in Item.objects.filter(
+                user=user, token__in={t for t in item_tokens if isinstance(t, str)}
+            )
+            .select_related("item_type")
+            .with_ancestors()
+        }
+        self.activities = {
+            a.token: a
+            for a in Activity.objects.filter(
+                user=user, token__in={t for t in activity_tokens if isinstance(t, str)}
+            ).select_related("item__item_type", "item__parent")
+        }
+
+    def run(self, atomic: bool = False) -> list[dict[str, Any]]:
+        """Per operation `{"status", "data"}` or `{"status", "error"}`. `atomic` keeps nothing if anything failed"""
+        results = []
+        with transaction.atomic():
+            for operation in self.operations:
+                try:
+                    with transaction.atomic():
+                        code, data = self.apply(operation)
+                    results.append({"status": code, "data": data})
+                except (BatchError, ValidationError) as e:
+                    results.append({"status": e.status_code, "error": e.detail})
+                    self.forget()
+                except DjangoValidationError as e:
+                    # a value the field can't take, like a start_time that isn't a time
+                    results.append(
+                        {"status": status.HTTP_400_BAD_REQUEST, "error": e.messages}
+                    )
+                    self.forget()
+                except DatabaseError:
+                    results.append(
+                        {
+                            "status": status.HTTP_400_BAD_REQUEST,
+                            "error": "Couldn't save this operation",
+                        }
+                    )
+                    self.forget()
+            if atomic and any("error" in result for result in results):
+                transaction.set_rollback(True)
+        return results
+
+    def forget(self):
+        # a rolled back operation may have left its changes on the cached objects
+        self.items.clear()
+        self.activities.clear()
+
+    def apply(self, operation: dict[str, Any]) -> tuple[int, Any]:
+        handler = {
+            ("create", "activity"): self.create_activity,
+            ("update", "activity"): self.update_activity,
+            ("delete", "activity"): self.delete_activity,
+            ("create", "item"): self.create_item,
+            ("update", "item"): self.update_item,
+            ("delete", "item"): self.delete_item,
+        }.get((operation.get("op"), operation.get("model")))
+        if handler is None:
+            raise BatchError(
+                "op must be create, update or delete, model activity or item"
+            )
+        if operation.get("data") is None:
+            return handler(operation.get("token"), {})
+        return handler(operation.get("token"), _object(operation, "data"))
+
+    def get_item(self, token: str) -> Item:
+        if not isinstance(token, str):
+            raise BatchError("An item token is required")
+        if token not in self.items:
+            try:
+                self.items[token] = (
+                    Item.objects.select_related("item_type")
+                    .with_ancestors()
+                    .get(user=self.user, token=token)
+                )
+            except Item.DoesNotExist:
+                raise BatchError(f"No item {token}", status.HTTP_404_NOT_FOUND)
+        return self.items[token]
+
+    def get_activity(self, token: str) -> Activity:
+        if not isinstance(token, str):
+            raise BatchError("An activity token is required")
+        if token not in self.activities:
+            try:
+                self.activities[token] = Activity.objects.select_related(
+                    "item__item_type", "item__parent"
+                ).get(user=self.user, token=token)
+            except Activity.DoesNotExist:
+                raise BatchError(f"No activity {token}", status.HTTP_404_NOT_FOUND)
+        return self.activities[token]
+
+    def new_item(self, item_type_slug: str, info: dict[str, Any]) -> Item:
+        if not isinstance(item_type_slug, str):
+            raise BatchError("item_type is required")
+        item_type = self.item_types.get(item_type_slug)
+        if item_type is None:
+            raise BatchError(
+                f"No item type {item_type_slug}", status.HTTP_404_NOT_FOUND
+            )
+        error = item_type.info_validator.error_message(info)
+        if error is not None:
+            raise BatchError(error)
+        item = Item(item_type=item_type, user=self.user, info=info)
+        item.save()
+        self.items[item.token] = item
+        return item
+
+    def create_activity(self, token, data) -> tuple[int, Any]:
+        item_details = _object(data, "itemDetails")
+        item_token = item_details.pop("token", None)
+        item_parent_token = item_details.pop("parent_token", None)
+        item_type_slug = item_details.pop("item_type", None)
+        if item_token:
+            item = self.get_item(item_token)
+        else:
+            item = self.new_item(item_type_slug, item_details.get("info", {}))
+        if item_parent_token:
+            item.parent = self.get_item(item_parent_token)
+            item.save()
+
+        activity_details = _object(data, "activityDetails")
+        unknown = activity_details.keys() - ACTIVITY_DETAILS
+        if unknown:
+            raise BatchError(f"activityDetails can't set {', '.join(sorted(unknown))}")
+        rating = activity_details.pop("rating", None)
+        if rating is not None:
+            if (
+                not isinstance(rating, (int, float))
+                or isinstance(rating, bool)
+                or not 0 <= rating <= self.rating_max
+            ):
+                raise BatchError(f"rating must be between 0 and {self.rating_max}")
+            rating = rating / self.rating_max
+        activity = Activity(
+            user=self.user, item=item, rating=rating, **activity_details
+        )
+        activity.save()
+        self.activities[activity.token] = activity
+        return status.HTTP_201_CREATED, ActivityListSerializer(activity).data
+
+    def update_activity(self, token, data) -> tuple[int, Any]:
+        activity = self.get_activity(token)
+        item_type = activity.item.item_type.slug
+        if data.pop("item_type", item_type) != item_type:
+            raise BatchError("An activity's item type can't be changed")
+        if "item" in data:
+            # the serializer would take anyone's item
+            self.get_item(data["item"])
+        serializer = ActivityDetailSerializer(activity, data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return status.HTTP_200_OK, serializer.data
+
+    def delete_activity(self, token, data) -> tuple[int, Any]:
+        self.get_activity(token).delete()
+        self.activities.pop(token)
+        return status.HTTP_204_NO_CONTENT, None
+
+    def create_item(self, token, data) -> tuple[int, Any]:
+        item_type_slug = data.pop("item_type", None)
+        set_as_parent_to = data.pop("setAsParentTo", None)
+        item = self.new_item(item_type_slug, data.get("info", {}))
+        if set_as_parent_to:
+            child = self.get_item(set_as_parent_to)
+            child.parent = item
+            child.save()
+        return status.HTTP_201_CREATED, ItemListSerializer(item).data
+
+    def update_item(self, token, data) -> tuple[int, Any]:
+        item = self.get_item(token)
+        if data.pop("item_type", item.item_type.slug) != item.item_type.slug:
+            raise BatchError("An item's type can't be changed")
+        parent_token = data.pop("parent_token", None)
+        if "info" in data:
+            error = item.item_type.info_validator.error_message(data["info"])
+            if error is not None:
+                raise BatchError(error)
+        serializer = ItemDetailSerializer(item, data=data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        if parent_token is not None:
+            item.parent = None if parent_token is False else self.get_item(parent_token)
+            item.save()
+        return status.HTTP_200_OK, ItemDetailSerializer(item).data
+
+    def delete_item(self, token, data) -> tuple[int, Any]:
+        self.get_item(token).delete()
+        self.items.pop(token)
+        return status.HTTP_204_NO_CONTENT, None
@@ -0,0 +1,153 @@
+import functools
+import hashlib
+from typing import Callable, Iterable
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+from rest_framework.request import Request
+
+from app.models import User
+
+
+def version_etag(user: User, kinds: Iterable[str], *extra: str) -> str:
+    """Changes whenever any of the `kinds` of the user's data do, see User.VERSION_KINDS"""
+    versions = [str(getattr(user, f"{kind}_version")) for kind in kinds]
+    return "-".join([str(user.pk), *versions, *extra])
+
+
+def response_cache_key(etag: str, request: HttpRequest) -> str:
+    # the etag scopes it to the user and their versions, so a write moves every reader to new keys
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f"response:{etag}:{path}"
+
+
+def first_page(request: HttpRequest) -> bool:
+    # later pages are rarely asked for twice, don't let them crowd out the first
+    return request.GET.get("page", "1") == "1" and not request.GET.get("cursor")
+
+
+def cached_response(key: str) -> HttpResponse | None:
+    hit = caches["responses"].get(key)
+    if hit is None:
+        return None
+    content, content_type = hit
+    return HttpResponse(content, content_type=content_type)
+
+
+def cache_response(key: str, response: HttpResponse) -> None:
+    if response.status_code == 200 and not response.streaming:
+        caches["responses"].set(key, (response.content, response["Content-Type"]))
+
+
+async def acached_response(key: str) -> HttpResponse | None:
+    hit = await caches["responses"].aget(key)
+    if hit is None:
+        return None
+    content, content_type = hit
+    return HttpResponse(content, content_type=content_type)
+
+
+async def acache_response(key: str, response: HttpResponse) -> None:
+    if response.status_code == 200 and not response.streaming:
+        await caches["responses"].aset(
+            key, (response.content, response["Content-Type"])
+        )
+
+
+def versioned(*kinds: str, cache: bool = False) -> Callable:
+    """
+    For function views built only from the `kinds` of the user's data: revalidated on every use,
+    and a 304 from the versions on request.user alone while the client's copy is current.
+    With `cache`, first pages are kept in the responses cache and served from it until those versions move.
+    Goes under login_required, or alogin_required for async views
+    """
+
+    def etag(request: HttpRequest, *args, **kwargs) -> str:
+        return version_etag(request.user, kinds)
+
+    def last_modified(request: HttpRequest, *args, **kwargs):
+        return request.user.versions_modified
+
+    def decorator(view: Callable) -> Callable:
+        if cache and iscoroutinefunction(view):
+            uncached = view
+
+            @functools.wraps(uncached)
+            async def view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+                if not (settings.RESPONSE_CACHE and first_page(request)):
+                    return await uncached(request, *args, **kwargs)
+                key = response_cache_key(etag(request), request)
+                response = await acached_response(key)
+                if response is None:
+                    response = await uncached(request, *args, **kwargs)
+                    await acache_response(key, response)
+                return response
+
+        elif cache:
+            uncached = view
+
+            @functools.wraps(uncached)
+            def view(request: HttpRequest, *args, **kwargs) -> HttpResponse:
+                if not (settings.RESPONSE_CACHE and first_page(request)):
+                    return uncached(request, *args, **kwargs)
+                key = response_cache_key(etag(request), request)
+                response = cached_response(key)
+                if response is None:
+                    response = uncached(request, *args, **kwargs)
+                    cache_response(key, response)
+                return response
+
+        view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+        return cache_control(private=True, no_cache=True)(view)
+
+    return decorator
+
+
+class ConditionalGetMixin:
+    """
+    versioned for DRF views: GETs get an ETag and Last-Modified from the `version_kinds` of the
+    user's data, and a 304 straight after authentication - before the queryset is touched -
+    while they still match. With `cache_responses`, first pages come from the responses cache
+    when it has them, skipping the queries and the serializers
+    """
+
+    version_kinds: tuple[str, ...] = ("library",)
+    cache_responses = False
+
+    def get(self, request: Request, *args, **kwargs):
+        user = request.user
+        # the browsable api and json are different representations
+        unquoted = version_etag(
+            user, self.version_kinds, request.accepted_renderer.format
+        )
+        etag = quote_etag(unquoted)
+        last_modified = int(user.versions_modified.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = self.get_response(request, unquoted, *args, **kwargs)
+        if response.status_code in {200, 304}:
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def get_response(self, request: Request, etag: str, *args, **kwargs):
+        if not (
+            self.cache_responses and settings.RESPONSE_CACHE and first_page(request)
+        ):
+            return super().get(request, *args, **kwargs)
+        key = response_cache_key(etag, request)
+        response = cached_response(key)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            # rendered after finalize_response, on its way out
+            response.add_post_render_callback(lambda r: cache_response(key, r))
+        return response
@@ -1,30 +1,97 @@
+import base64
+import datetime
+import hmac
+import io
+import json
 from os import environ
 from django.contrib.auth.decorators import login_required
-from django.http import HttpRequest, HttpResponse, JsonResponse
-from django.shortcuts import get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.contrib.postgres.search import TrigramWordDistance, TrigramWordSimilarity
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.http import (
+    HttpRequest,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.shortcuts import aget_object_or_404, get_object_or_404
+from django.views.decorators.http import require_POST
+from PIL import UnidentifiedImageError
 
-from app.models import Item, ItemType
+from app.api.async_views import alogin_required
+from app.api.conditional import versioned
+from app.models import (
+    ROLLUP_RATING_BUCKETS,
+    ActivityRollup,
+    AutocompleteSuggestion,
+    Item,
+    ItemType,
+)
+from app.utils.icons import set_icon
+from app.utils.library_export import (
+    EXPORT_FORMATS,
+    export_library,
+    read_in_thread,
+)
+from app.utils.library_import import LibraryImporter, file_format_for, read_rows
+from app.utils.request_timing import route_metrics
+from backend.env import METRICS_TOKEN
 
 
-@login_required
-def get_item_autocomplete_values(request: HttpRequest, item_slug: str) -> JsonResponse:
-    item_type = get_object_or_404(ItemType, user=request.user, slug=item_slug)
-    auto_complete_choices = {}
-    for field_name in item_type.item_schema.get("properties", {}).keys():
-        vals = (
-            Item.objects.filter(user=request.user, item_type__slug=item_slug)
-            .values_list(f"info__{field_name}", flat=True)
-            .distinct()
+@alogin_required
+@versioned("library", cache=True)
+async def get_item_autocomplete_values(
+    request: HttpRequest, item_slug: str
+) -> JsonResponse:
+    """
+    Suggestions per schema field, most used first, from the AutocompleteSuggestion index.
+    `?q=` keeps values starting with it, `?limit=` caps each field's list.
+    """
+    item_type = await aget_object_or_404(ItemType, user=request.user, slug=item_slug)
+    prefix = request.GET.get("q", "")
+    try:
+        limit = int(request.GET["limit"]) if "limit" in request.GET else None
+    except ValueError:
+        limit = 0
+    if limit is not None and limit < 1:
+        return HttpResponseBadRequest("limit must be a positive number")
+
+    fields = list(item_type.item_schema.get("properties", {}).keys())
+    auto_complete_choices = {field_name: [] for field_name in fields}
+    suggestions = AutocompleteSuggestion.objects.filter(
+        item_type=item_type, field__in=fields
+    )
+    if prefix:
+        suggestions = suggestions.filter(label__istartswith=prefix)
+    suggestions = suggestions.annotate(
+        position=Window(
+            RowNumber(),
+            partition_by=F("field"),
+            order_by=[F("count").desc(), F("label").asc()],
         )
-        auto_complete_choices[field_name] = [
-            {"label": v, "value": v} for v in vals if v is not None
-        ]
+    )
+    if limit is not None:
+        suggestions = suggestions.filter(position__lte=limit)
+    async for field_name, value in suggestions.order_by(
+        "field", "position"
+    ).values_list("field", "value"):
+        auto_complete_choices[field_name].append({"label": value, "value": value})
+
     if item_type.parent_slug:
         items_of_parent_type = Item.objects.filter(
             user=request.user, item_type__slug=item_type.parent_slug
         )
+        if prefix:
+            items_of_parent_type = items_of_parent_type.filter(name__istartswith=prefix)
+        items_of_parent_type = items_of_parent_type.order_by("name").values_list(
+            "name", "token"
+        )[:limit]
         auto_complete_choices[item_type.parent_slug] = [
-            {"label": i.name, "value": i.token} for i in items_of_parent_type
+            {"label": name, "value": token}
+            async for name, token in items_of_parent_type
         ]
 
     return JsonResponse(auto_complete_choices)
@@ -40,39 +107,139 @@ def update_item_type_icon(request, slug):
         except KeyError:
             # if we are deleting the logo, we send an empty body
             icon = None
-        item_type.icon = icon
-        item_type.save()
+        try:
+            set_icon(item_type, icon)
+        except UnidentifiedImageError:
+            return HttpResponseBadRequest("Upload an image")
 
     return HttpResponse()
 
 
-@login_required
-def get_activities_static_filters(request: HttpRequest) -> JsonResponse:
-    res = {}
+@alogin_required
+@versioned("library", cache=True)
+async def get_activities_static_filters(request: HttpRequest) -> JsonResponse:
+    res = {"version": request.user.library_version}
 
     item_type_tuples = ItemType.objects.filter(user=request.user).values_list(
         "name", "slug"
     )
-    res["itemTypes"] = [{"label": i[0], "value": i[1]} for i in item_type_tuples]
+    res["itemTypes"] = [{"label": i[0], "value": i[1]} async for i in item_type_tuples]
 
-    items = Item.objects.filter(user=request.user).only("token", "info")
-    res["items"] = [{"label": i.name, "value": i.token} for i in items]
+    items = Item.objects.filter(user=request.user).values_list("name", "token")
+    res["items"] = [{"label": name, "value": token} async for name, token in items]
 
     return JsonResponse(res)
 
 
-@login_required
-def get_items_static_filters(request: HttpRequest) -> JsonResponse:
+FILTER_ITEMS_PAGE_SIZE = 50
+FILTER_ITEMS_MAX_PAGE_SIZE = 200
+
+
+@alogin_required
+@versioned("library", cache=True)
+async def get_activities_static_filter_items(request: HttpRequest) -> JsonResponse:
+    """
+    The item choices of get_activities_static_filters a page at a time, by name.
+    `?q=` keeps names starting with it, `?itemType=` keeps one type,
+    `?cursor=` is the `next` of the previous page.
+    """
+    try:
+        page_size = min(
+            int(request.GET.get("page_size", FILTER_ITEMS_PAGE_SIZE)),
+            FILTER_ITEMS_MAX_PAGE_SIZE,
+        )
+    except ValueError:
+        return HttpResponseBadRequest("page_size must be a number")
+    if page_size < 1:
+        return HttpResponseBadRequest("page_size must be at least 1")
+
+    items = Item.objects.filter(user=request.user)
+    prefix = request.GET.get("q", "")
+    if prefix:
+        items = items.filter(name__istartswith=prefix)
+    item_type_slug = request.GET.get("itemType")
+    if item_type_slug:
+        items = items.filter(item_type__slug=item_type_slug)
+    cursor = request.GET.get("cursor")
+    if cursor:
+        try:
+            name, token = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest("Invalid cursor")
+        items = items.filter(Q(name__gt=name) | Q(name=name, token__gt=token))
+
+    page = items.order_by("name", "token").values_list("name", "token")
+    rows = [row async for row in page[: page_size + 1]]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = base64.urlsafe_b64encode(json.dumps(rows[-1]).encode()).decode()
+
+    return JsonResponse(
+        {
+            "version": request.user.library_version,
+            "items": [{"label": name, "value": token} for name, token in rows],
+            "next": next_cursor,
+        }
+    )
+
+
+@alogin_required
+@versioned("item_type", cache=True)
+async def get_items_static_filters(request: HttpRequest) -> JsonResponse:
     res = {}
 
     item_type_tuples = ItemType.objects.filter(user=request.user).values_list(
         "name", "slug"
     )
-    res["itemTypes"] = [{"label": i[0], "value": i[1]} for i in item_type_tuples]
+    res["itemTypes"] = [{"label": i[0], "value": i[1]} async for i in item_type_tuples]
 
     return JsonResponse(res)
 
 
+FUZZY_MATCH_MAX_LIMIT = 50
+
+
+@login_required
+def fuzzy_match_items(request: HttpRequest) -> JsonResponse:
+    """Typo tolerant item lookup by name and key info fields, best matches first"""
+    query = request.GET.get("q", "").strip()
+    try:
+        limit = int(request.GET.get("limit", 10))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return HttpResponseBadRequest("limit must be a positive number")
+    limit = min(limit, FUZZY_MATCH_MAX_LIMIT)
+    if not query:
+        return JsonResponse({"results": []})
+
+    items = Item.objects.filter(
+        user=request.user, search_text__trigram_word_similar=query
+    )
+    item_type_slug = request.GET.get("itemType")
+    if item_type_slug:
+        items = items.filter(item_type__slug=item_type_slug)
+    # ordering by distance lets the gist index hand back the nearest rows directly
+    items = items.annotate(
+        similarity=TrigramWordSimilarity(query, "search_text")
+    ).order_by(TrigramWordDistance(query, "search_text"))[:limit]
+
+    return JsonResponse(
+        {
+            "results": [
+                {
+                    "token": i["token"],
+                    "name": i["name"],
+                    "item_type": i["item_type__slug"],
+                    "similarity": i["similarity"],
+                }
+                for i in items.values("token", "name", "item_type__slug", "similarity")
+            ]
+        }
+    )
+
+
 @login_required
 def update_item_icon(request: HttpRequest, item_token: str) -> HttpResponse:
     if request.method == "DELETE":
@@ -80,11 +247,142 @@ def update_item_icon(request: HttpRequest, item_token: str) -> HttpResponse:
     else:
         file = request.FILES["file"]
     item = get_object_or_404(Item, user=request.user, token=item_token)
-    item.icon = file
-    item.save()
+    try:
+        set_icon(item, file)
+    except UnidentifiedImageError:
+        return HttpResponseBadRequest("Upload an image")
     return HttpResponse()
 
 
 @login_required
-def version(request: HttpRequest):
+@require_POST
+def import_library(request: HttpRequest) -> JsonResponse:
+    """
+    Items and activities from an uploaded .csv or .jsonl `file`, see LibraryImporter for the columns.
+    `?itemType=` is the item type of rows that don't name one
+    """
+    upload = request.FILES.get("file")
+    if upload is None:
+        return HttpResponseBadRequest("No file")
+    file_format = file_format_for(upload.name)
+    if file_format is None:
+        return HttpResponseBadRequest("Upload a .csv or .jsonl file")
+    importer = LibraryImporter(request.user, request.GET.get("itemType"))
+    # read straight off the upload, rows are written a chunk at a time
+    with io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="") as file:
+        report = importer.run(read_rows(file, file_format))
+    return JsonResponse(report.as_dict())
+
+
+def _parse_month(value: str | None) -> datetime.date | None:
+    if not value:
+        return None
+    return datetime.date.fromisoformat(f"{value[:7]}-01")
+
+
+@login_required
+@versioned("library", "activity", "settings")
+def get_stats(request: HttpRequest) -> JsonResponse:
+    """
+    Activity counts per item type and month, and the rating histogram, from ActivityRollup
+    so the cost doesn't grow with history. Optional `?itemType=`, and `?from=` / `?to=` months (YYYY-MM, inclusive)
+    """
+    try:
+        start = _parse_month(request.GET.get("from"))
+        end = _parse_month(request.GET.get("to"))
+    except ValueError:
+        return HttpResponseBadRequest("from and to should look like YYYY-MM")
+    rollups = ActivityRollup.objects.filter(user=request.user)
+    if item_type_slug := request.GET.get("itemType"):
+        rollups = rollups.filter(item_type__slug=item_type_slug)
+    if start is not None:
+        rollups = rollups.filter(period__gte=start)
+    if end is not None:
+        rollups = rollups.filter(period__lte=end)
+
+    item_types = {}
+    months = {}
+    histogram = [0] * ROLLUP_RATING_BUCKETS
+    rated = 0
+    rating_sum = 0.0
+    for row in rollups.order_by("period").values(
+        "item_type__slug",
+        "item_type__name",
+        "period",
+        "finished",
+        "rating_bucket",
+        "count",
+        "rating_sum",
+    ):
+        item_type = item_types.setdefault(
+            row["item_type__slug"],
+            {
+                "slug": row["item_type__slug"],
+                "name": row["item_type__name"],
+                "activities": 0,
+                "finished": 0,
+            },
+        )
+        month = months.setdefault(
+            row["period"].strftime("%Y-%m"), {"activities": 0, "finished": 0}
+        )
+        for counts in (item_type, month):
+            counts["activities"] += row["count"]
+            counts["finished"] += row["count"] if row["finished"] else 0
+        if row["rating_bucket"] is not None:
+            histogram[row["rating_bucket"]] += row["count"]
+            rated += row["count"]
+            rating_sum += row["rating_sum"]
+
+    rating_max = request.user.settings.get("ratingMax", 5)
+    return JsonResponse(
+        {
+            "itemTypes": sorted(item_types.values(), key=lambda t: t["name"]),
+            "months": [{"month": m, **counts} for m, counts in months.items()],
+            "ratings": {
+                # bucket i holds ratings from i/10 up to (i+1)/10 of ratingMax
+                "histogram": histogram,
+                "average": round(rating_sum / rated * rating_max, 2) if rated else None,
+                "count": rated,
+            },
+        }
+    )
+
+
+EXPORT_CONTENT_TYPES = {"jsonl": "application/jsonl", "csv": "text/csv"}
+
+
+@login_required
+def export_library_file(request: HttpRequest) -> StreamingHttpResponse:
+    """The whole library as `?format=jsonl` (the default) or `?format=csv`, streamed as it's read"""
+    export_format = request.GET.get("format", "jsonl")
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest("format must be jsonl or csv")
+    content = export_library(request.user, export_format)
+    if isinstance(request, ASGIRequest):
+        content = read_in_thread(content)
+    res = StreamingHttpResponse(
+        content, content_type=EXPORT_CONTENT_TYPES[export_format]
+    )
+    res[
+        "Content-Disposition"
+    ] = f'attachment; filename="pillowbook-export.{export_format}"'
+    return res
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Per route latency histograms and query/phase totals in the Prometheus text format, for this process"""
+    authorization = request.headers.get("Authorization", "")
+    allowed = request.user.is_staff or (
+        METRICS_TOKEN and hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}")
+    )
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(
+        route_metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@alogin_required
+async def version(request: HttpRequest):
     return JsonResponse({"version": environ.get("COMMIT_HASH", "local")})
@@ -0,0 +1,165 @@
+import base64
+import datetime
+import json
+from typing import Any
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Field, OrderBy, Q, QuerySet
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+def _encode_value(value: Any) -> str:
+    # full precision, the lookups parse it back when comparing
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Can't put {type(value)} in a cursor")
+
+
+class KeysetPaginationMixin:
+    """
+    Opt-in cursor pagination for PageNumberPagination subclasses: when `?cursor=` is present
+    (empty for the first page) paginate_queryset should hand over to paginate_queryset_by_cursor,
+    which seeks past the last row of the previous page instead of counting and offsetting. Works with whatever ordering the filters left on the
+    queryset, with pk appended as a tie breaker and nulls always sorted last.
+    `?estimate=true` adds the planner's row estimate as `estimated_count`.
+    """
+
+    cursor_query_param = "cursor"
+    estimate_query_param = "estimate"
+    invalid_cursor_message = "Invalid cursor"
+
+    keyset_mode = False
+
+    def wants_cursor(self, request: Request) -> bool:
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset_by_cursor(self, queryset: QuerySet, request: Request):
+        self.keyset_mode = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        ordering = self._keyset_ordering(queryset)
+        self.estimated_count = None
+        if request.query_params.get(self.estimate_query_param) == "true":
+            self.estimated_count = self._estimate_count(queryset)
+
+        queryset = queryset.annotate(
+            **{f"keyset_{i}": F(field) for i, (field, _) in enumerate(ordering)}
+        ).order_by(*self._nulls_last(ordering))
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            fields = [
+                queryset.query.annotations[f"keyset_{i}"].output_field
+                for i in range(len(ordering))
+            ]
+            queryset = queryset.filter(
+                self._after(ordering, self._decode_cursor(cursor, ordering, fields))
+            )
+
+        rows = list(queryset[: page_size + 1])
+        self.next_cursor = None
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            self.next_cursor = self._encode_cursor(
+                ordering, [getattr(last, f"keyset_{i}") for i in range(len(ordering))]
+            )
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset_mode:
+            return super().get_paginated_response(data)
+        res: dict[str, Any] = {"next": self.get_next_link(), "results": data}
+        if self.estimated_count is not None:
+            res["estimated_count"] = self.estimated_count
+        return Response(res)
+
+    def get_next_link(self):
+        if not self.keyset_mode:
+            return super().get_next_link()
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor,
+        )
+
+    def order_like_cursor(self, queryset: QuerySet) -> QuerySet:
+        """
+        The order cursor pages come in - pk as the tie breaker and nulls last - for paging by offset,
+        so a client gets the same rows whichever it uses
+        """
+        if not all(isinstance(field, str) for field in queryset.query.order_by):
+            return queryset
+        return queryset.order_by(*self._nulls_last(self._keyset_ordering(queryset)))
+
+    @staticmethod
+    def _nulls_last(ordering: list[tuple[str, bool]]) -> list[OrderBy]:
+        return [
+            F(field).desc(nulls_last=True)
+            if descending
+            else F(field).asc(nulls_last=True)
+            for field, descending in ordering
+        ]
+
+    @staticmethod
+    def _keyset_ordering(queryset: QuerySet) -> list[tuple[str, bool]]:
+        ordering = []
+        for field in queryset.query.order_by:
+            if not isinstance(field, str) or field == "?":
+                continue
+            ordering.append((field.lstrip("-"), field.startswith("-")))
+        if not any(field in {"pk", "id"} for field, _ in ordering):
+            ordering.append(("pk", ordering[0][1] if ordering else True))
+        return ordering
+
+    @staticmethod
+    def _after(ordering: list[tuple[str, bool]], values: list[Any]) -> Q:
+        """Rows sorting after `values`: equal on the first n-1 keys and past it on the nth, for some n"""
+        after = Q(pk__in=[])
+        equal = Q()
+        for i, ((_, descending), value) in enumerate(zip(ordering, values)):
+            key = f"keyset_{i}"
+            if value is not None:
+                past = Q(**{f"{key}__{'lt' if descending else 'gt'}": value})
+                after |= equal & (past | Q(**{f"{key}__isnull": True}))
+                equal &= Q(**{key: value})
+            else:
+                # nulls sort last, so nothing is past a null on this key
+                equal &= Q(**{f"{key}__isnull": True})
+        return after
+
+    def _encode_cursor(
+        self, ordering: list[tuple[str, bool]], values: list[Any]
+    ) -> str:
+        payload = json.dumps({"o": ordering, "v": values}, default=_encode_value)
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def _decode_cursor(
+        self, cursor: str, ordering: list[tuple[str, bool]], fields: list[Field]
+    ) -> list[Any]:
+        """The values in `cursor`, as `fields` of the keys in `ordering`. Raises NotFound"""
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = payload["v"]
+            same_ordering = [tuple(o) for o in payload["o"]] == ordering
+        except (ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not same_ordering or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            # a tampered value would otherwise reach the database, and come back as a 500
+            return [
+                None if value is None else field.to_python(value)
+                for field, value in zip(fields, values)
+            ]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _estimate_count(queryset: QuerySet) -> int:
+        plan = json.loads(queryset.order_by().explain(format="json"))
+        return plan[0]["Plan"]["Plan Rows"]
@@ -1,19 +1,30 @@
 from django.urls import path, re_path
+from app.api.async_views import activity_details, item_details, item_type_list
 from app.api.non_drf_views import (
+    export_library_file,
+    fuzzy_match_items,
+    get_activities_static_filter_items,
     get_activities_static_filters,
     get_item_autocomplete_values,
     get_items_static_filters,
+    get_stats,
+    import_library,
+    metrics,
     update_item_icon,
     update_item_type_icon,
     version,
 )
 from app.api.views import (
-    ActivityDetail,
     ActivityList,
-    ItemDetails,
+    ActivityTimeline,
+    ApiTokenDetails,
+    ApiTokenList,
+    BatchWrite,
+    ConcurrentActivities,
     ItemList,
+    ItemSeries,
+    ItemTree,
     ItemTypeDetails,
-    ItemTypeList,
     UserDetails,
 )
 from app.utils.common_utils import TOKEN_REGEX
@@ -22,18 +33,34 @@ from app.utils.common_utils import TOKEN_REGEX
 urlpatterns = [
     re_path("^item_type/(?P<slug>[\\w_-]+)/icon", update_item_type_icon),
     re_path("^item_type/(?P<slug>[\\w_-]+)", ItemTypeDetails.as_view()),
-    path("item_type", ItemTypeList.as_view()),
+    path("item_type", item_type_list),
     path("activity", ActivityList.as_view()),
-    re_path(f"^activity/(?P<token>A_{TOKEN_REGEX})", ActivityDetail.as_view()),
+    path("activity/timeline", ActivityTimeline.as_view()),
+    re_path(
+        f"^activity/(?P<token>A_{TOKEN_REGEX})/concurrent",
+        ConcurrentActivities.as_view(),
+    ),
+    re_path(f"^activity/(?P<token>A_{TOKEN_REGEX})", activity_details),
     path("item", ItemList.as_view()),
-    re_path(f"^item/(?P<token>I_{TOKEN_REGEX})", ItemDetails.as_view()),
+    path("batch", BatchWrite.as_view()),
+    re_path(f"^item/(?P<token>I_{TOKEN_REGEX})/tree", ItemTree.as_view()),
+    re_path(f"^item/(?P<token>I_{TOKEN_REGEX})/series", ItemSeries.as_view()),
+    re_path(f"^item/(?P<token>I_{TOKEN_REGEX})", item_details),
     re_path("^settings", UserDetails.as_view()),
     re_path(
         f"^get_autocomplete_suggestions/(?P<item_slug>[\\w_-]+)",
         get_item_autocomplete_values,
     ),
     path("get_activities_static_filters", get_activities_static_filters),
+    path("get_activities_static_filter_items", get_activities_static_filter_items),
     path("get_items_static_filters", get_items_static_filters),
+    path("fuzzy_match_items", fuzzy_match_items),
+    path("stats", get_stats),
+    path("import", import_library),
+    path("export", export_library_file),
     re_path(f"^item_icon/(?P<item_token>I_{TOKEN_REGEX})", update_item_icon),
     path("version", version),
+    path("metrics", metrics),
+    path("tokens", ApiTokenList.as_view()),
+    re_path("^tokens/(?P<key>\\w+)", ApiTokenDetails.as_view()),
 ]
@@ -1,20 +1,45 @@
+import datetime
 from typing import Any, TypedDict
 
+from django.contrib.postgres.search import SearchRank
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from rest_framework import generics, status
 from rest_framework.filters import OrderingFilter, SearchFilter
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.text import slugify
+from rest_framework.exceptions import ParseError
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 import jsonschema
+from PIL import UnidentifiedImageError
 from rest_framework.views import APIView
-from app.models import Activity, Item, ItemType, User
+from backend.drf_helpers import (
+    ExtensionSessionAuthentication,
+    SessionOnlyAuthentication,
+)
+from app.api.conditional import ConditionalGetMixin
+from app.api.batch import MAX_BATCH_OPERATIONS, BatchWriter
+from app.api.pagination import KeysetPaginationMixin
+from app.models import Activity, ApiToken, Item, ItemType, User
+from app.utils.icons import set_icon
+from app.utils.api_tokens import MAX_TOKEN_LIFETIME, issue_token, revoke
+from app.utils.name_templates import get_tz
+from app.utils.schema_validation import InfoValidator, forget_info_validator
+from app.utils.search import build_search_query
 from app.serializers import (
     ActivityDetailSerializer,
     ActivityListSerializer,
+    ApiTokenSerializer,
     ItemDetailSerializer,
     ItemListSerializer,
+    ItemTreeSerializer,
+    SeriesChildSerializer,
     ItemTypeListSerializer,
     ItemTypeSerializer,
     UserSettingsSerializer,
@@ -29,11 +54,14 @@ from django_filters.rest_framework import (
 )
 
 
-class PaginationBase(PageNumberPagination):
+class PaginationBase(KeysetPaginationMixin, PageNumberPagination):
     page_size = 20
     page_size_query_param = "page_size"
 
     def paginate_queryset(self, queryset, request, view=None):
+        if self.wants_cursor(request):
+            return self.paginate_queryset_by_cursor(queryset, request)
+        queryset = self.order_like_cursor(queryset)
         # this would normally return a list, but we want a queryset
         page = super().paginate_queryset(
             queryset.values_list("pk", flat=True), request, view
@@ -45,7 +73,9 @@ class CharInFilter(BaseInFilter, CharFilter):
     pass
 
 
-class ItemTypeList(generics.ListCreateAPIView):
+class ItemTypeList(ConditionalGetMixin, generics.ListCreateAPIView):
+    version_kinds = ("item_type",)
+    cache_responses = True
     permission_classes = [IsAuthenticated]
     serializer_class = ItemTypeListSerializer
 
@@ -59,25 +89,29 @@ class ItemTypeList(generics.ListCreateAPIView):
         parent_slug = request.POST.get("parentSlug", None)
         icon = request.FILES.get("icon")
 
-        new_item_type = ItemType(
-            user=request.user,
-            name=name,
-            slug=slugify(name),
-            icon=icon if icon else None,
-        )
+        new_item_type = ItemType(user=request.user, name=name, slug=slugify(name))
         if parent_slug:
             try:
                 parent_type = ItemType.objects.get(user=request.user, slug=parent_slug)
                 new_item_type.parent_slug = parent_slug
             except ItemType.DoesNotExist:
                 pass
-        new_item_type.save()
+        try:
+            with transaction.atomic():
+                new_item_type.save()
+                if icon:
+                    # shared and given variants like any other upload
+                    set_icon(new_item_type, icon)
+        except UnidentifiedImageError:
+            return Response("Upload an image", status=status.HTTP_400_BAD_REQUEST)
         return Response(
             self.serializer_class(new_item_type).data, status=status.HTTP_201_CREATED
         )
 
 
-class ItemTypeDetails(generics.RetrieveUpdateDestroyAPIView):
+class ItemTypeDetails(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_kinds = ("item_type",)
+    cache_responses = True
     permission_classes = [IsAuthenticated]
     serializer_class = ItemTypeSerializer
     lookup_field = "slug"
@@ -88,6 +122,15 @@ class ItemTypeDetails(generics.RetrieveUpdateDestroyAPIView):
 
     def partial_update(self, request, *args, **kwargs):
         parent_slug = request.data.pop("parent_slug", None)
+        if "item_schema" in request.data:
+            if not isinstance(request.data["item_schema"], dict):
+                return Response(
+                    "item_schema must be an object", status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                InfoValidator(request.data["item_schema"])
+            except jsonschema.exceptions.SchemaError as e:
+                return Response(e.message, status=status.HTTP_400_BAD_REQUEST)
         res = super().partial_update(request, *args, **kwargs)
         if parent_slug is not None:
             obj = self.get_object()
@@ -99,7 +142,13 @@ class ItemTypeDetails(generics.RetrieveUpdateDestroyAPIView):
             res = Response(self.serializer_class(obj).data)
         return res
 
-    # TODO: validate in update that any changes to schema are valid?
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        forget_info_validator(serializer.instance.pk)
+
+    def perform_destroy(self, instance):
+        forget_info_validator(instance.pk)
+        super().perform_destroy(instance)
 
 
 class ItemDetailsType(TypedDict):
@@ -110,24 +159,26 @@ def create_validated_item(
     item_details: ItemDetailsType, item_type: ItemType, user: User
 ):
     item_required_fields = item_type.item_schema.get("required", [])
-    try:
-        jsonschema.validate(item_details["info"], item_type.item_schema)
-    except jsonschema.exceptions.ValidationError as e:
-        return Response(e.message, status=status.HTTP_400_BAD_REQUEST)
+    error = item_type.info_validator.error_message(item_details["info"])
+    if error is not None:
+        return Response(error, status=status.HTTP_400_BAD_REQUEST)
 
     item = Item(item_type=item_type, user=user, info=item_details["info"])
     item.save()
     return item
 
 
-class ActivityDetail(generics.RetrieveUpdateDestroyAPIView):
+class ActivityDetail(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_kinds = ("library", "activity")
     permission_classes = [IsAuthenticated]
     serializer_class = ActivityDetailSerializer
     lookup_field = "token"
 
     def get_queryset(self):
         token = self.kwargs["token"]
-        return Activity.objects.filter(user=self.request.user, token=token)
+        return Activity.objects.filter(
+            user=self.request.user, token=token
+        ).select_related("item__item_type")
 
 
 class ActivityFilterSet(FilterSet):
@@ -174,19 +225,30 @@ class ActivityFilterSet(FilterSet):
         fields = []
 
 
-class ActivitySearchFilter(SearchFilter):
-    def get_search_fields(self, view: APIView, request: Request):
-        schemas = ItemType.objects.filter(user=request.user).values_list(
-            "item_schema", flat=True
-        )
-        fields = set()
-        for s in schemas:
-            fields |= set(s.get("required", []))
+class FullTextSearchFilter(SearchFilter):
+    """`?search=` against Item.search_document, ranked unless an explicit ordering was asked for"""
+
+    search_document_field = "search_document"
+
+    def filter_queryset(self, request: Request, queryset, view: APIView):
+        query = build_search_query(self.get_search_terms(request))
+        if query is None:
+            return queryset
+        queryset = queryset.filter(**{self.search_document_field: query})
+        if request.query_params.get(api_settings.ORDERING_PARAM):
+            return queryset
+        return queryset.annotate(
+            search_rank=SearchRank(F(self.search_document_field), query)
+        ).order_by("-search_rank", *queryset.query.order_by)
 
-        return [f"item__info__{f}" for f in fields if f]
 
+class ActivitySearchFilter(FullTextSearchFilter):
+    search_document_field = "item__search_document"
 
-class ActivityList(generics.ListCreateAPIView):
+
+class ActivityList(ConditionalGetMixin, generics.ListCreateAPIView):
+    version_kinds = ("library", "activity")
+    cache_responses = True
     permission_classes = [IsAuthenticated]
     serializer_class = ActivityListSerializer
     pagination_class = PaginationBase
@@ -194,7 +256,11 @@ class ActivityList(generics.ListCreateAPIView):
     filterset_class = ActivityFilterSet
 
     def get_queryset(self):
-        return Activity.objects.filter(user=self.request.user).order_by("-pk")
+        return (
+            Activity.objects.filter(user=self.request.user)
+            .select_related("item__item_type")
+            .order_by("-pk")
+        )
 
     def create(self, request, *args, **kwargs):
         incoming = request.data
@@ -232,9 +298,100 @@ class ActivityList(generics.ListCreateAPIView):
         return Response(serialized_obj, status=status.HTTP_201_CREATED)
 
 
+TIMELINE_MAX_ACTIVITIES = 500
+
+
+def _timeline_bound(value: str | None, tz: datetime.tzinfo) -> datetime.datetime | None:
+    """An ISO datetime, or a date meaning its midnight, naive ones in the user's timezone"""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime.datetime.combine(day, datetime.time())
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise ParseError(f"Can't read {value} as a date or time")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment, tz)
+    return moment
+
+
+class ActivityTimeline(ConditionalGetMixin, generics.ListAPIView):
+    """
+    Activities overlapping `?from=` - `?to=` (`to` exclusive, either may be left open),
+    or the day `?at=`, earliest first. Activities without an end are ongoing, see activity_span.
+    Takes ActivityList's filters
+    """
+
+    # settings for the timezone the window is read in
+    version_kinds = ("library", "activity", "settings")
+    permission_classes = [IsAuthenticated]
+    serializer_class = ActivityListSerializer
+    filter_backends = [DjangoFilterBackend, ActivitySearchFilter]
+    filterset_class = ActivityFilterSet
+
+    def get_window(self) -> tuple[datetime.datetime | None, datetime.datetime | None]:
+        params = self.request.query_params
+        tz = get_tz(self.request.user.display_timezone) or datetime.timezone.utc
+        if "at" in params:
+            start = _timeline_bound(params["at"], tz)
+            return start, start + datetime.timedelta(days=1)
+        start = _timeline_bound(params.get("from"), tz)
+        end = _timeline_bound(params.get("to"), tz)
+        if start is None and end is None:
+            raise ParseError("Needs from and/or to, or at")
+        return start, end
+
+    def get_queryset(self):
+        return (
+            Activity.objects.filter(user=self.request.user)
+            .overlapping(*self.get_window())
+            .select_related("item__item_type")
+            .order_by(Coalesce("start_time", "end_time", "created"), "pk")
+        )
+
+    def list(self, request, *args, **kwargs):
+        activities = list(
+            self.filter_queryset(self.get_queryset())[: TIMELINE_MAX_ACTIVITIES + 1]
+        )
+        return Response(
+            {
+                "results": self.get_serializer(
+                    activities[:TIMELINE_MAX_ACTIVITIES], many=True
+                ).data,
+                "truncated": len(activities) > TIMELINE_MAX_ACTIVITIES,
+            }
+        )
+
+
+class ConcurrentActivities(ConditionalGetMixin, generics.ListAPIView):
+    """The user's other activities that overlap the given one in time"""
+
+    version_kinds = ("library", "activity")
+    permission_classes = [IsAuthenticated]
+    serializer_class = ActivityListSerializer
+    pagination_class = PaginationBase
+
+    def get_queryset(self):
+        activity = get_object_or_404(
+            Activity, user=self.request.user, token=self.kwargs["token"]
+        )
+        return (
+            Activity.objects.concurrent_with(activity)
+            .select_related("item__item_type")
+            # a named field, so the cursor can page by it
+            .annotate(began=Coalesce("start_time", "end_time", "created"))
+            .order_by("began", "pk")
+        )
+
+
 class ItemFilterSet(FilterSet):
     itemTypes = CharInFilter(field_name="item_type__slug", lookup_expr="in")
     pinned = CharInFilter(method="filter_by_pinned")
+    name = CharFilter(lookup_expr="icontains")
 
     def filter_by_pinned(self, queryset, name, value):
         if "false" in value:
@@ -248,19 +405,13 @@ class ItemFilterSet(FilterSet):
         fields = []
 
 
-class ItemSearchFilter(SearchFilter):
-    def get_search_fields(self, view: APIView, request: Request):
-        schemas = ItemType.objects.filter(user=request.user).values_list(
-            "item_schema", flat=True
-        )
-        fields = set()
-        for s in schemas:
-            fields |= set(s.get("required", []))
-
-        return [f"info__{f}" for f in fields if f]
+class ItemSearchFilter(FullTextSearchFilter):
+    search_document_field = "search_document"
 
 
-class ItemList(generics.ListCreateAPIView):
+class ItemList(ConditionalGetMixin, generics.ListCreateAPIView):
+    version_kinds = ("library",)
+    cache_responses = True
     permission_classes = [IsAuthenticated]
     serializer_class = ItemListSerializer
     pagination_class = PaginationBase
@@ -269,13 +420,18 @@ class ItemList(generics.ListCreateAPIView):
     ordering_fields = [
         "created",
         "modified",
+        "name",
         "rating",
         "item_type__slug",
         "parent__token",
     ]
 
     def get_queryset(self):
-        return Item.objects.filter(user=self.request.user)
+        return (
+            Item.objects.filter(user=self.request.user)
+            .select_related("item_type")
+            .with_ancestors()
+        )
 
     def create(self, request, *args, **kwargs):
         incoming = {**request.data}
@@ -300,13 +456,18 @@ class ItemList(generics.ListCreateAPIView):
         )
 
 
-class ItemDetails(generics.RetrieveUpdateDestroyAPIView):
+class ItemDetails(ConditionalGetMixin, generics.RetrieveUpdateDestroyAPIView):
+    version_kinds = ("library",)
     permission_classes = [IsAuthenticated]
     serializer_class = ItemDetailSerializer
     lookup_field = "token"
 
     def get_queryset(self):
-        return Item.objects.filter(user=self.request.user, token=self.kwargs["token"])
+        return (
+            Item.objects.filter(user=self.request.user, token=self.kwargs["token"])
+            .select_related("item_type")
+            .with_ancestors()
+        )
 
     def partial_update(self, request, *args, **kwargs) -> Response:
         incoming = request.data
@@ -318,12 +479,11 @@ class ItemDetails(generics.RetrieveUpdateDestroyAPIView):
         if "info" in item_details:
             item_required_fields = orig_obj.item_type.item_schema["required"]
 
-            try:
-                jsonschema.validate(
-                    item_details["info"], orig_obj.item_type.item_schema
-                )
-            except jsonschema.exceptions.ValidationError as e:
-                return Response(e.message, status=status.HTTP_400_BAD_REQUEST)
+            error = orig_obj.item_type.info_validator.error_message(
+                item_details["info"]
+            )
+            if error is not None:
+                return Response(error, status=status.HTTP_400_BAD_REQUEST)
 
         res = super().partial_update(request, *args, **kwargs)
         if parent_token is not None:
@@ -338,7 +498,75 @@ class ItemDetails(generics.RetrieveUpdateDestroyAPIView):
         return res
 
 
-class UserDetails(generics.RetrieveUpdateAPIView):
+class ItemTree(ConditionalGetMixin, generics.RetrieveAPIView):
+    """
+    An item with its ancestors, and everything below it nested under `children` -
+    the whole subtree from one recursive query, however deep it goes
+    """
+
+    version_kinds = ("library",)
+    permission_classes = [IsAuthenticated]
+    serializer_class = ItemDetailSerializer
+    lookup_field = "token"
+
+    def get_queryset(self):
+        return (
+            Item.objects.filter(user=self.request.user, token=self.kwargs["token"])
+            .select_related("item_type")
+            .with_ancestors()
+        )
+
+    def retrieve(self, request, *args, **kwargs) -> Response:
+        item = self.get_object()
+        descendants = (
+            Item.objects.filter(user=request.user)
+            .descendants_of([item.pk])
+            # only there if the item is its own ancestor
+            .exclude(pk=item.pk)
+            .select_related("item_type")
+            .order_by("name", "pk")
+        )
+        nodes = {item.pk: {**self.get_serializer(item).data, "children": []}}
+        for descendant in descendants:
+            nodes[descendant.pk] = {
+                **ItemTreeSerializer(descendant).data,
+                "children": [],
+            }
+        # ordered by name, so each parent's children are too
+        for descendant in descendants:
+            nodes[descendant.parent_id]["children"].append(nodes[descendant.pk])
+        return Response(nodes[item.pk])
+
+
+class ItemSeries(ItemTree):
+    """
+    A parent item - a book series, say - with its children and how far along each is: activity
+    count, latest activity, finished and average rating. The stats of every child come from
+    one grouped query, so a long series costs what a short one does
+    """
+
+    version_kinds = ("library", "activity")
+
+    def retrieve(self, request, *args, **kwargs) -> Response:
+        item = self.get_object()
+        children = list(
+            Item.objects.filter(user=request.user, parent=item)
+            .select_related("item_type")
+            .with_activity_stats()
+            .order_by("name", "pk")
+        )
+        return Response(
+            {
+                **self.get_serializer(item).data,
+                "finished_count": sum(c.any_finished for c in children),
+                "children": SeriesChildSerializer(children, many=True).data,
+            }
+        )
+
+
+class UserDetails(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
+    version_kinds = ("settings",)
+    cache_responses = True
     permission_classes = [IsAuthenticated]
     serializer_class = UserSettingsSerializer
 
@@ -347,3 +575,82 @@ class UserDetails(generics.RetrieveUpdateAPIView):
 
     def get_object(self):
         return self.get_queryset().first()
+
+
+class ApiTokenList(generics.ListCreateAPIView):
+    """
+    The user's API tokens. POST `{"name": ..., "days": 90}` makes one, answering with the signed
+    `token` - the only time it's shown
+    """
+
+    permission_classes = [IsAuthenticated]
+    # not with a token, see SessionOnlyAuthentication
+    authentication_classes = [SessionOnlyAuthentication]
+    serializer_class = ApiTokenSerializer
+
+    def get_queryset(self):
+        return ApiToken.objects.filter(user=self.request.user).order_by("-created")
+
+    def create(self, request, *args, **kwargs) -> Response:
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            days = int(request.data.get("days", 90))
+        except (TypeError, ValueError):
+            raise ParseError("days must be a number")
+        if not 0 < days <= MAX_TOKEN_LIFETIME.days:
+            raise ParseError(f"days must be between 1 and {MAX_TOKEN_LIFETIME.days}")
+        api_token, token = issue_token(
+            request.user,
+            serializer.validated_data.get("name", ""),
+            datetime.timedelta(days=days),
+        )
+        return Response(
+            {**ApiTokenSerializer(api_token).data, "token": token},
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class ApiTokenDetails(generics.RetrieveDestroyAPIView):
+    """DELETE revokes the token, everywhere within a few seconds"""
+
+    permission_classes = [IsAuthenticated]
+    # not with a token, see SessionOnlyAuthentication
+    authentication_classes = [SessionOnlyAuthentication]
+    serializer_class = ApiTokenSerializer
+    lookup_field = "key"
+
+    def get_queryset(self):
+        return ApiToken.objects.filter(user=self.request.user)
+
+    def perform_destroy(self, instance: ApiToken) -> None:
+        revoke(ApiToken.objects.filter(pk=instance.pk))
+
+
+class BatchWrite(APIView):
+    """
+    Many item and activity writes in one request and one transaction, see BatchWriter.
+    Takes `{"operations": [...], "atomic": false}`, answers with a result per operation
+    """
+
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [ExtensionSessionAuthentication]
+
+    def post(self, request, *args, **kwargs) -> Response:
+        operations = request.data.get("operations")
+        if not isinstance(operations, list) or not all(
+            isinstance(o, dict) for o in operations
+        ):
+            return Response(
+                "operations must be a list of objects",
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(operations) > MAX_BATCH_OPERATIONS:
+            return Response(
+                f"At most {MAX_BATCH_OPERATIONS} operations per batch",
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        results = BatchWriter(request.user, operations).run(
+            atomic=bool(request.data.get("atomic", False))
+        )
+        return Response({"results": results})
@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete
 import traceback
 import os
 
@@ -8,6 +10,12 @@ class AppConfig(AppConfig):
     name = "app"
 
     def ready(self):
+        from app.models import Item, ItemType, release_icon
+        from app.utils.request_timing import install_query_timer
+
+        connection_created.connect(install_query_timer)
+        for model in (Item, ItemType):
+            post_delete.connect(release_icon, sender=model)
         try:
             from app.models import ItemType
 
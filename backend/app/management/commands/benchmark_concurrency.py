@@ -0,0 +1,78 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from app.utils.concurrency_benchmark import (
+    CONCURRENCY_PATHS,
+    SERVER_ARGUMENTS,
+    run_concurrency_benchmark,
+)
+
+
+def _size(value: str) -> tuple[int, int]:
+    items, _, activities = value.partition(":")
+    return int(items), int(activities or int(items) * 10)
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the project with gunicorn's sync WSGI workers and with uvicorn workers on ASGI, and time "
+        "reads under concurrent and slow clients. Needs gunicorn and uvicorn installed, and a database "
+        "the servers can reach - a synthetic user is created there and deleted afterwards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interface",
+            action="append",
+            choices=list(SERVER_ARGUMENTS),
+            help="wsgi and/or asgi, repeatable. Both by default",
+        )
+        parser.add_argument(
+            "--path",
+            action="append",
+            choices=list(CONCURRENCY_PATHS),
+            help="only this read, repeatable",
+        )
+        parser.add_argument(
+            "--size", type=_size, default=(1000, 10000), help="items[:activities]"
+        )
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=20)
+        parser.add_argument(
+            "--slow-clients",
+            type=int,
+            default=20,
+            help="connections sending their request a byte at a time alongside",
+        )
+        parser.add_argument(
+            "--slow-seconds",
+            type=float,
+            default=5,
+            help="how long each slow client takes to send its request",
+        )
+        parser.add_argument("--workers", type=int, default=3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="write the JSON here, not to stdout")
+
+    def handle(self, *args, **options):
+        items, activities = options["size"]
+        results = run_concurrency_benchmark(
+            options["interface"] or list(SERVER_ARGUMENTS),
+            items=items,
+            activities=activities,
+            paths=options["path"],
+            requests=options["requests"],
+            concurrency=options["concurrency"],
+            slow_clients=options["slow_clients"],
+            slow_seconds=options["slow_seconds"],
+            workers=options["workers"],
+            seed=options["seed"],
+            progress=lambda message: self.stderr.write(message),
+        )
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
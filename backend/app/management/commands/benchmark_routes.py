@@ -0,0 +1,82 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.utils.route_benchmark import compare_benchmarks, run_benchmarks
+
+
+def _size(value: str) -> tuple[int, int]:
+    items, _, activities = value.partition(":")
+    return int(items), int(activities or int(items) * 10)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time every api and auth route against synthetic libraries of each --size, and write the results as JSON. "
+        "Nothing generated is kept"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            type=_size,
+            action="append",
+            help="items[:activities], repeatable. Activities default to ten per item",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--depth", type=int, default=2)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--route", action="append", help="only this route pattern, repeatable"
+        )
+        parser.add_argument("--output", help="write the JSON here, not to stdout")
+        parser.add_argument(
+            "--baseline", help="a previous --output to report regressions against"
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=1.2,
+            help="how many times slower a median has to get to count as a regression",
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Can't read {options['baseline']}: {e}")
+
+        results = run_benchmarks(
+            options["size"] or [(100, 1000), (1000, 10000), (10000, 100000)],
+            repeat=options["repeat"],
+            depth=options["depth"],
+            seed=options["seed"],
+            routes=options["route"],
+            progress=lambda message: self.stderr.write(message),
+        )
+        if baseline is not None:
+            results["regressions"] = compare_benchmarks(
+                baseline, results, options["threshold"]
+            )
+        if results["missing_routes"]:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"No requests for {', '.join(results['missing_routes'])}, add them to ROUTE_REQUESTS"
+                )
+            )
+
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+        if results.get("regressions"):
+            self.stderr.write(
+                self.style.ERROR(f"{len(results['regressions'])} regressions")
+            )
+            sys.exit(1)
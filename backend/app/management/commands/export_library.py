@@ -0,0 +1,27 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import User
+from app.utils.library_export import EXPORT_FORMATS, export_library
+
+
+class Command(BaseCommand):
+    help = "Write a user's whole library as jsonl or csv, to a file or stdout"
+
+    def add_arguments(self, parser):
+        parser.add_argument("email")
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="jsonl")
+        parser.add_argument("--output", help="path to write to, stdout when left out")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options["email"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['email']}")
+
+        if options["output"]:
+            with open(options["output"], "w", newline="") as file:
+                file.writelines(export_library(user, options["format"]))
+        else:
+            sys.stdout.writelines(export_library(user, options["format"]))
@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.utils.synthetic_library import generate_users
+
+
+class Command(BaseCommand):
+    help = "Create users with made up libraries for benchmarking, see SyntheticLibrary. Counts are per user"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1)
+        parser.add_argument("--items", type=int, default=1000)
+        parser.add_argument("--activities", type=int, default=10000)
+        parser.add_argument(
+            "--depth", type=int, default=2, help="levels of series above each book"
+        )
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--email-prefix", default="synthetic")
+        parser.add_argument("--password", help="log in as the users with this")
+
+    def handle(self, *args, **options):
+        try:
+            users, report = generate_users(
+                options["users"],
+                options["items"],
+                options["activities"],
+                depth=options["depth"],
+                seed=options["seed"],
+                email_prefix=options["email_prefix"],
+                password=options["password"],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(
+            json.dumps(
+                {**report.as_dict(), "emails": [u.email for u in users]}, indent=2
+            )
+        )
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import User
+from app.utils.library_import import (
+    IMPORT_CHUNK_SIZE,
+    LibraryImporter,
+    file_format_for,
+    read_rows,
+)
+
+
+class Command(BaseCommand):
+    help = "Import items and activities for a user from a .csv or .jsonl file, see LibraryImporter for the columns"
+
+    def add_arguments(self, parser):
+        parser.add_argument("email")
+        parser.add_argument("path")
+        parser.add_argument("--item-type", help="slug for rows without an item_type")
+        parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options["email"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user {options['email']}")
+        file_format = file_format_for(options["path"])
+        if file_format is None:
+            raise CommandError("Expected a .csv or .jsonl file")
+
+        importer = LibraryImporter(user, options["item_type"], options["chunk_size"])
+        with open(options["path"], encoding="utf-8-sig", newline="") as file:
+            report = importer.run(read_rows(file, file_format))
+        self.stdout.write(json.dumps(report.as_dict(), indent=2))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from app.models import StoredIcon
+from app.utils.icons import make_icon_variants
+
+
+class Command(BaseCommand):
+    help = "Make the resized WebP copies of icons that don't have them yet, or of every icon with --all"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", action="store_true", help="redo icons that already have variants"
+        )
+
+    def handle(self, *args, **options):
+        icons = StoredIcon.objects.all()
+        if not options["all"]:
+            icons = icons.filter(variants={})
+        made = 0
+        for pk in icons.values_list("pk", flat=True).iterator():
+            made += make_icon_variants(pk) is not None
+        self.stdout.write(f"Made variants for {made} icons")
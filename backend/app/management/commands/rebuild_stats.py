@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import ActivityRollup, User
+
+
+class Command(BaseCommand):
+    help = "Recount the activity rollups behind /api/stats from the activities, for everyone or one user"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", help="email of the only user to rebuild")
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options["user"]:
+            users = users.filter(email=options["user"])
+            if not users.exists():
+                raise CommandError(f"No user {options['user']}")
+        for user in users.iterator():
+            ActivityRollup.objects.rebuild(user)
+            self.stdout.write(f"Rebuilt stats for {user.email}")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.utils.icons import recount_stored_icons, share_legacy_icons
+
+
+class Command(BaseCommand):
+    help = (
+        "Move icons uploaded before they were shared under their content hash, "
+        "then recount who uses each stored icon and delete the unused ones"
+    )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Moved {share_legacy_icons()} icons")
+        self.stdout.write(f"Deleted {recount_stored_icons()} unused icons")
@@ -1,5 +1,7 @@
 from typing import Any
 from django.contrib.auth.base_user import BaseUserManager
+from django.db.models import F
+from django.db.models.functions import Now
 
 
 class UserManager(BaseUserManager):
@@ -24,3 +26,14 @@ class UserManager(BaseUserManager):
         extra_fields.setdefault("is_superuser", True)
         extra_fields.setdefault("is_staff", True)
         return self._create_user(email, password, **extra_fields)
+
+    def bump_versions(self, user_id: int, *kinds: str) -> None:
+        """Mark parts of the user's data as changed, `kinds` from User.VERSION_KINDS"""
+        self.filter(pk=user_id).update(
+            versions_modified=Now(),
+            **{f"{kind}_version": F(f"{kind}_version") + 1 for kind in kinds},
+        )
+
+    def bump_library_version(self, user_id: int) -> None:
+        """Mark the user's items or item types as changed, see User.library_version"""
+        self.bump_versions(user_id, "library")
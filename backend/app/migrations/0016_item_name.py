@@ -0,0 +1,58 @@
+# Generated by Django 5.0 on 2026-10-18 10:25
+
+import re
+
+from dateutil.tz import gettz
+from django.db import migrations, models
+
+
+def render_names(apps, schema_editor):
+    # historical models don't carry Item.render_name, so this is a frozen copy of it
+    Item = apps.get_model("app", "Item")
+    field_regex = re.compile(r"{{([\w\-\.!%]+)}}")
+    parent_regex = re.compile(r"(parent\.)*(.*)")
+
+    items = Item.objects.select_related("item_type", "user", "parent")
+    batch = []
+    for item in items.iterator(chunk_size=1000):
+        tz = gettz(item.user.settings.get("displayTimezone", "UTC"))
+        name = item.item_type.name_schema
+        for field in field_regex.findall(name):
+            match = parent_regex.search(field)
+            actual_field = match.group(2)
+            ancestor = item
+            for _ in range(match.start(2) // len("parent.")):
+                ancestor = ancestor.parent if ancestor else None
+            val = ""
+            if ancestor:
+                if actual_field.split("!")[0] == "created":
+                    local = ancestor.created.astimezone(tz)
+                    val = (
+                        local.strftime(actual_field.split("!")[1])
+                        if "!" in actual_field
+                        else local.isoformat()
+                    )
+                else:
+                    val = ancestor.info.get(actual_field, "")
+            name = name.replace("{{" + field + "}}", str(val))
+        item.name = name
+        batch.append(item)
+        if len(batch) >= 1000:
+            Item.objects.bulk_update(batch, ["name"])
+            batch = []
+    Item.objects.bulk_update(batch, ["name"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0015_item_icon"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="name",
+            field=models.TextField(blank=True, db_index=True),
+        ),
+        migrations.RunPython(render_names, migrations.RunPython.noop),
+    ]
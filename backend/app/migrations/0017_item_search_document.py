@@ -0,0 +1,54 @@
+# Generated by Django 5.0 on 2026-10-18 10:28
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+# app.utils.search.item_search_document as it was when this ran: the rendered name, the info
+# values, the parent's name and the notes, weighted in that order
+BUILD_SEARCH_DOCUMENTS = """
+UPDATE app_item SET search_document =
+    setweight(to_tsvector('simple'::regconfig, COALESCE(name, '')), 'A')
+    || setweight(
+        jsonb_to_tsvector(
+            'simple'::regconfig,
+            COALESCE(info, '{}'::jsonb),
+            '["string", "numeric"]'
+        ),
+        'B'
+    )
+    || setweight(
+        to_tsvector(
+            'simple'::regconfig,
+            COALESCE(
+                (SELECT parent.name FROM app_item parent WHERE parent.id = app_item.parent_id),
+                ''
+            )
+        ),
+        'C'
+    )
+    || setweight(to_tsvector('simple'::regconfig, COALESCE(notes, '')), 'D')
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0016_item_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="search_document",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="item",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_document"], name="item_search_idx"
+            ),
+        ),
+        migrations.RunSQL(BUILD_SEARCH_DOCUMENTS, migrations.RunSQL.noop),
+    ]
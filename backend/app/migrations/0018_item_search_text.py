@@ -0,0 +1,50 @@
+# Generated by Django 5.0 on 2026-10-18 10:41
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import BtreeGistExtension, TrigramExtension
+from django.db import migrations, models
+
+
+def build_search_text(apps, schema_editor):
+    # app.utils.search.item_search_text as it was when this ran: the name plus the values of
+    # the fields any of the user's item types require
+    Item = apps.get_model("app", "Item")
+    ItemType = apps.get_model("app", "ItemType")
+    for user_id in Item.objects.values_list("user_id", flat=True).distinct():
+        fields = set()
+        for schema in ItemType.objects.filter(user_id=user_id).values_list(
+            "item_schema", flat=True
+        ):
+            fields |= set(schema.get("required", []))
+        fields = sorted(f for f in fields if f)
+        values = ", ".join(["name", *["info ->> %s"] * len(fields)])
+        schema_editor.execute(
+            f"UPDATE app_item SET search_text = concat_ws(' ', {values}) "
+            "WHERE user_id = %s",
+            [*fields, user_id],
+        )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0017_item_search_document"),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        BtreeGistExtension(),
+        migrations.AddField(
+            model_name="item",
+            name="search_text",
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(build_search_text, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="item",
+            index=django.contrib.postgres.indexes.GistIndex(
+                fields=["user", "search_text"],
+                name="item_search_text_trgm_idx",
+                opclasses=["gist_int8_ops", "gist_trgm_ops"],
+            ),
+        ),
+    ]
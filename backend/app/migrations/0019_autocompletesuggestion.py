@@ -0,0 +1,79 @@
+# Generated by Django 5.0 on 2026-10-18 10:32
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0018_item_search_text"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AutocompleteSuggestion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("field", models.TextField()),
+                ("value", models.JSONField()),
+                ("label", models.TextField()),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "item_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="app.itemtype"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        models.F("item_type"),
+                        models.F("field"),
+                        django.contrib.postgres.indexes.OpClass(
+                            django.db.models.functions.text.Upper("label"),
+                            name="text_pattern_ops",
+                        ),
+                        name="suggestion_prefix_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="autocompletesuggestion",
+            constraint=models.UniqueConstraint(
+                fields=("item_type", "field", "value"), name="unique_suggestion"
+            ),
+        ),
+        migrations.RunSQL(
+            """
+            INSERT INTO app_autocompletesuggestion (user_id, item_type_id, field, value, label, count)
+            SELECT i.user_id, i.item_type_id, kv.key, kv.value,
+                   CASE WHEN jsonb_typeof(kv.value) = 'string' THEN kv.value #>> '{}' ELSE kv.value::text END,
+                   count(*)
+            FROM app_item i, jsonb_each(i.info) kv
+            WHERE jsonb_typeof(kv.value) = 'number'
+               OR (jsonb_typeof(kv.value) = 'string' AND kv.value <> '""'::jsonb)
+            GROUP BY i.user_id, i.item_type_id, kv.key, kv.value
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0 on 2026-10-18 10:36
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0019_autocompletesuggestion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="library_version",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="item",
+            index=models.Index(
+                models.F("user"),
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper("name"),
+                    name="text_pattern_ops",
+                ),
+                name="item_name_prefix_idx",
+            ),
+        ),
+    ]
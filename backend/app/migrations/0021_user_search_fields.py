@@ -0,0 +1,38 @@
+# Generated by Django 5.0 on 2026-10-18 10:38
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+def fill_search_fields(apps, schema_editor):
+    User = apps.get_model("app", "User")
+    ItemType = apps.get_model("app", "ItemType")
+    for user in User.objects.all():
+        fields = set()
+        for schema in ItemType.objects.filter(user=user).values_list(
+            "item_schema", flat=True
+        ):
+            fields |= set(schema.get("required", []))
+        user.search_fields = sorted(f for f in fields if f)
+        user.save(update_fields=["search_fields"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0020_user_library_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="search_fields",
+            field=django.contrib.postgres.fields.ArrayField(
+                base_field=models.TextField(),
+                blank=True,
+                default=list,
+                editable=False,
+                size=None,
+            ),
+        ),
+        migrations.RunPython(fill_search_fields, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.0 on 2026-10-18 10:50
+
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from app.utils.name_templates import get_zone
+
+# activities so far, rounded the same way as ActivityRollupQuerySet.tally
+BACKFILL_ROLLUPS = """
+INSERT INTO app_activityrollup (user_id, item_type_id, period, finished, rating_bucket, count, rating_sum)
+SELECT a.user_id, i.item_type_id,
+       date_trunc('month', coalesce(a.end_time, a.start_time, a.created) AT TIME ZONE %s)::date,
+       a.finished, CASE WHEN a.rating IS NOT NULL THEN least(floor(a.rating * 10), 9) END, count(*), coalesce(sum(a.rating), 0)
+FROM app_activity a
+JOIN app_item i ON i.id = a.item_id
+WHERE a.user_id = ANY(%s)
+GROUP BY 1, 2, 3, 4, 5
+"""
+
+
+def backfill_rollups(apps, schema_editor):
+    User = apps.get_model("app", "User")
+    # users by the zone their months are counted in, which get_zone settles as rollup_key does
+    zones = defaultdict(list)
+    for user_id, user_settings in User.objects.values_list("id", "settings"):
+        tz_name = (user_settings or {}).get("displayTimezone", "UTC")
+        zones[get_zone(tz_name).key].append(user_id)
+    for zone, user_ids in zones.items():
+        schema_editor.execute(BACKFILL_ROLLUPS, [zone, user_ids])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0021_user_search_fields"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActivityRollup",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("period", models.DateField()),
+                ("finished", models.BooleanField()),
+                ("rating_bucket", models.SmallIntegerField(null=True)),
+                ("count", models.IntegerField(default=0)),
+                ("rating_sum", models.FloatField(default=0)),
+                (
+                    "item_type",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="app.itemtype"
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="activityrollup",
+            constraint=models.UniqueConstraint(
+                fields=("user", "item_type", "period", "finished", "rating_bucket"),
+                name="unique_activity_rollup",
+                nulls_distinct=False,
+            ),
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
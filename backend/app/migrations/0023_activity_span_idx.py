@@ -0,0 +1,43 @@
+# Generated by Django 5.0 on 2026-10-18 10:53
+
+import app.models
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0022_activityrollup"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="activity",
+            index=django.contrib.postgres.indexes.GistIndex(
+                models.F("user"),
+                app.models.TsTzRange(
+                    django.db.models.functions.comparison.Coalesce(
+                        "start_time", "end_time", "created"
+                    ),
+                    models.Case(
+                        models.When(
+                            end_time__isnull=False,
+                            then=django.db.models.functions.comparison.Greatest(
+                                "end_time", "start_time"
+                            ),
+                        ),
+                        models.When(
+                            finished=True,
+                            then=django.db.models.functions.comparison.Coalesce(
+                                "start_time", "end_time", "created"
+                            ),
+                        ),
+                        default=None,
+                    ),
+                    models.Value("[]"),
+                ),
+                name="activity_span_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0023_activity_span_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="item",
+            name="icon_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name="itemtype",
+            name="icon_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
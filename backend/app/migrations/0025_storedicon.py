@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-18 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("app", "0024_icon_variants"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="StoredIcon",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("name", models.TextField(unique=True)),
+                ("variants", models.JSONField(blank=True, default=dict)),
+                ("refcount", models.IntegerField(default=0)),
+                ("created", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
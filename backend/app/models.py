@@ -1,21 +1,41 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
+import copy
 import datetime
-import re
-from functools import reduce
+import json
+from typing import Any, Iterable
 from django.core.validators import MaxValueValidator, MinValueValidator
 
-from django.db import models
+from django.db import connection, models, transaction
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db.models.fields import EmailField, DateTimeField, TextField, BooleanField
+from django.db.models import Avg, Case, Count, F, Max, Sum, When
+from django.db.models.expressions import RawSQL
+from django.db.models.query import ModelIterable
 from django.db.models.fields.json import JSONField
-from django.contrib.postgres.fields import ArrayField
+from django.db.models.functions import (
+    Coalesce,
+    Floor,
+    Greatest,
+    Least,
+    TruncMonth,
+    Upper,
+)
+from django.contrib.postgres.aggregates import ArrayAgg, BoolOr
+from django.contrib.postgres.fields import ArrayField, DateTimeRangeField
+from django.contrib.postgres.indexes import GinIndex, GistIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.backends.postgresql.psycopg_any import DateTimeTZRange
 
 from django.utils import timezone
 from app.utils.common_utils import TOKEN_REGEX, gen_token
+from app.utils.name_templates import NameTemplate, compile_name_schema, get_zone
+from app.utils.schema_validation import InfoValidator, get_info_validator
+from app.utils.search import item_search_document, item_search_text
 from app.managers import UserManager
 from backend.env import WEB_HOST
 
-from dateutil.tz import gettz
+
+
 class TimeStampedModel(models.Model):
     class Meta:
         abstract = True
@@ -29,6 +49,32 @@ class TimeStampedModel(models.Model):
     )
 
 
+class LoadedValuesMixin:
+    """Remembers the values of `tracked_fields` a row was loaded with, so save() can tell what changed"""
+
+    tracked_fields: tuple[str, ...] = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_values()
+        return instance
+
+    def remember_loaded_values(self):
+        self._loaded_values = {
+            f: copy.deepcopy(self.__dict__[f])
+            for f in self.tracked_fields
+            if f in self.__dict__
+        }
+
+    def has_changed(self, field: str) -> bool:
+        loaded = getattr(self, "_loaded_values", {})
+        if field not in loaded:
+            # unsaved, or the field was deferred - assume the worst
+            return True
+        return loaded[field] != getattr(self, field)
+
+
 def _gen_user_token():
     return f"U_{gen_token()}"
 
@@ -40,7 +86,9 @@ def _default_user_settings():
     }
 
 
-class User(AbstractBaseUser, PermissionsMixin, TimeStampedModel):
+class User(LoadedValuesMixin, AbstractBaseUser, PermissionsMixin, TimeStampedModel):
+    tracked_fields = ("settings",)
+
     USERNAME_FIELD = "email"
     EMAIL_FIELD = "email"
     REQUIRED_FIELDS = []
@@ -51,20 +99,106 @@ class User(AbstractBaseUser, PermissionsMixin, TimeStampedModel):
     token: "TextField[str, str]" = TextField(default=_gen_user_token, unique=True)
     is_staff: "BooleanField[bool, bool]" = BooleanField(default=False)
     settings = JSONField(default=_default_user_settings, blank=True)
+    # bumped on every write to the user's items and item types, so clients can cache what's built from them
+    library_version = models.BigIntegerField(default=0, editable=False)
+    # and the same for just item types, activities and settings, see app.api.conditional
+    item_type_version = models.BigIntegerField(default=0, editable=False)
+    activity_version = models.BigIntegerField(default=0, editable=False)
+    settings_version = models.BigIntegerField(default=0, editable=False)
+    # when any of the versions last went up
+    versions_modified = DateTimeField(default=timezone.now, editable=False)
+    # union of the required info fields of the user's item types, see refresh_search_fields
+    search_fields = ArrayField(TextField(), default=list, blank=True, editable=False)
 
     objects = UserManager()
 
+    VERSION_KINDS = ("library", "item_type", "activity", "settings")
+
     @staticmethod
     def gen_token():
         return _gen_user_token()
 
+    @classmethod
+    def version_fields(cls) -> set[str]:
+        return {f"{kind}_version" for kind in cls.VERSION_KINDS} | {"versions_modified"}
+
+    @property
+    def display_timezone(self) -> str:
+        return self.settings.get("displayTimezone", "UTC")
+
+    def save(self, *args, **kwargs):
+        old_settings = getattr(self, "_loaded_values", {}).get("settings")
+        if not self._state.adding and not args and "update_fields" not in kwargs:
+            # the versions only go up through bump_versions - don't write back a stale copy
+            kwargs["update_fields"] = [
+                f.name
+                for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.version_fields()
+            ]
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "settings" not in update_fields:
+            # the settings weren't written, so nothing that follows them has changed
+            return
+        if old_settings is not None and old_settings != self.settings:
+            User.objects.bump_versions(self.pk, "settings")
+        if (
+            old_settings is not None
+            and old_settings.get("displayTimezone", "UTC") != self.display_timezone
+        ):
+            # time fields in item names are rendered in the user's timezone
+            for item_type in self.itemtype_set.all():
+                if item_type.name_template.uses_time:
+                    item_type.refresh_item_names()
+            # and so are the months activities are counted in
+            ActivityRollup.objects.rebuild(self)
+        self.remember_loaded_values()
+
+
+MEDIA_HOST = WEB_HOST if WEB_HOST.startswith("http") else f"https://{WEB_HOST}"
+
+
+class IconVariantsMixin:
+    """URLs of the resized copies of `icon` made by app.utils.icons, falling back to the original until they're made"""
+
+    def icon_url_for(self, size: int) -> str:
+        variant = self.icon_variants.get(str(size))
+        if not variant:
+            return self.icon_url
+        return f"{MEDIA_HOST}{self.icon.storage.url(variant)}"
+
+    @property
+    def icon_url_32(self) -> str:
+        return self.icon_url_for(32)
+
+    @property
+    def icon_url_64(self) -> str:
+        return self.icon_url_for(64)
+
+    @property
+    def icon_url_256(self) -> str:
+        return self.icon_url_for(256)
+
 
 def _item_type_icon_upload_helper(instance, filename):
     now = datetime.datetime.now()
     return f"{instance.user.pk}/{now.isoformat()}/{filename}"
 
 
-class ItemType(TimeStampedModel):
+class ItemTypeQuerySet(models.QuerySet):
+    def user_name_templates(self, user_id: int) -> list[NameTemplate]:
+        """The compiled name schemas of the user's item types"""
+        return [
+            compile_name_schema(schema)
+            for schema in self.filter(user_id=user_id).values_list(
+                "name_schema", flat=True
+            )
+        ]
+
+
+class ItemType(IconVariantsMixin, LoadedValuesMixin, TimeStampedModel):
+    tracked_fields = ("name_schema", "item_schema")
+
     slug = models.SlugField(max_length=200, unique=True)
     name = models.TextField()
     item_schema = JSONField(default=dict, blank=True)
@@ -80,6 +214,10 @@ class ItemType(TimeStampedModel):
     icon = models.ImageField(
         upload_to=_item_type_icon_upload_helper, null=True, blank=True
     )
+    # size -> storage name of the WebP copies of icon, see IconVariantsMixin
+    icon_variants = JSONField(default=dict, blank=True, editable=False)
+
+    objects = ItemTypeQuerySet.as_manager()
 
     @property
     def icon_url(self):
@@ -88,6 +226,62 @@ class ItemType(TimeStampedModel):
     def __str__(self) -> str:
         return self.slug
 
+    @property
+    def name_template(self) -> NameTemplate:
+        # compiled plans are cached on the schema text, so an edited schema is a fresh plan
+        return compile_name_schema(self.name_schema)
+
+    @property
+    def info_validator(self) -> InfoValidator:
+        # compiled once per item type, and again only when item_schema changes
+        return get_info_validator(self)
+
+    @property
+    def required_fields(self) -> set[str]:
+        return set(self.item_schema.get("required", []))
+
+    def save(self, *args, **kwargs):
+        schema_changed = self.pk is not None and self.has_changed("name_schema")
+        loaded_schema = getattr(self, "_loaded_values", {}).get("item_schema", {})
+        search_fields_changed = self.required_fields != set(
+            loaded_schema.get("required", [])
+        )
+        super().save(*args, **kwargs)
+        if schema_changed:
+            self.refresh_item_names()
+        if search_fields_changed:
+            Item.objects.refresh_search_index(
+                self.user_id, refresh_search_fields(self.user_id)
+            )
+        User.objects.bump_versions(self.user_id, "library", "item_type")
+        self.remember_loaded_values()
+
+    def delete(self, *args, **kwargs):
+        # items of other types whose parents go with this one's
+        orphans = list(
+            Item.objects.filter(parent__item_type=self)
+            .exclude(item_type=self)
+            .values_list("pk", flat=True)
+        )
+        res = super().delete(*args, **kwargs)
+        Item.objects.refresh_names(self.user_id, orphans)
+        if self.required_fields:
+            Item.objects.refresh_search_index(
+                self.user_id, refresh_search_fields(self.user_id)
+            )
+        User.objects.bump_versions(self.user_id, "library", "item_type", "activity")
+        return res
+
+    def refresh_item_names(self):
+        template = self.name_template
+        items = list(Item.objects.filter(item_type=self).for_renaming([template]))
+        for item in items:
+            item.name = template.render(item, item.user.display_timezone)
+        Item.objects.bulk_update(items, ["name"], batch_size=1000)
+        User.objects.bump_library_version(self.user_id)
+        renamed = Item.objects.renamed([i.pk for i in items])
+        renamed.refresh_search_index(self.user_id)
+
     @staticmethod
     def update_defaults():
         from app.schemas import default_item_types
@@ -102,17 +296,227 @@ class ItemType(TimeStampedModel):
 def _gen_item_token():
     return f"I_{gen_token()}"
 
+
 def _item_icon_upload_helper(instance, filename):
     now = datetime.datetime.now()
     return f"{instance.user.pk}/item/{now.isoformat()}/{filename}"
 
 
+def refresh_search_fields(user_id: int) -> list[str]:
+    """
+    Store the info fields searched for a user - everything required by any of their item types.
+    Item types call this whenever their required fields change, so nothing else scans the schemas
+    """
+    fields = set()
+    for schema in ItemType.objects.filter(user_id=user_id).values_list(
+        "item_schema", flat=True
+    ):
+        fields |= set(schema.get("required", []))
+    search_fields = sorted(f for f in fields if f)
+    User.objects.filter(pk=user_id).update(search_fields=search_fields)
+    return search_fields
+
+
+class ArrayElement(models.Func):
+    """One element of a postgres array, counting from 1"""
+
+    template = "(%(expressions)s)[%(index)s]"
+    output_field = TextField()
+
+    def __init__(self, expression, index: int, **extra):
+        super().__init__(expression, index=int(index), **extra)
+
+
+class WithAncestorsIterable(ModelIterable):
+    """Items as ModelIterable makes them, with attach_ancestors run over each chunk, see with_ancestors"""
+
+    def __iter__(self):
+        # a chunk at a time for iterator() and aiterator(), everything at once otherwise
+        chunk_size = self.chunk_size if self.chunked_fetch else None
+        items = []
+        for item in super().__iter__():
+            items.append(item)
+            if chunk_size and len(items) >= chunk_size:
+                attach_ancestors(items)
+                yield from items
+                items = []
+        attach_ancestors(items)
+        yield from items
+
+
+class ItemQuerySet(models.QuerySet):
+    def refresh_search_index(
+        self, user_id: int, search_fields: list[str] | None = None
+    ) -> int:
+        """Rebuild search_document and search_text for this user's items in the queryset"""
+        if search_fields is None:
+            search_fields = User.objects.values_list("search_fields", flat=True).get(
+                pk=user_id
+            )
+        return self.filter(user_id=user_id).update(
+            search_document=item_search_document(self.model),
+            search_text=item_search_text(search_fields),
+        )
+
+    def renamed(self, pks: list[int]) -> "ItemQuerySet":
+        """The items whose search documents read the names of `pks`"""
+        return self.filter(models.Q(pk__in=pks) | models.Q(parent_id__in=pks))
+
+    def for_renaming(self, templates: Iterable[NameTemplate]) -> "ItemQuerySet":
+        """
+        Only what rendering names with `templates` reads - the columns and ancestors they use,
+        the item type's schema and the user's timezone
+        """
+        templates = list(templates)
+        paths = {t.related_path for t in templates if t.related_path}
+        columns = {c for t in templates for c in t.columns}
+        return self.select_related("item_type", "user", *paths).only(
+            "item_type__name_schema", "user__settings", *columns
+        )
+
+    def refresh_names(self, user_id: int, pks: list[int]) -> None:
+        """Re-render the names of the user's items `pks`, and of the descendants that read them"""
+        if not pks:
+            return
+        templates = ItemType.objects.user_name_templates(user_id)
+        items = list(self.filter(user_id=user_id, pk__in=pks).for_renaming(templates))
+        for item in items:
+            item.name = item.render_name()
+        self.bulk_update(items, ["name"], batch_size=1000)
+        self.renamed([i.pk for i in items]).refresh_search_index(user_id)
+        self.refresh_names_below(user_id, [i.pk for i in items])
+
+    def refresh_names_below(self, user_id: int, parent_ids: list[int]) -> None:
+        """Re-render the names of descendants of `parent_ids` whose name schema reaches up to them"""
+        templates = ItemType.objects.user_name_templates(user_id)
+        max_depth = max((t.max_depth for t in templates), default=0)
+        seen = set(parent_ids)
+        depth = 1
+        while parent_ids and depth <= max_depth:
+            children = [
+                c
+                for c in self.filter(parent_id__in=parent_ids).for_renaming(templates)
+                if c.pk not in seen
+            ]
+            stale = [
+                c for c in children if c.item_type.name_template.max_depth >= depth
+            ]
+            for child in stale:
+                child.name = child.render_name()
+            self.bulk_update(stale, ["name"], batch_size=1000)
+            self.renamed([c.pk for c in stale]).refresh_search_index(user_id)
+            parent_ids = [c.pk for c in children]
+            seen.update(parent_ids)
+            depth += 1
 
-class Item(TimeStampedModel):
-    name_template_regex = re.compile(r"{{([\w\-\.!%]+)}}")
-    parent_stripper_regex = re.compile(r"(parent\.)*(.*)")
+    def ancestors_of(self, pks: list[int]) -> "ItemQuerySet":
+        """Everything above the items `pks` - parents, their parents and so on - in one recursive query"""
+        table = self.model._meta.db_table
+        # UNION rather than UNION ALL, so a loop of parents ends once every row has been seen
+        ancestors = RawSQL(
+            "WITH RECURSIVE ancestors(id, parent_id) AS ("
+            f"SELECT id, parent_id FROM {table} WHERE id IN "
+            f"(SELECT parent_id FROM {table} WHERE id = ANY(%s)) "
+            f"UNION SELECT i.id, i.parent_id FROM {table} i "
+            "JOIN ancestors a ON i.id = a.parent_id"
+            ") SELECT id FROM ancestors",
+            [list(pks)],
+        )
+        return self.filter(pk__in=ancestors)
+
+    def descendants_of(self, pks: list[int]) -> "ItemQuerySet":
+        """Everything below the items `pks` - children, their children and so on - in one recursive query"""
+        table = self.model._meta.db_table
+        descendants = RawSQL(
+            "WITH RECURSIVE descendants(id) AS ("
+            f"SELECT id FROM {table} WHERE parent_id = ANY(%s) "
+            f"UNION SELECT i.id FROM {table} i "
+            "JOIN descendants d ON i.parent_id = d.id"
+            ") SELECT id FROM descendants",
+            [list(pks)],
+        )
+        return self.filter(pk__in=descendants)
+
+    def at_depth(self, user_id: int, depth: int) -> "ItemQuerySet":
+        """The user's items `depth` parents below the top of their tree, in one recursive query"""
+        table = self.model._meta.db_table
+        levels = RawSQL(
+            "WITH RECURSIVE levels(id, depth) AS ("
+            f"SELECT id, 0 FROM {table} WHERE user_id = %s AND parent_id IS NULL "
+            f"UNION ALL SELECT i.id, l.depth + 1 FROM {table} i "
+            "JOIN levels l ON i.parent_id = l.id WHERE l.depth < %s"
+            ") SELECT id FROM levels WHERE depth = %s",
+            [user_id, depth, depth],
+        )
+        return self.filter(pk__in=levels)
+
+    def outside_trees(self, user_id: int) -> "ItemQuerySet":
+        """
+        The user's items with no way up to the top of a tree - those whose parents loop, and anything
+        below them - which at_depth never reaches
+        """
+        table = self.model._meta.db_table
+        in_trees = RawSQL(
+            "WITH RECURSIVE in_trees(id) AS ("
+            f"SELECT id FROM {table} WHERE user_id = %s AND parent_id IS NULL "
+            f"UNION SELECT i.id FROM {table} i "
+            "JOIN in_trees t ON i.parent_id = t.id"
+            ") SELECT id FROM in_trees",
+            [user_id],
+        )
+        return self.filter(user_id=user_id).exclude(pk__in=in_trees)
+
+    def with_activity_stats(self) -> "ItemQuerySet":
+        """
+        Each item's activity_count, whether any of them is finished, their average_rating and the
+        token and time of the latest - grouped in the same query, not looked up per item
+        """
+        latest = Coalesce(
+            "activity__end_time", "activity__start_time", "activity__created"
+        )
+        return self.annotate(
+            activity_count=Count("activity"),
+            any_finished=Coalesce(BoolOr("activity__finished"), False),
+            average_rating=Avg("activity__rating"),
+            latest_activity_at=Max(latest),
+            latest_activity_token=ArrayElement(
+                ArrayAgg("activity__token", ordering=latest.desc(nulls_last=True)),
+                1,
+            ),
+        )
+
+    def with_ancestors(self) -> "ItemQuerySet":
+        """
+        Items that come with their ancestors, from one more query however deep they go (one per chunk
+        with iterator()). Item.ancestors and the parent chain are then read without going back
+        to the database
+        """
+        clone = self._chain()
+        clone._iterable_class = WithAncestorsIterable
+        return clone
+
+
+class Item(IconVariantsMixin, LoadedValuesMixin, TimeStampedModel):
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            GinIndex(fields=["search_document"], name="item_search_idx"),
+            GistIndex(
+                fields=["user", "search_text"],
+                name="item_search_text_trgm_idx",
+                opclasses=["gist_int8_ops", "gist_trgm_ops"],
+            ),
+            models.Index(
+                F("user"),
+                OpClass(Upper("name"), name="text_pattern_ops"),
+                name="item_name_prefix_idx",
+            ),
+        ]
+
+    tracked_fields = ("info", "parent_id", "notes", "name")
 
     token: "TextField[str, str]" = TextField(default=_gen_item_token, unique=True)
+    # rendered from item_type.name_schema on save, see render_name
+    name: "TextField[str, str]" = TextField(blank=True, db_index=True)
     info = JSONField(default=dict, blank=True)
     rating: "models.FloatField[float, float]" = models.FloatField(
         null=True, blank=True, validators=[MinValueValidator(0), MaxValueValidator(1)]
@@ -127,6 +531,14 @@ class Item(TimeStampedModel):
     icon = models.ImageField(
         upload_to=_item_icon_upload_helper, null=True, blank=True
     )
+    # size -> storage name of the WebP copies of icon, see IconVariantsMixin
+    icon_variants = JSONField(default=dict, blank=True, editable=False)
+    # name, info, parent name and notes - maintained on save, see ItemQuerySet
+    search_document = SearchVectorField(null=True, editable=False)
+    # name and key info values, for trigram matching
+    search_text: "TextField[str, str]" = TextField(blank=True, editable=False)
+
+    objects = ItemQuerySet.as_manager()
 
     @property
     def icon_url(self):
@@ -138,64 +550,233 @@ class Item(TimeStampedModel):
             return ""
         return self.parent.name
 
-    def _parse_time_name_field(self, spec, val):
-        print(self.user.settings)
-
-        tz = self.user.settings.get('displayTimezone', 'UTC')
-        tz_local_val = val.astimezone(gettz(tz))
+    @property
+    def ancestors(self) -> list["Item"]:
+        """Parent first, root last. A query unless they came with ItemQuerySet.with_ancestors"""
+        if not hasattr(self, "_ancestors"):
+            attach_ancestors([self])
+        return self._ancestors
 
-        if "!" in spec:
-            format_string = spec.split("!")[1]
-          
-            
-            return tz_local_val.strftime(format_string)
-        return tz_local_val.isoformat()
+    def render_name(self) -> str:
+        return self.item_type.name_template.render(self, self.user.display_timezone)
 
-    @property
-    def name(self):
-        name_fields = re.findall(self.name_template_regex, self.item_type.name_schema)
-        name = self.item_type.name_schema
-        time_fields = ["created"]
-
-        for field in name_fields:
-            (parent_accessor, actual_field) = re.search(
-                self.parent_stripper_regex, field
-            ).groups()
-            val = ""
-            if not parent_accessor:
-                if actual_field.split("!")[0] in time_fields:
-                    val = self._parse_time_name_field(actual_field, self.created)
-                else:
-                    val = self.info.get(actual_field, "")
-            else:
-                ancestor = reduce(
-                    lambda memo, next_: getattr(memo, next_, None),
-                    parent_accessor.strip(".").split("."),
-                    self,
-                )
-                if ancestor:
-                    if actual_field.split("!")[0] in time_fields:
-                        val = self._parse_time_name_field(
-                            actual_field, ancestor.created
-                        )
-                    else:
-                        val = ancestor.info.get(actual_field, "")
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        inputs_changed = self.has_changed("info") or self.has_changed("parent_id")
+        old_info = {}
+        if not adding:
+            old_info = getattr(self, "_loaded_values", {}).get("info")
+            if old_info is None:
+                old_info = Item.objects.values_list("info", flat=True).get(pk=self.pk)
+        if self.has_changed("parent_id"):
+            self.__dict__.pop("_ancestors", None)
+        if inputs_changed:
+            self.name = self.render_name()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = {*kwargs["update_fields"], "name"}
+        super().save(*args, **kwargs)
+        if adding and self.item_type.name_template.uses_time:
+            # `created` is only filled in by the insert
+            self.name = self.render_name()
+            Item.objects.filter(pk=self.pk).update(name=self.name)
+        elif inputs_changed:
+            self.refresh_descendant_names()
+        if inputs_changed or self.has_changed("notes"):
+            Item.objects.filter(pk=self.pk).refresh_search_index(self.user_id)
+        if not adding and self.has_changed("name"):
+            # children index their parent's name
+            Item.objects.filter(parent_id=self.pk).refresh_search_index(self.user_id)
+        if old_info != self.info:
+            deltas = suggestion_values(self.info)
+            deltas.subtract(suggestion_values(old_info))
+            AutocompleteSuggestion.objects.record(self.user_id, self.item_type_id, deltas)
+        User.objects.bump_library_version(self.user_id)
+        self.remember_loaded_values()
 
-            name = name.replace("{{" + field + "}}", str(val))
+    def delete(self, *args, **kwargs):
+        deltas = Counter()
+        deltas.subtract(suggestion_values(self.info))
+        AutocompleteSuggestion.objects.record(self.user_id, self.item_type_id, deltas)
+        # the activities go with the item, without their delete()
+        rollups = ActivityRollup.objects.tally(
+            self.activity_set.all(), self.user.display_timezone
+        )
+        # the children stay, without a parent to name themselves after
+        orphans = list(
+            Item.objects.filter(parent_id=self.pk).values_list("pk", flat=True)
+        )
+        user_id = self.user_id
+        res = super().delete(*args, **kwargs)
+        ActivityRollup.objects.record(rollups.negated())
+        Item.objects.refresh_names(user_id, orphans)
+        User.objects.bump_versions(self.user_id, "library", "activity")
+        return res
 
-        return name
+    def refresh_descendant_names(self):
+        """Re-render the names of descendants whose name schema reaches up to this item"""
+        Item.objects.refresh_names_below(self.user_id, [self.pk])
 
     def __str__(self) -> str:
         return f"Item<{self.token}> of type {self.item_type}"
 
 
+def attach_ancestors(items: list[Item]) -> None:
+    """
+    Fetch the ancestors of `items` in one query, and put them on each as Item.ancestors
+    and as its parent, its parent's parent and so on
+    """
+    if not items:
+        return
+    found = {}
+    if any(item.parent_id for item in items):
+        found = {a.pk: a for a in Item.objects.ancestors_of([i.pk for i in items])}
+    for item in items:
+        chain = []
+        child, parent_id = item, item.parent_id
+        while parent_id in found and found[parent_id] not in chain:
+            parent = found[parent_id]
+            Item.parent.field.set_cached_value(child, parent)
+            chain.append(parent)
+            child, parent_id = parent, parent.parent_id
+        item._ancestors = chain
+
+
+def suggestion_values(info: dict[str, Any]) -> Counter[tuple[str, str]]:
+    """(field, json encoded value) for every info value worth suggesting"""
+    return Counter(
+        (field, json.dumps(value))
+        for field, value in info.items()
+        if isinstance(value, (str, int, float))
+        and not isinstance(value, bool)
+        and value != ""
+    )
+
+
+class AutocompleteSuggestionQuerySet(models.QuerySet):
+    def record(
+        self, user_id: int, item_type_id: int, deltas: Counter[tuple[str, str]]
+    ):
+        """Add `deltas` to the usage counts, creating and dropping suggestions as needed"""
+        rows = [(key, count) for key, count in deltas.items() if count]
+        table = self.model._meta.db_table
+        for start in range(0, len(rows), 1000):
+            chunk = rows[start : start + 1000]
+            params = []
+            for (field, value), count in chunk:
+                decoded = json.loads(value)
+                label = decoded if isinstance(decoded, str) else value
+                params += [user_id, item_type_id, field, value, label, count]
+            values = ", ".join(["(%s, %s, %s, %s::jsonb, %s, %s)"] * len(chunk))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} (user_id, item_type_id, field, value, label, count) "
+                    f"VALUES {values} "
+                    "ON CONFLICT (item_type_id, field, value) "
+                    f"DO UPDATE SET count = {table}.count + EXCLUDED.count",
+                    params,
+                )
+        if any(count < 0 for _, count in rows):
+            self.filter(
+                item_type_id=item_type_id,
+                field__in={field for (field, _), count in rows if count < 0},
+                count__lte=0,
+            ).delete()
+
+
+class AutocompleteSuggestion(models.Model):
+    """Distinct info values per item type field, with how many items use them"""
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["item_type", "field", "value"], name="unique_suggestion"
+            )
+        ]
+        indexes = [
+            models.Index(
+                F("item_type"),
+                F("field"),
+                OpClass(Upper("label"), name="text_pattern_ops"),
+                name="suggestion_prefix_idx",
+            )
+        ]
+
+    user: "models.ForeignKey[User, User]" = models.ForeignKey(
+        User, on_delete=models.CASCADE
+    )
+    item_type = models.ForeignKey(ItemType, on_delete=models.CASCADE)
+    field: "TextField[str, str]" = TextField()
+    value = JSONField()
+    # the value as text, for prefix matching
+    label: "TextField[str, str]" = TextField()
+    count: "models.IntegerField[int, int]" = models.IntegerField(default=0)
+
+    objects = AutocompleteSuggestionQuerySet.as_manager()
+
+
 def _gen_activity_token():
     return f"A_{gen_token()}"
 
 
-class Activity(TimeStampedModel):
+class TsTzRange(models.Func):
+    function = "TSTZRANGE"
+    output_field = DateTimeRangeField()
+
+
+def activity_span() -> TsTzRange:
+    """
+    The time an activity covers, as an inclusive tstzrange: from its start (or end, or creation)
+    to its end. Unfinished activities without an end are ongoing, so the range is open;
+    finished ones without an end are just the one moment.
+    The activity_span_idx index is on exactly this expression, keep them in step
+    """
+    lower = Coalesce("start_time", "end_time", "created")
+    return TsTzRange(
+        lower,
+        Case(
+            When(end_time__isnull=False, then=Greatest("end_time", "start_time")),
+            When(finished=True, then=lower),
+            default=None,
+        ),
+        models.Value("[]"),
+    )
+
+
+class ActivityQuerySet(models.QuerySet):
+    def overlapping(
+        self, start: datetime.datetime | None, end: datetime.datetime | None
+    ) -> "ActivityQuerySet":
+        """Activities whose span meets [start, end), None being unbounded"""
+        return self.alias(span=activity_span()).filter(
+            span__overlap=DateTimeTZRange(start, end, "[)")
+        )
+
+    def concurrent_with(self, activity: "Activity") -> "ActivityQuerySet":
+        """The user's other activities whose spans overlap `activity`'s"""
+        span = (
+            Activity.objects.filter(pk=activity.pk)
+            .annotate(span=activity_span())
+            .values_list("span", flat=True)
+        )
+        return (
+            self.filter(user_id=activity.user_id)
+            .exclude(pk=activity.pk)
+            .alias(span=activity_span())
+            .filter(span__overlap=models.Subquery(span))
+        )
+
+
+class Activity(LoadedValuesMixin, TimeStampedModel):
     class Meta:
         verbose_name_plural = "Activities"
+        indexes = [
+            # btree_gist lets the user id share the index with the range
+            GistIndex(F("user"), activity_span(), name="activity_span_idx"),
+        ]
+
+    objects = ActivityQuerySet.as_manager()
+
+    tracked_fields = ("item_id", "start_time", "end_time", "finished", "rating")
 
     token: "TextField[str, str]" = TextField(default=_gen_activity_token, unique=True)
 
@@ -224,3 +805,300 @@ class Activity(TimeStampedModel):
 
     def __str__(self):
         return f"Activity <{self.token}> for {self.item.name}"
+
+    def save(self, *args, **kwargs):
+        old = None
+        if self.pk is not None:
+            old = getattr(self, "_loaded_values", {})
+            if len(old) < len(self.tracked_fields):
+                old = (
+                    Activity.objects.filter(pk=self.pk)
+                    .values(*self.tracked_fields)
+                    .first()
+                )
+        super().save(*args, **kwargs)
+        new = {f: getattr(self, f) for f in self.tracked_fields}
+        if old != new:
+            tz = self.user.display_timezone
+            deltas = RollupDeltas()
+            if old is not None:
+                item_type_id = (
+                    self.item.item_type_id
+                    if old["item_id"] == self.item_id
+                    else Item.objects.values_list("item_type_id", flat=True).get(
+                        pk=old["item_id"]
+                    )
+                )
+                deltas.add(
+                    rollup_key(self.user_id, item_type_id, tz, self.created, **old),
+                    -1,
+                    old["rating"],
+                )
+            deltas.add(
+                rollup_key(self.user_id, self.item.item_type_id, tz, self.created, **new),
+                1,
+                self.rating,
+            )
+            ActivityRollup.objects.record(deltas)
+        User.objects.bump_versions(self.user_id, "activity")
+        self.remember_loaded_values()
+
+    def delete(self, *args, **kwargs):
+        deltas = RollupDeltas()
+        deltas.add(
+            rollup_key(
+                self.user_id,
+                self.item.item_type_id,
+                self.user.display_timezone,
+                self.created,
+                **{f: getattr(self, f) for f in self.tracked_fields},
+            ),
+            -1,
+            self.rating,
+        )
+        res = super().delete(*args, **kwargs)
+        ActivityRollup.objects.record(deltas)
+        User.objects.bump_versions(self.user_id, "activity")
+        return res
+
+
+ROLLUP_RATING_BUCKETS = 10
+
+
+def rollup_key(
+    user_id: int,
+    item_type_id: int,
+    tz_name: str,
+    created: datetime.datetime,
+    *,
+    start_time: datetime.datetime | None,
+    end_time: datetime.datetime | None,
+    finished: bool,
+    rating: float | None,
+    **_,
+) -> tuple:
+    """The ActivityRollup row an activity counts towards, see ActivityRollupQuerySet.rebuild for the SQL twin"""
+    when = end_time or start_time or created
+    period = when.astimezone(get_zone(tz_name)).date()
+    return (
+        user_id,
+        item_type_id,
+        period.replace(day=1),
+        finished,
+        None
+        if rating is None
+        else min(int(rating * ROLLUP_RATING_BUCKETS), ROLLUP_RATING_BUCKETS - 1),
+    )
+
+
+class RollupDeltas(defaultdict):
+    """rollup key -> [count change, rating sum change]"""
+
+    def __init__(self):
+        super().__init__(lambda: [0, 0.0])
+
+    def add(self, key: tuple, sign: int, rating: float | None):
+        self[key][0] += sign
+        self[key][1] += sign * (rating or 0)
+
+    def negated(self) -> "RollupDeltas":
+        negated = RollupDeltas()
+        for key, (count, rating_sum) in self.items():
+            negated[key] = [-count, -rating_sum]
+        return negated
+
+
+class ActivityRollupQuerySet(models.QuerySet):
+    def record(self, deltas: RollupDeltas):
+        """Add `deltas` to their rows, creating and dropping rows as needed"""
+        rows = [(key, d) for key, d in deltas.items() if d[0] or d[1]]
+        table = self.model._meta.db_table
+        for start in range(0, len(rows), 1000):
+            chunk = rows[start : start + 1000]
+            params = []
+            for key, (count, rating_sum) in chunk:
+                params += [*key, count, rating_sum]
+            values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} "
+                    "(user_id, item_type_id, period, finished, rating_bucket, count, rating_sum) "
+                    f"VALUES {values} "
+                    "ON CONFLICT ON CONSTRAINT unique_activity_rollup "
+                    f"DO UPDATE SET count = {table}.count + EXCLUDED.count, "
+                    f"rating_sum = {table}.rating_sum + EXCLUDED.rating_sum",
+                    params,
+                )
+        if any(d[0] < 0 for _, d in rows):
+            self.filter(
+                user_id__in={key[0] for key, d in rows if d[0] < 0}, count__lte=0
+            ).delete()
+
+    def tally(self, activities: models.QuerySet, tz_name: str) -> RollupDeltas:
+        """The rows `activities` add up to, counted in the database. rollup_key's SQL twin"""
+        rows = (
+            activities.annotate(
+                period=TruncMonth(
+                    Coalesce("end_time", "start_time", "created"),
+                    output_field=models.DateField(),
+                    tzinfo=get_zone(tz_name),
+                ),
+                # LEAST skips nulls, so unrated activities need keeping out of it
+                rating_bucket=Case(
+                    When(
+                        rating__isnull=False,
+                        then=Least(
+                            Floor(F("rating") * ROLLUP_RATING_BUCKETS),
+                            ROLLUP_RATING_BUCKETS - 1,
+                        ),
+                    ),
+                    output_field=models.SmallIntegerField(),
+                ),
+            )
+            .values_list(
+                "user_id", "item__item_type_id", "period", "finished", "rating_bucket"
+            )
+            .annotate(count=Count("pk"), rating_sum=Coalesce(Sum("rating"), 0.0))
+            .order_by()
+        )
+        deltas = RollupDeltas()
+        for *key, count, rating_sum in rows:
+            deltas[tuple(key)] = [count, rating_sum]
+        return deltas
+
+    def rebuild(self, user: User):
+        """Recount the user's rows from their activities, for when they've drifted"""
+        with transaction.atomic():
+            self.filter(user=user).delete()
+            self.record(
+                self.tally(Activity.objects.filter(user=user), user.display_timezone)
+            )
+
+
+class ActivityRollup(models.Model):
+    """
+    Activity counts per user, item type, month, finished and tenth of the rating range, for the stats endpoint.
+    Kept up to date by Activity.save and delete, `manage.py rebuild_stats` recounts them
+    """
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "item_type", "period", "finished", "rating_bucket"],
+                name="unique_activity_rollup",
+                nulls_distinct=False,
+            )
+        ]
+
+    user: "models.ForeignKey[User, User]" = models.ForeignKey(
+        User, on_delete=models.CASCADE
+    )
+    item_type = models.ForeignKey(ItemType, on_delete=models.CASCADE)
+    # first day of the month of the activity's end, start or creation, in the user's timezone
+    period = models.DateField()
+    finished: "BooleanField[bool, bool]" = BooleanField()
+    # 0-9, null when unrated
+    rating_bucket = models.SmallIntegerField(null=True)
+    count = models.IntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+
+    objects = ActivityRollupQuerySet.as_manager()
+
+
+class StoredIconQuerySet(models.QuerySet):
+    def acquire(self, sha256: str, name: str) -> "StoredIcon":
+        """One more user of the icon file `name`, recording it if it's new"""
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (sha256, name, variants, refcount, created) "
+                "VALUES (%s, %s, '{}', 1, now()) "
+                "ON CONFLICT (sha256) "
+                f"DO UPDATE SET refcount = {table}.refcount + 1 "
+                "RETURNING id",
+                [sha256, name],
+            )
+            (pk,) = cursor.fetchone()
+        return self.get(pk=pk)
+
+    def release(self, name: str | None) -> bool:
+        """
+        One fewer user of the icon file `name`. The last one out deletes the file
+        and its variants, once the transaction commits. False for names without a row
+        """
+        if not name:
+            return False
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET refcount = refcount - 1 WHERE name = %s "
+                "RETURNING refcount",
+                [name],
+            )
+            row = cursor.fetchone()
+        if row is None:
+            return False
+        if row[0] <= 0:
+            transaction.on_commit(lambda: self.delete_unused(name))
+        return True
+
+    def delete_unused(self, name: str) -> None:
+        """
+        Drops the icon file `name`, its variants and its row if nothing uses it any more. The row stays
+        locked until the files are gone, so an upload of the same bytes (acquire) waits and writes
+        them again rather than counting on files about to go
+        """
+        with transaction.atomic():
+            unused = (
+                self.select_for_update().filter(name=name, refcount__lte=0).first()
+            )
+            if unused is None:
+                # someone uploaded the same icon again since
+                return
+            self.filter(pk=unused.pk).delete()
+            storage = Item._meta.get_field("icon").storage
+            for file in [name, *unused.variants.values()]:
+                storage.delete(file)
+
+
+class StoredIcon(models.Model):
+    """
+    An uploaded icon, stored once under the hash of its bytes however many items and item types
+    of however many users use it. Files under icons/ never change, so they're served as immutable
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    # storage names of the original and of its resized copies, see app.utils.icons
+    name = TextField(unique=True)
+    variants = JSONField(default=dict, blank=True)
+    # Items and ItemTypes whose icon is this, see StoredIconQuerySet.acquire and release
+    refcount = models.IntegerField(default=0)
+    created = DateTimeField(auto_now_add=True)
+
+    objects = StoredIconQuerySet.as_manager()
+
+
+def release_icon(sender, instance: Item | ItemType, **kwargs):
+    """
+    post_delete receiver for Items and ItemTypes, so the ones that go in a cascade - with a user,
+    or an item type's items - give up their icon too
+    """
+    StoredIcon.objects.release(instance.icon.name)
+
+
+def _gen_api_token_key():
+    return gen_token(24)
+
+
+class ApiToken(models.Model):
+    """
+    A bearer token for the extension and mobile clients. The token itself is signed and carries
+    the user and expiry, so only revocation needs this row - see app.utils.api_tokens
+    """
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=32, unique=True, default=_gen_api_token_key)
+    name = TextField(blank=True, default="")
+    created = DateTimeField(auto_now_add=True)
+    expires = DateTimeField()
+    revoked = DateTimeField(null=True, blank=True)
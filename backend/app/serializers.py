@@ -1,22 +1,37 @@
 from os import read
 from django.db.models.base import Model
-from rest_framework.fields import CharField
+from rest_framework.fields import (
+    BooleanField,
+    CharField,
+    FloatField,
+    IntegerField,
+    SerializerMethodField,
+)
 from rest_framework.relations import SlugRelatedField
 from rest_framework.serializers import ModelSerializer
 
-from app.models import Activity, Item, ItemType, User
+from app.models import Activity, ApiToken, Item, ItemType, User
+from app.utils.request_timing import timed
 
 
-class ItemTypeListSerializer(ModelSerializer):
-    icon_url = CharField(read_only=True)
+class TimedModelSerializer(ModelSerializer):
+    """Adds its time to the request's Server-Timing, see ServerTimingMiddleware"""
+
+    def to_representation(self, instance):
+        with timed("serialize"):
+            return super().to_representation(instance)
+
+
+class ItemTypeListSerializer(TimedModelSerializer):
+    icon_url = CharField(source="icon_url_32", read_only=True)
 
     class Meta:
         model = ItemType
         fields = ["slug", "name", "parent_slug", "icon_url"]
 
 
-class ItemTypeSerializer(ModelSerializer):
-    icon_url = CharField(read_only=True)
+class ItemTypeSerializer(TimedModelSerializer):
+    icon_url = CharField(source="icon_url_256", read_only=True)
 
     class Meta:
         model = ItemType
@@ -31,9 +46,9 @@ class ItemTypeSerializer(ModelSerializer):
         ]
 
 
-class ActivityListSerializer(ModelSerializer):
-    item_type_icon_url = CharField(source="item.item_type.icon_url", read_only=True)
-    item_icon_url = CharField(source="item.icon_url", read_only=True)
+class ActivityListSerializer(TimedModelSerializer):
+    item_type_icon_url = CharField(source="item.item_type.icon_url_64", read_only=True)
+    item_icon_url = CharField(source="item.icon_url_64", read_only=True)
     item_type = CharField(source="item.item_type.slug")
     item_type_name = CharField(source="item.item_type.name")
     item_name = CharField(source="item.name")
@@ -55,8 +70,8 @@ class ActivityListSerializer(ModelSerializer):
         ]
 
 
-class ActivityDetailSerializer(ModelSerializer):
-    icon_url = CharField(source="item.item_type.icon_url", read_only=True)
+class ActivityDetailSerializer(TimedModelSerializer):
+    icon_url = CharField(source="item.item_type.icon_url_256", read_only=True)
     item = SlugRelatedField(slug_field="token", queryset=Item.objects.all())
     item_type = CharField(source="item.item_type.slug")
     token = CharField(read_only=True)
@@ -78,11 +93,20 @@ class ActivityDetailSerializer(ModelSerializer):
         ]
 
 
-class ItemListSerializer(ModelSerializer):
+class ItemAncestorSerializer(ModelSerializer):
+    class Meta:
+        model = Item
+        fields = ["token", "name"]
+
+
+class ItemListSerializer(TimedModelSerializer):
     item_type = CharField(source="item_type.slug")
     item_type_name = CharField(source="item_type.name")
-    item_type_icon_url = CharField(read_only=True, source="item_type.icon_url")
-    icon_url = CharField(read_only=True)
+    item_type_icon_url = CharField(read_only=True, source="item_type.icon_url_64")
+    icon_url = CharField(read_only=True, source="icon_url_64")
+    name = CharField(read_only=True)
+    # parent first, see ItemQuerySet.with_ancestors
+    ancestors = ItemAncestorSerializer(many=True, read_only=True)
 
     class Meta:
         model = Item
@@ -93,18 +117,61 @@ class ItemListSerializer(ModelSerializer):
             "item_type",
             "item_type_name",
             "parent_name",
+            "ancestors",
+            "icon_url",
+            "item_type_icon_url",
+            "pinned",
+        ]
+
+
+class ItemTreeSerializer(ItemListSerializer):
+    # the tree says where they hang
+    ancestors = None
+
+    class Meta:
+        model = Item
+        fields = [
+            "token",
+            "name",
+            "rating",
+            "item_type",
+            "item_type_name",
             "icon_url",
             "item_type_icon_url",
             "pinned",
         ]
 
 
-class ItemDetailSerializer(ModelSerializer):
+class SeriesChildSerializer(ItemTreeSerializer):
+    """Needs ItemQuerySet.with_activity_stats"""
+
+    activity_count = IntegerField(read_only=True)
+    finished = BooleanField(source="any_finished", read_only=True)
+    average_rating = FloatField(read_only=True)
+    latest_activity = SerializerMethodField()
+
+    class Meta(ItemTreeSerializer.Meta):
+        fields = ItemTreeSerializer.Meta.fields + [
+            "activity_count",
+            "finished",
+            "average_rating",
+            "latest_activity",
+        ]
+
+    def get_latest_activity(self, item: Item) -> dict | None:
+        if item.latest_activity_token is None:
+            return None
+        return {"token": item.latest_activity_token, "at": item.latest_activity_at}
+
+
+class ItemDetailSerializer(TimedModelSerializer):
     item_type = CharField(source="item_type.slug")
     token = CharField(read_only=True)
     parent_token = CharField(source="parent.token", allow_null=True)
-    item_type_icon_url = CharField(read_only=True, source="item_type.icon_url")
-    icon_url = CharField(read_only=True)
+    item_type_icon_url = CharField(read_only=True, source="item_type.icon_url_256")
+    icon_url = CharField(read_only=True, source="icon_url_256")
+    name = CharField(read_only=True)
+    ancestors = ItemAncestorSerializer(many=True, read_only=True)
 
     class Meta:
         model = Item
@@ -117,13 +184,21 @@ class ItemDetailSerializer(ModelSerializer):
             "name",
             "parent_name",
             "parent_token",
+            "ancestors",
             "item_type_icon_url",
             "icon_url",
             "pinned",
         ]
 
 
-class UserSettingsSerializer(ModelSerializer):
+class UserSettingsSerializer(TimedModelSerializer):
     class Meta:
         model = User
         fields = ["settings"]
+
+
+class ApiTokenSerializer(ModelSerializer):
+    class Meta:
+        model = ApiToken
+        fields = ["key", "name", "created", "expires", "revoked"]
+        read_only_fields = ["key", "created", "expires", "revoked"]
@@ -1,3 +1,1972 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import zoneinfo
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Prefetch, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+import jsonschema
+from PIL import Image
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from app.models import (
+    Activity,
+    ActivityRollup,
+    ApiToken,
+    Item,
+    ItemType,
+    StoredIcon,
+    User,
+)
+from app.schemas import default_item_types
+from app.serializers import ItemDetailSerializer
+from backend.urls import serve_icon
+from app.utils.api_tokens import (
+    REVOCATION_REFRESH_SECONDS,
+    encode_token,
+    issue_token,
+    token_keys,
+)
+from app.utils.concurrency_benchmark import fetch, load
+from app.utils.request_timing import route_metrics
+from app.utils.route_benchmark import (
+    Timing,
+    benchmarked_routes,
+    compare_benchmarks,
+    run_benchmarks,
+)
+from app.utils.name_templates import (
+    NameTemplate,
+    Placeholder,
+    compile_name_schema,
+    get_tz,
+)
+from app.utils import schema_validation
+from app.utils.schema_validation import InfoValidator, get_info_validator
+from app.utils.synthetic_library import generate_users
+
+
+class LibraryTestCase(TestCase):
+    """A logged in user with the default item types, books named after their series"""
+
+    def setUp(self):
+        self.user = User.objects.create_user("budget@example.com", "pw")
+        for item_type in default_item_types:
+            ItemType.objects.create(
+                user=self.user,
+                **{
+                    **item_type,
+                    "slug": f"{item_type['slug']}-{self.user.pk}",
+                    "parent_slug": item_type.get("parent_slug")
+                    and f"{item_type['parent_slug']}-{self.user.pk}",
+                    "activity_schema": item_type.get("activity_schema") or {},
+                },
+            )
+        self.series_type = ItemType.objects.get(slug=f"book-series-{self.user.pk}")
+        self.book_type = ItemType.objects.get(slug=f"book-{self.user.pk}")
+        self.book_type.name_schema = "{{title}} ({{parent.title}})"
+        self.book_type.save()
+        self.client.force_login(self.user)
+
+    def make_books(self, count: int, depth: int = 1) -> list[Item]:
+        parent = None
+        for i in range(depth):
+            parent = Item.objects.create(
+                user=self.user,
+                item_type=self.series_type,
+                info={"title": f"Series {i}"},
+                parent=parent,
+            )
+        books = []
+        for i in range(count):
+            book = Item.objects.create(
+                user=self.user,
+                item_type=self.book_type,
+                info={"title": f"Book {i}", "author": "Someone"},
+                parent=parent,
+            )
+            Activity.objects.create(user=self.user, item=book, finished=True)
+            books.append(book)
+        return books
+
+
+class ItemNameTestCase(LibraryTestCase):
+    """Stored names follow whatever they were rendered from"""
+
+    def name(self, item: Item) -> str:
+        return Item.objects.values_list("name", flat=True).get(pk=item.pk)
+
+    def test_info_and_parent(self):
+        (book,) = self.make_books(1)
+        self.assertEqual(self.name(book), "Book 0 (Series 0)")
+        book.info = {**book.info, "title": "Dune"}
+        book.save()
+        self.assertEqual(self.name(book), "Dune (Series 0)")
+
+        other = Item.objects.create(
+            user=self.user, item_type=self.series_type, info={"title": "Other"}
+        )
+        book.parent = other
+        book.save()
+        self.assertEqual(self.name(book), "Dune (Other)")
+
+    def test_name_schema(self):
+        books = self.make_books(2)
+        self.book_type.name_schema = "{{title}} by {{author}}"
+        self.book_type.save()
+        self.assertEqual(
+            [self.name(b) for b in books], ["Book 0 by Someone", "Book 1 by Someone"]
+        )
+
+    def test_ancestors(self):
+        (book,) = self.make_books(1, depth=2)
+        self.book_type.name_schema = "{{title}} ({{parent.parent.title}})"
+        self.book_type.save()
+        self.assertEqual(self.name(book), "Book 0 (Series 0)")
+        grandparent = book.parent.parent
+        grandparent.info = {"title": "Saga"}
+        grandparent.save()
+        self.assertEqual(self.name(book), "Book 0 (Saga)")
+        # the book's own search document has the new name too
+        results = self.client.get("/api/item?search=saga").json()["results"]
+        self.assertIn(book.token, [r["token"] for r in results])
+
+    def test_display_timezone(self):
+        (book,) = self.make_books(1)
+        self.book_type.name_schema = "{{title}} {{created!%H}}"
+        self.book_type.save()
+        created = Item.objects.get(pk=book.pk).created
+        self.assertEqual(self.name(book), f"Book 0 {created:%H}")
+        self.user.settings = {**self.user.settings, "displayTimezone": "Asia/Kolkata"}
+        self.user.save()
+        local = created.astimezone(zoneinfo.ZoneInfo("Asia/Kolkata"))
+        self.assertEqual(self.name(book), f"Book 0 {local:%H}")
+
+    def test_renaming_reads_only_what_it_renders(self):
+        (book,) = self.make_books(1, depth=2)
+        template = self.book_type.name_template
+        with self.assertNumQueries(1):
+            (item,) = Item.objects.filter(pk=book.pk).for_renaming([template])
+            self.assertEqual(
+                template.render(item, item.user.display_timezone), "Book 0 (Series 1)"
+            )
+        self.assertIn("notes", item.get_deferred_fields())
+        self.assertIn("search_document", item.parent.get_deferred_fields())
+
+    def test_parent_deleted(self):
+        first, second = self.make_books(2)
+        first.parent.delete()
+        self.assertEqual(
+            [self.name(first), self.name(second)], ["Book 0 ()", "Book 1 ()"]
+        )
+        self.assertEqual(
+            self.client.get("/api/item?search=series").json()["results"], []
+        )
+
+        # and when they go with their item type
+        (book,) = self.make_books(1)
+        self.series_type.delete()
+        self.assertEqual(self.name(book), "Book 0 ()")
+
+
+class NameTemplateTestCase(SimpleTestCase):
+    def test_parse(self):
+        template = NameTemplate("{{title}} ({{parent.parent.title}}, {{created!%Y}})")
+        self.assertEqual(
+            template.parts,
+            [
+                Placeholder(0, "title"),
+                " (",
+                Placeholder(2, "title"),
+                ", ",
+                Placeholder(0, "created", True, "%Y"),
+                ")",
+            ],
+        )
+        self.assertEqual(template.max_depth, 2)
+        self.assertTrue(template.uses_time)
+        self.assertEqual(template.related_path, "parent__parent")
+        self.assertEqual(template.columns, ["created", "info", "parent__parent__info"])
+
+        plain = NameTemplate("Untitled")
+        self.assertEqual(
+            (plain.max_depth, plain.related_path, plain.columns), (0, None, [])
+        )
+        self.assertFalse(plain.uses_time)
+
+    def test_render(self):
+        created = datetime.datetime(2024, 1, 1, 23, 30, tzinfo=datetime.timezone.utc)
+        series = SimpleNamespace(info={"title": "Dune"}, parent=None, created=created)
+        book = SimpleNamespace(info={"title": "Messiah"}, parent=series, created=None)
+        template = NameTemplate("{{title}} ({{parent.title}} {{parent.created!%d}})")
+        self.assertEqual(template.render(book), "Messiah (Dune 01)")
+        self.assertEqual(template.render(book, "Asia/Tokyo"), "Messiah (Dune 02)")
+        # missing ancestors and fields render as nothing
+        self.assertEqual(template.render(series), "Dune ( )")
+        self.assertEqual(
+            NameTemplate("{{parent.created}}").render(book), created.isoformat()
+        )
+
+    def test_compiled_once(self):
+        schema = "{{title}} by {{author}}"
+        first = compile_name_schema(schema)
+        hits = compile_name_schema.cache_info().hits
+        self.assertIs(compile_name_schema(schema), first)
+        self.assertEqual(compile_name_schema.cache_info().hits, hits + 1)
+
+    def test_time_zones_cache_is_bounded(self):
+        # the names come from users' settings
+        self.assertEqual(get_tz.cache_info().maxsize, 128)
+
+
+class QueryBudgetTestCase(LibraryTestCase):
+    """Read endpoints must cost the same number of queries whatever the page size or ancestor depth"""
+
+    # session + user lookup, then at most count / page of pks / page of rows
+    LIST_BUDGET = 6
+    DETAIL_BUDGET = 4
+
+    def count_queries(self, url: str) -> int:
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assert_flat(self, url: str, budget: int):
+        self.make_books(2)
+        small = self.count_queries(url)
+        self.make_books(20, depth=4)
+        large = self.count_queries(url)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, budget)
+
+    def test_activity_list(self):
+        self.assert_flat("/api/activity?page_size=20", self.LIST_BUDGET)
+
+    def test_item_list(self):
+        self.assert_flat("/api/item?page_size=20", self.LIST_BUDGET)
+
+    def test_item_list_search(self):
+        self.assert_flat("/api/item?page_size=20&search=book", self.LIST_BUDGET)
+
+    def test_activity_list_search(self):
+        self.assert_flat("/api/activity?page_size=20&search=book", self.LIST_BUDGET)
+
+    def test_item_details(self):
+        shallow = self.make_books(1)[0]
+        deep = self.make_books(1, depth=6)[0]
+        self.assertEqual(
+            self.count_queries(f"/api/item/{shallow.token}"),
+            self.count_queries(f"/api/item/{deep.token}"),
+        )
+        self.assertLessEqual(
+            self.count_queries(f"/api/item/{deep.token}"), self.DETAIL_BUDGET
+        )
+
+    def test_activity_details(self):
+        book = self.make_books(1, depth=6)[0]
+        activity = book.activity_set.get()
+        self.assertLessEqual(
+            self.count_queries(f"/api/activity/{activity.token}"), self.DETAIL_BUDGET
+        )
+
+    def test_static_filters(self):
+        self.assert_flat("/api/get_activities_static_filters", self.DETAIL_BUDGET)
+        self.assert_flat(
+            f"/api/get_autocomplete_suggestions/{self.book_type.slug}",
+            self.DETAIL_BUDGET + 1,
+        )
+
+
+class SearchTestCase(LibraryTestCase):
+    def search(self, url: str) -> list[str]:
+        return [r["token"] for r in self.client.get(url).json()["results"]]
+
+    def test_search_document_follows_edits(self):
+        (book,) = self.make_books(1)
+        series = book.parent
+        self.assertEqual(self.search("/api/item?search=someone"), [book.token])
+
+        series.info = {"title": "Dune Chronicles"}
+        series.save()
+        # the book's name and its parent name both changed
+        self.assertEqual(
+            set(self.search("/api/item?search=chron")), {series.token, book.token}
+        )
+        activity = book.activity_set.get()
+        self.assertEqual(
+            self.search("/api/activity?search=dune+book"), [activity.token]
+        )
+
+    def test_name_matches_rank_first(self):
+        (book,) = self.make_books(1)
+        noted = Item.objects.create(
+            user=self.user,
+            item_type=self.book_type,
+            info={"title": "Other", "author": "Else"},
+            notes="reminds me of Book 0",
+        )
+        self.assertEqual(
+            self.search("/api/item?search=book"), [book.token, noted.token]
+        )
+
+    def test_fuzzy_match(self):
+        (book,) = self.make_books(1)
+        book.info = {"title": "Dune Messiah", "author": "Frank Herbert"}
+        book.save()
+        res = self.client.get("/api/fuzzy_match_items?q=Dune+Mesiah").json()
+        self.assertEqual([r["token"] for r in res["results"]], [book.token])
+
+        res = self.client.get(
+            f"/api/fuzzy_match_items?q=Herbrt&itemType={self.series_type.slug}"
+        ).json()
+        self.assertEqual(res["results"], [])
+
+        for limit in ["ten", "0", "-1"]:
+            with self.subTest(limit):
+                res = self.client.get(f"/api/fuzzy_match_items?q=Dune&limit={limit}")
+                self.assertEqual(res.status_code, 400)
+
+    def test_search_fields_follow_item_types(self):
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.search_fields, ["author", "console", "title"])
+        (book,) = self.make_books(1)
+        self.book_type.item_schema = {
+            **self.book_type.item_schema,
+            "required": ["title"],
+        }
+        self.book_type.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.search_fields, ["console", "title"])
+        self.assertEqual(
+            self.client.get("/api/fuzzy_match_items?q=Someone").json()["results"], []
+        )
+
+        self.series_type.delete()
+        ItemType.objects.get(slug=f"video_game-{self.user.pk}").delete()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.search_fields, ["title"])
+
+
+class KeysetPaginationTestCase(LibraryTestCase):
+    def walk(self, url: str) -> list[str]:
+        tokens = []
+        while url:
+            res = self.client.get(url).json()
+            self.assertNotIn("count", res)
+            tokens += [r["token"] for r in res["results"]]
+            url = res["next"]
+        return tokens
+
+    def test_cursor_pages_match_offset_order(self):
+        books = self.make_books(7)
+        for i, book in enumerate(books):
+            # ties and nulls on the sort key
+            book.rating = None if i % 3 == 0 else (i % 2) / 2
+            book.save()
+        for ordering in ["-rating", "rating", "name", "-created"]:
+            full = self.client.get(f"/api/item?page_size=50&ordering={ordering}")
+            expected = [r["token"] for r in full.json()["results"]]
+            walked = self.walk(f"/api/item?cursor=&page_size=2&ordering={ordering}")
+            self.assertEqual(walked, expected)
+        # unrated last either way
+        for ordering in ["rating", "-rating"]:
+            res = self.client.get(f"/api/item?page_size=50&ordering={ordering}").json()
+            self.assertEqual(
+                [r["rating"] is None for r in res["results"]],
+                [False] * 4 + [True] * 4,
+            )
+
+        activities = self.walk("/api/activity?cursor=&page_size=3")
+        self.assertEqual(
+            activities,
+            list(
+                Activity.objects.filter(user=self.user)
+                .order_by("-pk")
+                .values_list("token", flat=True)
+            ),
+        )
+
+    def test_estimate_and_bad_cursor(self):
+        self.make_books(3)
+        res = self.client.get("/api/item?cursor=&estimate=true").json()
+        self.assertIn("estimated_count", res)
+        self.assertEqual(self.client.get("/api/item?cursor=nonsense").status_code, 404)
+
+    def test_tampered_cursor(self):
+        def cursor(ordering, values):
+            payload = json.dumps({"o": ordering, "v": values}).encode()
+            return base64.urlsafe_b64encode(payload).decode()
+
+        self.make_books(3)
+        for label, ordering, url in [
+            ("pk", [["pk", True]], "/api/item?page_size=2"),
+            ("float", [["rating", False], ["pk", False]], "/api/item?ordering=rating"),
+            (
+                "datetime",
+                [["created", True], ["pk", True]],
+                "/api/item?ordering=-created",
+            ),
+        ]:
+            for value in ["abc", {"a": 1}, [1]]:
+                with self.subTest(label, value=value):
+                    values = [value] if len(ordering) == 1 else [value, 1]
+                    res = self.client.get(f"{url}&cursor={cursor(ordering, values)}")
+                    self.assertEqual(res.status_code, 404)
+        # still good values, even as strings
+        res = self.client.get(f"/api/item?cursor={cursor([['pk', True]], ['999999'])}")
+        self.assertEqual(res.status_code, 200)
+
+
+class AutocompleteTestCase(LibraryTestCase):
+    def suggestions(self, query: str = "") -> dict:
+        return self.client.get(
+            f"/api/get_autocomplete_suggestions/{self.book_type.slug}{query}"
+        ).json()
+
+    def test_index_follows_item_writes(self):
+        books = self.make_books(3)
+        books[0].info = {"title": "Book 0", "author": "Else", "series_num": 1}
+        books[0].save()
+        res = self.suggestions()
+        self.assertEqual([s["value"] for s in res["author"]], ["Someone", "Else"])
+        self.assertEqual(res["series_num"], [{"label": 1, "value": 1}])
+        self.assertEqual(len(res[self.series_type.slug]), 1)
+
+        books[1].delete()
+        books[2].delete()
+        res = self.suggestions("?q=b&limit=1")
+        self.assertEqual(res["author"], [])
+        self.assertEqual(res["title"], [{"label": "Book 0", "value": "Book 0"}])
+
+        for limit in ["one", "0", "-1"]:
+            with self.subTest(limit):
+                res = self.client.get(
+                    f"/api/get_autocomplete_suggestions/{self.book_type.slug}?limit={limit}"
+                )
+                self.assertEqual(res.status_code, 400)
+
+
+class StaticFilterItemsTestCase(LibraryTestCase):
+    def test_pages_and_prefix(self):
+        self.make_books(5)
+        url = "/api/get_activities_static_filter_items?page_size=2"
+        labels = []
+        while url:
+            res = self.client.get(url).json()
+            labels += [i["label"] for i in res["items"]]
+            url = res["next"] and (
+                "/api/get_activities_static_filter_items?page_size=2&cursor="
+                + res["next"]
+            )
+        self.assertEqual(labels, sorted(labels))
+        self.assertEqual(len(labels), 6)
+
+        res = self.client.get("/api/get_activities_static_filter_items?q=series")
+        self.assertEqual([i["label"] for i in res.json()["items"]], ["Series 0"])
+
+    def test_bad_page_size(self):
+        self.make_books(1)
+        for page_size in ["0", "-3", "many"]:
+            with self.subTest(page_size):
+                res = self.client.get(
+                    f"/api/get_activities_static_filter_items?page_size={page_size}"
+                )
+                self.assertEqual(res.status_code, 400)
+
+    def test_etag_follows_library_writes(self):
+        (book,) = self.make_books(1)
+        url = "/api/get_activities_static_filters"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        book.info = {"title": "Renamed"}
+        book.save()
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Renamed (Series 0)", [i["label"] for i in res.json()["items"]])
+
+
+class ConditionalGetTestCase(LibraryTestCase):
+    """Read endpoints answer 304 from the user's versions, without their main query"""
+
+    def revalidate(self, url: str, etag: str, last_modified: str | None = None):
+        headers = {"HTTP_IF_NONE_MATCH": etag}
+        if last_modified is not None:
+            headers = {"HTTP_IF_MODIFIED_SINCE": last_modified}
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url, **headers)
+        return res, len(ctx.captured_queries)
+
+    def test_not_modified_without_the_main_query(self):
+        (book,) = self.make_books(1)
+        activity = book.activity_set.get()
+        urls = [
+            "/api/item_type",
+            f"/api/item_type/{self.book_type.slug}",
+            "/api/item?page_size=20",
+            f"/api/item/{book.token}",
+            "/api/activity?page_size=20",
+            f"/api/activity/{activity.token}",
+            "/api/activity/timeline?at=2024-01-01",
+            "/api/settings",
+            "/api/get_items_static_filters",
+            "/api/get_activities_static_filters",
+            f"/api/get_autocomplete_suggestions/{self.book_type.slug}",
+            "/api/stats",
+        ]
+        for url in urls:
+            with self.subTest(url):
+                res = self.client.get(url)
+                self.assertEqual(res.status_code, 200)
+                self.assertIn("no-cache", res["Cache-Control"])
+                res, queries = self.revalidate(url, res["ETag"])
+                self.assertEqual(res.status_code, 304)
+                # session + user
+                self.assertEqual(queries, 2)
+                res, _ = self.revalidate(url, '"stale"', res["Last-Modified"])
+                self.assertEqual(res.status_code, 304)
+
+    def test_writes_change_only_their_etags(self):
+        (book,) = self.make_books(1)
+        activity = book.activity_set.get()
+        urls = {
+            "item_types": "/api/item_type",
+            "items": "/api/item",
+            "activities": "/api/activity",
+            "settings": "/api/settings",
+            # its days are in the user's timezone
+            "timeline": "/api/activity/timeline?at=2024-01-01",
+        }
+
+        def changed() -> set[str]:
+            stale = {
+                name
+                for name, url in urls.items()
+                if self.client.get(url, HTTP_IF_NONE_MATCH=etags[name]).status_code
+                == 200
+            }
+            etags.update(
+                {name: self.client.get(url)["ETag"] for name, url in urls.items()}
+            )
+            return stale
+
+        etags = {name: self.client.get(url)["ETag"] for name, url in urls.items()}
+        activity.rating = 0.5
+        activity.save()
+        self.assertEqual(changed(), {"activities", "timeline"})
+        book.info = {"title": "Renamed"}
+        book.save()
+        self.assertEqual(changed(), {"items", "activities", "timeline"})
+        self.book_type.name = "Novel"
+        self.book_type.save()
+        self.assertEqual(changed(), {"item_types", "items", "activities", "timeline"})
+        self.user.settings["ratingMax"] = 10
+        self.user.save()
+        self.assertEqual(changed(), {"settings", "timeline"})
+        activity.delete()
+        self.assertEqual(changed(), {"activities", "timeline"})
+        book.delete()
+        self.assertEqual(changed(), {"items", "activities", "timeline"})
+
+        # nothing to write, so nothing changes
+        self.user.settings["ratingMax"] = 3
+        self.user.save(update_fields=[])
+        self.assertEqual(changed(), set())
+
+    def test_other_methods_unaffected(self):
+        etag = self.client.get("/api/settings")["ETag"]
+        res = self.client.patch(
+            "/api/settings",
+            {"settings": {"ratingMax": 10}},
+            content_type="application/json",
+            HTTP_IF_NONE_MATCH=etag,
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("ETag", res)
+        res = self.client.get("/api/settings", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.json()["settings"]["ratingMax"], 10)
+
+
+class ResponseCacheTestCase(LibraryTestCase):
+    """Warm reads come from the responses cache, keyed by the user's versions"""
+
+    URLS = [
+        "/api/item_type",
+        "/api/settings",
+        "/api/item?page_size=5",
+        "/api/activity?page_size=5",
+        "/api/get_items_static_filters",
+        "/api/get_activities_static_filters",
+    ]
+
+    def setUp(self):
+        super().setUp()
+        caches["responses"].clear()
+
+    def queries(self, url: str) -> tuple[bytes, int]:
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(url)
+        self.assertEqual(res.status_code, 200)
+        return res.content, len(ctx.captured_queries)
+
+    def test_warm_reads_skip_the_database(self):
+        self.make_books(3)
+        for url in [
+            *self.URLS,
+            f"/api/item_type/{self.book_type.slug}",
+            f"/api/get_autocomplete_suggestions/{self.book_type.slug}",
+        ]:
+            with self.subTest(url):
+                cold, cold_queries = self.queries(url)
+                warm, warm_queries = self.queries(url)
+                self.assertEqual(cold, warm)
+                # session + user
+                self.assertEqual(warm_queries, 2)
+                self.assertGreater(cold_queries, 2)
+
+    def test_writes_move_to_new_keys(self):
+        (book,) = self.make_books(1)
+        for url in self.URLS:
+            self.client.get(url)
+        book.info = {"title": "Renamed", "author": "Someone"}
+        book.save()
+        self.user.settings["ratingMax"] = 10
+        self.user.save()
+        ItemType.objects.create(
+            user=self.user, slug=f"comic-{self.user.pk}", name="Comic"
+        )
+        for url in self.URLS:
+            with self.subTest(url):
+                content, queries = self.queries(url)
+                self.assertGreater(queries, 2)
+        self.assertIn(b"Renamed", self.client.get("/api/item").content)
+        self.assertIn(b"Comic", self.client.get("/api/item_type").content)
+        self.assertEqual(
+            self.client.get("/api/settings").json()["settings"]["ratingMax"], 10
+        )
+
+    def test_scoped_to_first_pages_and_users(self):
+        self.make_books(6)
+        self.queries("/api/item?page_size=2&page=2")
+        self.assertGreater(self.queries("/api/item?page_size=2&page=2")[1], 2)
+
+        mine = self.client.get("/api/item_type").content
+        other = User.objects.create_user("cache@example.com", "pw")
+        self.client.force_login(other)
+        self.assertNotEqual(self.client.get("/api/item_type").content, mine)
+
+    @override_settings(RESPONSE_CACHE=False)
+    def test_off(self):
+        self.queries("/api/item_type")
+        self.assertGreater(self.queries("/api/item_type")[1], 2)
+
+
+class InfoValidatorTestCase(SimpleTestCase):
+    INSTANCES = [
+        {"title": "Dune", "author": "Herbert"},
+        {"title": "Dune", "author": "Herbert", "series_num": 1.5},
+        {"title": "Dune"},
+        {"title": 3, "author": "Herbert"},
+        {"title": "Dune", "author": "Herbert", "series_num": True},
+        {"title": "Dune", "author": "Herbert", "pages": 412},
+        {"author": 1, "pages": 412, "isbn": "x"},
+        ["Dune"],
+        None,
+    ]
+
+    def test_matches_jsonschema(self):
+        for item_type in default_item_types:
+            schema = item_type["item_schema"]
+            validator = InfoValidator(schema)
+            self.assertIsNotNone(validator.fast_check)
+            for instance in self.INSTANCES:
+                try:
+                    jsonschema.validate(instance, schema)
+                    expected = None
+                except jsonschema.exceptions.ValidationError as e:
+                    expected = e.message
+                self.assertEqual(validator.error_message(instance), expected)
+
+    def test_cached_until_schema_changes(self):
+        item_type = ItemType(pk=-1, item_schema={"type": "object", "required": ["a"]})
+        validator = get_info_validator(item_type)
+        self.assertIs(get_info_validator(item_type), validator)
+        self.assertIsNone(validator.error_message({"a": 1}))
+
+        item_type.item_schema = {"type": "object", "required": ["b"]}
+        self.assertEqual(
+            get_info_validator(item_type).error_message({"a": 1}),
+            "'b' is a required property",
+        )
+        with self.assertRaises(jsonschema.exceptions.SchemaError):
+            InfoValidator({"type": "thing"})
+
+    def test_list_of_types(self):
+        validator = InfoValidator(
+            {"type": "object", "properties": {"title": {"type": ["string", "null"]}}}
+        )
+        self.assertIsNone(validator.fast_check)
+        self.assertIsNone(validator.error_message({"title": None}))
+        self.assertEqual(
+            validator.error_message({"title": 3}), "3 is not of type 'string', 'null'"
+        )
+
+    def test_cache_is_bounded(self):
+        schema = {"type": "object"}
+        with mock.patch.object(schema_validation, "MAX_CACHED_VALIDATORS", 2):
+            for pk in [-1, -2, -3]:
+                get_info_validator(ItemType(pk=pk, item_schema=schema))
+            self.assertNotIn(-1, schema_validation._validators)
+            self.assertIn(-3, schema_validation._validators)
+            self.assertLessEqual(len(schema_validation._validators), 2)
+
+
+class ItemTypeSchemaTestCase(LibraryTestCase):
+    def test_item_schema_must_be_an_object(self):
+        for item_schema in [["title"], "title", {"type": "thing"}]:
+            with self.subTest(item_schema):
+                res = self.client.patch(
+                    f"/api/item_type/{self.book_type.slug}",
+                    {"item_schema": item_schema},
+                    content_type="application/json",
+                )
+                self.assertEqual(res.status_code, 400)
+        self.book_type.refresh_from_db()
+        self.assertEqual(self.book_type.item_schema["type"], "object")
+
+
+class ImportTestCase(LibraryTestCase):
+    def upload(self, name: str, content: str, query: str = "") -> dict:
+        res = self.client.post(
+            f"/api/import{query}",
+            {"file": SimpleUploadedFile(name, content.encode())},
+        )
+        self.assertEqual(res.status_code, 200)
+        return res.json()
+
+    def test_csv(self):
+        book_type = self.book_type.slug
+        content = "\n".join(
+            [
+                "item_type,title,author,series_num,parent,finished,rating,end_time",
+                f"{self.series_type.slug},Dune,,,,,,",
+                f"{book_type},Dune Messiah,Herbert,2,Dune,true,4,2023/05/01",
+                f"{book_type},Dune Messiah,Herbert,2,Dune,true,5,2024-01-02T10:00:00",
+                f"{book_type},Children,Herbert,two,Dune,,,",
+                f"{book_type},Heretics,Herbert,5,Nope,,,",
+            ]
+        )
+        report = self.upload("goodreads.csv", content)
+        self.assertEqual(report["rows"], 5)
+        self.assertEqual(report["items_created"], 2)
+        self.assertEqual(report["activities_created"], 2)
+        self.assertEqual(
+            report["errors"],
+            [
+                {"row": 5, "error": "'two' is not a number"},
+                {"row": 6, "error": "No parent 'Nope'"},
+            ],
+        )
+        book = Item.objects.get(item_type=self.book_type)
+        self.assertEqual(book.name, "Dune Messiah (Dune)")
+        self.assertEqual(book.info["series_num"], 2)
+        self.assertEqual(
+            sorted(book.activity_set.values_list("rating", flat=True)), [0.8, 1.0]
+        )
+        res = self.client.get("/api/item?search=messiah").json()
+        self.assertEqual([r["token"] for r in res["results"]], [book.token])
+
+        # importing again only adds activities
+        report = self.upload("goodreads.csv", content)
+        self.assertEqual(report["items_created"], 0)
+        self.assertEqual(book.activity_set.count(), 4)
+
+    def test_jsonl(self):
+        (book,) = self.make_books(1)
+        content = "\n".join(
+            [
+                json.dumps({"token": book.token, "pending": True}),
+                json.dumps({"info": {"title": "Solaris", "author": "Lem"}}),
+                json.dumps({"info": {"title": "Solaris"}}),
+                "{oops",
+            ]
+        )
+        report = self.upload(
+            "export.jsonl", content, f"?itemType={self.book_type.slug}"
+        )
+        self.assertEqual(report["items_created"], 1)
+        self.assertEqual(report["activities_created"], 1)
+        self.assertEqual([e["row"] for e in report["errors"]], [3, 4])
+        self.assertEqual(
+            report["errors"][0]["error"], "'author' is a required property"
+        )
+        self.assertTrue(book.activity_set.filter(pending=True).exists())
+
+
+class ExportTestCase(LibraryTestCase):
+    def export(self, export_format: str) -> str:
+        res = self.client.get(f"/api/export?format={export_format}")
+        self.assertTrue(res.streaming)
+        return b"".join(res.streaming_content).decode()
+
+    def test_jsonl(self):
+        books = self.make_books(3)
+        lines = [json.loads(line) for line in self.export("jsonl").splitlines()]
+        kinds = [line["kind"] for line in lines]
+        self.assertEqual(kinds.count("item_type"), 4)
+        self.assertEqual(kinds.count("item"), 4)
+        self.assertEqual(kinds.count("activity"), 3)
+        self.assertEqual(
+            kinds, sorted(kinds, key=["item_type", "item", "activity"].index)
+        )
+        exported = {line["token"]: line for line in lines if line["kind"] == "item"}
+        self.assertEqual(exported[books[0].token]["parent"], books[0].parent.token)
+        self.assertEqual(exported[books[0].token]["name"], "Book 0 (Series 0)")
+
+    def test_csv_imports_into_another_account(self):
+        books = self.make_books(2)
+        Activity.objects.create(user=self.user, item=books[0], rating=0.5)
+        content = self.export("csv")
+
+        other = User.objects.create_user("export@example.com", "pw")
+        for item_type in ItemType.objects.filter(user=self.user):
+            ItemType.objects.create(
+                user=other,
+                # slugs are unique across accounts
+                slug=item_type.slug.replace(f"-{self.user.pk}", f"-{other.pk}"),
+                name=item_type.name,
+                name_schema=item_type.name_schema,
+                item_schema=item_type.item_schema,
+                parent_slug=item_type.parent_slug
+                and item_type.parent_slug.replace(f"-{self.user.pk}", f"-{other.pk}"),
+            )
+        content = content.replace(f"-{self.user.pk},", f"-{other.pk},")
+        self.client.force_login(other)
+        res = self.client.post(
+            "/api/import",
+            {"file": SimpleUploadedFile("export.csv", content.encode())},
+        ).json()
+        self.assertEqual(res["errors"], [])
+        self.assertEqual(
+            sorted(Item.objects.filter(user=other).values_list("name", flat=True)),
+            sorted(Item.objects.filter(user=self.user).values_list("name", flat=True)),
+        )
+        self.assertEqual(
+            sorted(
+                Activity.objects.filter(user=other).values_list("rating", flat=True),
+                key=str,
+            ),
+            sorted(
+                Activity.objects.filter(user=self.user).values_list(
+                    "rating", flat=True
+                ),
+                key=str,
+            ),
+        )
+
+    def test_csv_keeps_reparented_trees(self):
+        # the middle of the tree is older than the top
+        (book,) = self.make_books(1)
+        middle = book.parent
+        top = Item.objects.create(
+            user=self.user, item_type=self.series_type, info={"title": "Saga"}
+        )
+        middle.parent = top
+        middle.save()
+        content = self.export("csv")
+        tokens = [line.split(",", 1)[0] for line in content.splitlines()[1:]]
+        self.assertEqual(tokens, [top.token, middle.token, book.token])
+
+        other = User.objects.create_user("export@example.com", "pw")
+        for item_type in ItemType.objects.filter(user=self.user):
+            item_type.pk = None
+            item_type.user = other
+            item_type.slug = item_type.slug.replace(f"-{self.user.pk}", f"-{other.pk}")
+            item_type.save()
+        content = content.replace(f"-{self.user.pk},", f"-{other.pk},")
+        self.client.force_login(other)
+        res = self.client.post(
+            "/api/import",
+            {"file": SimpleUploadedFile("export.csv", content.encode())},
+        ).json()
+        self.assertEqual(res["errors"], [])
+        self.assertEqual(
+            {
+                item.info["title"]: item.parent and item.parent.info["title"]
+                for item in Item.objects.filter(user=other).select_related("parent")
+            },
+            {"Saga": None, "Series 0": "Saga", "Book 0": "Series 0"},
+        )
+
+    def test_csv_parents_that_loop(self):
+        (book,) = self.make_books(1)
+        series = book.parent
+        Item.objects.filter(pk=series.pk).update(parent=book)
+        below = Item.objects.create(
+            user=self.user, item_type=self.book_type, parent=book, info={"title": "B"}
+        )
+        (alone,) = self.make_books(1)
+        content = self.export("csv")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(
+            [row["token"] for row in rows],
+            [alone.parent.token, alone.token, series.token, book.token, below.token],
+        )
+        self.assertEqual([row["parent"] for row in rows[2:]], ["", "", ""])
+
+
+class BatchWriteTestCase(LibraryTestCase):
+    def batch(self, operations: list[dict], atomic: bool = False) -> list[dict]:
+        res = self.client.post(
+            "/api/batch",
+            {"operations": operations, "atomic": atomic},
+            content_type="application/json",
+        )
+        self.assertEqual(res.status_code, 200)
+        return res.json()["results"]
+
+    def test_operations(self):
+        book, other = self.make_books(2)
+        new_book = {
+            "item_type": self.book_type.slug,
+            "info": {"title": "Solaris", "author": "Lem"},
+        }
+        results = self.batch(
+            [
+                {
+                    "op": "create",
+                    "model": "activity",
+                    "data": {
+                        "itemDetails": new_book,
+                        "activityDetails": {"finished": True, "rating": 4},
+                    },
+                },
+                {
+                    "op": "create",
+                    "model": "activity",
+                    "data": {
+                        "itemDetails": {"token": book.token},
+                        "activityDetails": {"pending": True},
+                    },
+                },
+                {
+                    "op": "update",
+                    "model": "item",
+                    "token": book.token,
+                    "data": {"notes": "again"},
+                },
+                {
+                    "op": "update",
+                    "model": "item",
+                    "token": book.token,
+                    "data": {"info": {}},
+                },
+                {"op": "delete", "model": "item", "token": other.token},
+                {"op": "delete", "model": "item", "token": "I_missing"},
+                {"op": "explode", "model": "item"},
+            ]
+        )
+        self.assertEqual(
+            [r["status"] for r in results], [201, 201, 200, 400, 204, 404, 400]
+        )
+        self.assertEqual(results[0]["data"]["item_name"], "Solaris ()")
+        self.assertEqual(results[3]["error"], "'title' is a required property")
+        book.refresh_from_db()
+        self.assertEqual(book.notes, "again")
+        self.assertEqual(book.info["title"], "Book 0")
+        self.assertFalse(Item.objects.filter(pk=other.pk).exists())
+        self.assertEqual(Activity.objects.get(item__name="Solaris ()").rating, 0.8)
+
+    def test_atomic(self):
+        (book,) = self.make_books(1)
+        results = self.batch(
+            [
+                {
+                    "op": "update",
+                    "model": "item",
+                    "token": book.token,
+                    "data": {"notes": "kept?"},
+                },
+                {"op": "delete", "model": "activity", "token": "A_missing"},
+            ],
+            atomic=True,
+        )
+        self.assertEqual([r["status"] for r in results], [200, 404])
+        book.refresh_from_db()
+        self.assertEqual(book.notes, "")
+
+    def test_bad_operations(self):
+        (book,) = self.make_books(1)
+        activity = book.activity_set.get()
+        other = User.objects.create_user("other@example.com", "pw")
+        theirs = Item.objects.create(
+            user=other, item_type=self.book_type, info={"title": "Theirs"}
+        )
+        results = self.batch(
+            [
+                {"op": "update", "model": "item", "token": ["I_x"]},
+                {"op": "update", "model": "item", "token": book.token, "data": "x"},
+                {"op": "create", "model": "activity", "data": {"itemDetails": []}},
+                {
+                    "op": "create",
+                    "model": "activity",
+                    "data": {
+                        "itemDetails": {"token": book.token},
+                        "activityDetails": {"rating": "high", "user": 2},
+                    },
+                },
+                {
+                    "op": "create",
+                    "model": "activity",
+                    "data": {
+                        "itemDetails": {"token": book.token},
+                        "activityDetails": {"rating": "high"},
+                    },
+                },
+                {
+                    "op": "create",
+                    "model": "activity",
+                    "data": {
+                        "itemDetails": {"token": book.token},
+                        "activityDetails": {"start_time": "soon"},
+                    },
+                },
+                {
+                    "op": "update",
+                    "model": "item",
+                    "token": book.token,
+                    "data": {"item_type": self.series_type.slug},
+                },
+                {
+                    "op": "update",
+                    "model": "activity",
+                    "token": activity.token,
+                    "data": {"item_type": self.series_type.slug},
+                },
+                {
+                    "op": "update",
+                    "model": "activity",
+                    "token": activity.token,
+                    "data": {"item": theirs.token},
+                },
+                {
+                    "op": "update",
+                    "model": "item",
+                    "token": book.token,
+                    "data": {"item_type": self.book_type.slug, "notes": "fine"},
+                },
+            ]
+        )
+        self.assertEqual([r["status"] for r in results], [400] * 8 + [404, 200])
+        self.assertEqual(
+            [r.get("error") for r in results[:5]],
+            [
+                "An item token is required",
+                "data must be an object",
+                "itemDetails must be an object",
+                "activityDetails can't set user",
+                "rating must be between 0 and 5",
+            ],
+        )
+        activity.refresh_from_db()
+        self.assertEqual(activity.item_id, book.pk)
+
+    def test_lookups_are_shared(self):
+        books = self.make_books(10)
+        operations = [
+            {
+                "op": "create",
+                "model": "activity",
+                "data": {
+                    "itemDetails": {"token": book.token},
+                    "activityDetails": {"finished": True},
+                },
+            }
+            for book in books
+        ]
+        with CaptureQueriesContext(connection) as ctx:
+            self.batch(operations)
+        # savepoint, insert, rollup, version and release per activity, plus the shared lookups
+        self.assertLessEqual(len(ctx.captured_queries), 5 * len(books) + 8)
+
+
+class StatsTestCase(LibraryTestCase):
+    def assertRollupsMatchActivities(self):
+        stored = {
+            (r.user_id, r.item_type_id, r.period, r.finished, r.rating_bucket): [
+                r.count,
+                round(r.rating_sum, 6),
+            ]
+            for r in ActivityRollup.objects.filter(user=self.user)
+        }
+        counted = ActivityRollup.objects.tally(
+            Activity.objects.filter(user=self.user), self.user.display_timezone
+        )
+        self.assertEqual(
+            stored,
+            {key: [count, round(total, 6)] for key, (count, total) in counted.items()},
+        )
+
+    def test_rollups_follow_activity_writes(self):
+        books = self.make_books(3)
+        self.assertRollupsMatchActivities()
+
+        activity = books[0].activity_set.get()
+        activity.rating = 0.7
+        activity.finished = False
+        activity.end_time = datetime.datetime(2020, 2, 1, tzinfo=datetime.timezone.utc)
+        activity.save()
+        self.assertRollupsMatchActivities()
+
+        # edited without having loaded what it counts by
+        other = Activity.objects.only("pk", "user").get(item=books[1])
+        other.item = books[2]
+        other.rating = 1
+        other.save()
+        self.assertRollupsMatchActivities()
+
+        activity.delete()
+        books[2].delete()
+        self.assertRollupsMatchActivities()
+        self.assertFalse(
+            ActivityRollup.objects.filter(user=self.user, count__lte=0).exists()
+        )
+
+    def test_timezone_change_rebuilds(self):
+        (book,) = self.make_books(1)
+        activity = book.activity_set.get()
+        activity.end_time = datetime.datetime(
+            2020, 3, 1, 2, tzinfo=datetime.timezone.utc
+        )
+        activity.save()
+        self.user.settings = {
+            **self.user.settings,
+            "displayTimezone": "America/New_York",
+        }
+        self.user.save()
+        self.assertEqual(
+            ActivityRollup.objects.get(user=self.user).period, datetime.date(2020, 2, 1)
+        )
+        self.assertRollupsMatchActivities()
+
+    def test_posix_timezone_counts_in_utc(self):
+        # gettz reads this one, zoneinfo and Postgres don't
+        self.user.settings = {**self.user.settings, "displayTimezone": "EST+5"}
+        self.user.save()
+        (book,) = self.make_books(1)
+        activity = book.activity_set.get()
+        activity.end_time = datetime.datetime(
+            2020, 3, 1, 2, tzinfo=datetime.timezone.utc
+        )
+        activity.save()
+        self.assertEqual(
+            ActivityRollup.objects.get(user=self.user).period, datetime.date(2020, 3, 1)
+        )
+        self.assertRollupsMatchActivities()
+        ActivityRollup.objects.rebuild(self.user)
+        self.assertRollupsMatchActivities()
+
+    def test_stats(self):
+        books = self.make_books(3)
+        for book, rating in zip(books, [0.2, 1, None]):
+            Activity.objects.create(
+                user=self.user,
+                item=book,
+                rating=rating,
+                end_time=datetime.datetime(2021, 5, 3, tzinfo=datetime.timezone.utc),
+            )
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get("/api/stats").json()
+        # session, user and the rollups
+        self.assertLessEqual(len(ctx.captured_queries), 3)
+        self.assertEqual(
+            res["itemTypes"],
+            [
+                {
+                    "slug": self.book_type.slug,
+                    "name": self.book_type.name,
+                    "activities": 6,
+                    "finished": 3,
+                }
+            ],
+        )
+        self.assertIn(
+            {"month": "2021-05", "activities": 3, "finished": 0}, res["months"]
+        )
+        self.assertEqual(res["ratings"]["count"], 2)
+        self.assertEqual(res["ratings"]["histogram"][2], 1)
+        self.assertEqual(res["ratings"]["histogram"][9], 1)
+        self.assertEqual(res["ratings"]["average"], 3)
+
+        res = self.client.get("/api/stats?from=2021-05&to=2021-05").json()
+        self.assertEqual(
+            res["months"], [{"month": "2021-05", "activities": 3, "finished": 0}]
+        )
+        self.assertEqual(self.client.get("/api/stats?from=soon").status_code, 400)
+
+    def test_rebuild_command(self):
+        self.make_books(2)
+        ActivityRollup.objects.filter(user=self.user).update(count=99)
+        call_command("rebuild_stats", user=self.user.email, stdout=io.StringIO())
+        self.assertRollupsMatchActivities()
+
+
+class TimelineTestCase(LibraryTestCase):
+    def activity(self, item, start=None, end=None, **kwargs) -> Activity:
+        day = lambda d: d and datetime.datetime(
+            2024, 3, d, 12, tzinfo=datetime.timezone.utc
+        )
+        return Activity.objects.create(
+            user=self.user,
+            item=item,
+            start_time=day(start),
+            end_time=day(end),
+            **kwargs,
+        )
+
+    def test_overlapping_window(self):
+        book = self.make_books(1)[0]
+        before = self.activity(book, 1, 4, finished=True)
+        during = self.activity(book, 5, 8, finished=True)
+        ongoing = self.activity(book, 2)
+        ended_only = self.activity(book, end=6, finished=True)
+        self.activity(book, 20, 22)
+        res = self.client.get("/api/activity/timeline?from=2024-03-05&to=2024-03-10")
+        tokens = [a["token"] for a in res.json()["results"]]
+        self.assertEqual(tokens, [ongoing.token, during.token, ended_only.token])
+        self.assertNotIn(before.token, tokens)
+        self.assertFalse(res.json()["truncated"])
+
+        res = self.client.get("/api/activity/timeline?at=2024-03-03").json()
+        self.assertEqual(
+            {a["token"] for a in res["results"]}, {before.token, ongoing.token}
+        )
+        self.assertEqual(self.client.get("/api/activity/timeline").status_code, 400)
+        self.assertEqual(
+            self.client.get("/api/activity/timeline?at=whenever").status_code, 400
+        )
+
+    def test_concurrent(self):
+        book = self.make_books(1)[0]
+        reading = self.activity(book, 5, 8)
+        overlap = self.activity(book, 7, 9)
+        self.activity(book, 9, 10)
+        res = self.client.get(f"/api/activity/{reading.token}/concurrent").json()
+        self.assertEqual([a["token"] for a in res["results"]], [overlap.token])
+
+        ongoing = self.activity(book, 2)
+        url = f"/api/activity/{reading.token}/concurrent?page_size=1"
+        res = self.client.get(url).json()
+        self.assertEqual(res["count"], 2)
+        self.assertEqual([a["token"] for a in res["results"]], [ongoing.token])
+        res = self.client.get(f"{url}&cursor=").json()
+        res = self.client.get(res["next"]).json()
+        self.assertEqual([a["token"] for a in res["results"]], [overlap.token])
+        self.assertIsNone(res["next"])
+
+    def test_uses_span_index(self):
+        window = (
+            datetime.datetime(2024, 3, 5, tzinfo=datetime.timezone.utc),
+            datetime.datetime(2024, 3, 6, tzinfo=datetime.timezone.utc),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        # without the user filter, so the user_id index can't win on an empty table
+        plan = Activity.objects.overlapping(*window).explain()
+        self.assertIn("activity_span_idx", plan)
+
+
+class SyntheticLibraryTestCase(TestCase):
+    def test_generate(self):
+        (user,), report = generate_users(1, 60, 300, depth=3, seed=1)
+        self.assertEqual(report.as_dict(), {"users": 1, "items": 60, "activities": 300})
+        self.assertEqual(Activity.objects.filter(user=user).count(), 300)
+        self.assertTrue(
+            Item.objects.filter(
+                user=user, parent__parent__parent__isnull=False
+            ).exists()
+        )
+        self.assertFalse(Item.objects.filter(user=user, name="").exists())
+        self.assertEqual(
+            ActivityRollup.objects.filter(user=user).aggregate(n=Sum("count"))["n"],
+            300,
+        )
+        # same seed, same library
+        (again,), _ = generate_users(1, 60, 300, depth=3, seed=1, email_prefix="again")
+        self.assertEqual(
+            list(Item.objects.filter(user=user).order_by("pk").values_list("info")),
+            list(Item.objects.filter(user=again).order_by("pk").values_list("info")),
+        )
+
+    def test_emails_taken(self):
+        generate_users(2, 5, 5, seed=3)
+        users = User.objects.count()
+        with self.assertRaises(CommandError):
+            call_command("generate_library", users=3, items=5, activities=5, seed=3)
+        self.assertEqual(User.objects.count(), users)
+
+    def test_benchmark_covers_every_route(self):
+        results = run_benchmarks([(40, 200)], repeat=1)
+        self.assertEqual(results["missing_routes"], [])
+        (size,) = results["sizes"]
+        self.assertEqual(
+            {t["route"] for t in size["timings"]}, set(benchmarked_routes())
+        )
+        # the benchmark user isn't staff
+        self.assertEqual(
+            [
+                t
+                for t in size["timings"]
+                if t["status"] >= 400 and t["route"] != "metrics"
+            ],
+            [],
+        )
+        self.assertFalse(User.objects.filter(email__startswith="benchmark").exists())
+        json.dumps(results)
+        self.assertEqual(compare_benchmarks(results, results), [])
+
+    @override_settings(RESPONSE_CACHE=True)
+    def test_benchmark_skips_response_cache(self):
+        cached = []
+
+        def time_request(*args):
+            cached.append(settings.RESPONSE_CACHE)
+            return Timing("item", "list", "get")
+
+        with mock.patch("app.utils.route_benchmark.time_request", time_request):
+            run_benchmarks([(5, 5)], repeat=1, routes=["item"])
+        self.assertTrue(cached)
+        self.assertFalse(any(cached))
+
+
+class ServerTimingTestCase(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        route_metrics.reset()
+
+    def test_staff_get_server_timing(self):
+        self.make_books(3)
+        res = self.client.get("/api/item")
+        self.assertNotIn("Server-Timing", res)
+
+        self.user.is_staff = True
+        self.user.save()
+        res = self.client.get("/api/activity")
+        timing = dict(
+            metric.split(";", 1)[0:2] for metric in res["Server-Timing"].split(", ")
+        )
+        self.assertEqual(set(timing), {"db", "serialize", "names", "total"})
+        self.assertRegex(timing["db"], r'dur=[\d.]+;desc="\d+ queries"')
+
+    def test_metrics(self):
+        self.client.get("/api/item")
+        self.client.get("/api/item")
+        self.assertEqual(self.client.get("/api/metrics").status_code, 403)
+
+        self.user.is_staff = True
+        self.user.save()
+        body = self.client.get("/api/metrics").content.decode()
+        self.assertIn(
+            'pillowbook_request_duration_seconds_count{route="api/item",method="GET"} 2',
+            body,
+        )
+        self.assertIn(
+            'pillowbook_request_duration_seconds_bucket{route="api/item",method="GET",le="+Inf"} 2',
+            body,
+        )
+        self.assertRegex(
+            body,
+            r'pillowbook_request_phase_seconds_total\{route="api/item",method="GET",phase="serialize"\} [\d.e-]+',
+        )
+
+    def test_unknown_methods_share_a_series(self):
+        for method in ["BREW", "WHEN"]:
+            self.client.generic(method, "/api/item")
+        self.assertEqual(set(route_metrics.totals), {("api/item", "other")})
+
+    def test_user_not_looked_up_for_timing(self):
+        self.user.is_staff = True
+        self.user.save()
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get("/nothing-here")
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+
+class AsyncReadsTestCase(LibraryTestCase):
+    """The async read views answer like the DRF views they stand in for"""
+
+    def test_same_answers_as_drf(self):
+        (book,) = self.make_books(1)
+        activity = book.activity_set.get()
+        item = Item.objects.select_related("item_type", "parent").get(pk=book.pk)
+        res = self.client.get(f"/api/item/{book.token}")
+        self.assertEqual(res.json(), ItemDetailSerializer(item).data)
+        self.assertEqual(
+            self.client.get(
+                f"/api/item/{book.token}", HTTP_IF_NONE_MATCH=res["ETag"]
+            ).status_code,
+            304,
+        )
+        res = self.client.get(f"/api/activity/{activity.token}")
+        self.assertEqual(res.json()["item"], book.token)
+        self.assertEqual(
+            [t["slug"] for t in self.client.get("/api/item_type").json()],
+            list(
+                ItemType.objects.filter(user=self.user).values_list("slug", flat=True)
+            ),
+        )
+
+        # writes still go to DRF
+        res = self.client.patch(
+            f"/api/item/{book.token}",
+            {"notes": "async"},
+            content_type="application/json",
+        )
+        self.assertEqual(res.json()["notes"], "async")
+        res = self.client.post("/api/item_type", {"name": "Comic"})
+        self.assertEqual(res.status_code, 201)
+
+        self.assertEqual(
+            self.client.get("/api/item/I_missing").json(),
+            {"detail": "Not found.", "status_code": 404},
+        )
+        self.client.logout()
+        res = self.client.get(f"/api/item/{book.token}")
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(res.json()["status_code"], 403)
+        self.assertEqual(
+            self.client.get("/api/get_items_static_filters").status_code, 302
+        )
+
+    async def test_asgi(self):
+        (book,) = await sync_to_async(self.make_books)(1)
+        self.user.is_staff = True
+        await self.user.asave()
+        await self.async_client.aforce_login(self.user)
+        for url in [
+            f"/api/item/{book.token}",
+            f"/api/get_autocomplete_suggestions/{self.book_type.slug}?q=B",
+            "/api/get_activities_static_filters",
+            "/api/item?page_size=5",
+        ]:
+            with self.subTest(url):
+                res = await self.async_client.get(url)
+                self.assertEqual(res.status_code, 200)
+                # queries on the async ORM's threads are counted too
+                self.assertRegex(res["Server-Timing"], r'desc="[1-9]\d* queries"')
+
+    async def test_export_streams(self):
+        await sync_to_async(self.make_books)(3)
+        expected = await sync_to_async(
+            lambda: b"".join(self.client.get("/api/export").streaming_content)
+        )()
+        await self.async_client.aforce_login(self.user)
+        res = await self.async_client.get("/api/export")
+        # not read into a list before the response starts
+        self.assertTrue(res.is_async)
+        self.assertEqual(b"".join([chunk async for chunk in res]), expected)
+
+    async def test_load(self):
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            status, seconds = await fetch(port, "/", drip_seconds=0.1)
+            self.assertEqual(status, 200)
+            self.assertGreaterEqual(seconds, 0.1)
+            latencies, errors, _ = await load(
+                port,
+                "/",
+                "",
+                requests=10,
+                concurrency=3,
+                slow_clients=2,
+                slow_seconds=0.1,
+            )
+        self.assertEqual((len(latencies), errors), (10, 0))
+
+
+class IconVariantsTestCase(LibraryTestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(
+            MEDIA_ROOT=media_root.name, ICON_PROCESSING="inline"
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def upload(self, url: str, color: str = "red"):
+        image = io.BytesIO()
+        Image.new("RGB", (1200, 800), color).save(image, "PNG")
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                url, {"file": SimpleUploadedFile("cover.png", image.getvalue())}
+            )
+        self.assertEqual(res.status_code, 200)
+
+    def test_variants(self):
+        (book,) = self.make_books(1)
+        self.upload(f"/api/item_icon/{book.token}")
+        book.refresh_from_db()
+        self.assertEqual(set(book.icon_variants), {"32", "64", "256"})
+        storage = book.icon.storage
+        for size, name in book.icon_variants.items():
+            with storage.open(name) as file, Image.open(file) as image:
+                self.assertEqual(image.format, "WEBP")
+                self.assertEqual(max(image.size), int(size))
+
+        listed = self.client.get("/api/item").json()["results"]
+        self.assertTrue(
+            next(i for i in listed if i["token"] == book.token)["icon_url"].endswith(
+                "-64.webp"
+            )
+        )
+        detail = self.client.get(f"/api/item/{book.token}").json()
+        self.assertTrue(detail["icon_url"].endswith("-256.webp"))
+
+        old_variants = book.icon_variants.values()
+        self.upload(f"/api/item_icon/{book.token}", "blue")
+        book.refresh_from_db()
+        self.assertFalse(any(storage.exists(name) for name in old_variants))
+        self.assertTrue(all(storage.exists(n) for n in book.icon_variants.values()))
+
+    def test_new_item_type(self):
+        image = io.BytesIO()
+        Image.new("RGB", (1200, 800), "red").save(image, "PNG")
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.post(
+                "/api/item_type",
+                {
+                    "name": "Comic",
+                    "icon": SimpleUploadedFile("cover.png", image.getvalue()),
+                },
+            )
+        self.assertEqual(res.status_code, 201)
+        comic = ItemType.objects.get(user=self.user, slug="comic")
+        self.assertEqual(set(comic.icon_variants), {"32", "64", "256"})
+        self.assertTrue(comic.icon_url_32.endswith("-32.webp"))
+
+        res = self.client.post(
+            "/api/item_type",
+            {"name": "Zine", "icon": SimpleUploadedFile("zine.png", b"not an image")},
+        )
+        self.assertEqual(res.status_code, 400)
+        self.assertFalse(ItemType.objects.filter(slug="zine").exists())
+
+    def test_original_until_made(self):
+        with override_settings(ICON_PROCESSING="off"):
+            self.upload(f"/api/item_type/{self.book_type.slug}/icon")
+        self.book_type.refresh_from_db()
+        self.assertEqual(self.book_type.icon_variants, {})
+        self.assertEqual(self.book_type.icon_url_32, self.book_type.icon_url)
+
+        call_command("make_icon_variants", stdout=io.StringIO())
+        self.book_type.refresh_from_db()
+        self.assertTrue(self.book_type.icon_url_32.endswith("-32.webp"))
+        res = self.client.get("/api/item_type").json()
+        self.assertIn(self.book_type.icon_url_32, [t["icon_url"] for t in res])
+
+    def test_same_bytes_stored_once(self):
+        books = self.make_books(2)
+        other = User.objects.create_user("icons@example.com", "pw")
+        other_type = ItemType.objects.create(user=other, slug="other-book", name="b")
+        for book in books:
+            self.upload(f"/api/item_icon/{book.token}")
+        self.client.force_login(other)
+        with self.assertNumQueries(7):
+            # known bytes - no new file, and the variants come along
+            self.upload(f"/api/item_type/{other_type.slug}/icon")
+        other_type.refresh_from_db()
+        (stored,) = StoredIcon.objects.all()
+        self.assertEqual(stored.refcount, 3)
+        self.assertEqual(other_type.icon.name, stored.name)
+        self.assertEqual(other_type.icon_variants, stored.variants)
+        storage = other_type.icon.storage
+        self.assertEqual(len(storage.listdir(os.path.dirname(stored.name))[1]), 4)
+
+        books[0].refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            books[0].delete()
+            other_type.delete()
+        self.client.force_login(self.user)
+        self.upload(f"/api/item_icon/{books[1].token}", "blue")
+        self.assertFalse(StoredIcon.objects.filter(pk=stored.pk).exists())
+        self.assertFalse(storage.exists(stored.name))
+        self.assertFalse(any(storage.exists(n) for n in stored.variants.values()))
+
+    def test_new_item_type_shares(self):
+        (book,) = self.make_books(1)
+        self.upload(f"/api/item_icon/{book.token}")
+        image = io.BytesIO()
+        Image.new("RGB", (1200, 800), "red").save(image, "PNG")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                "/api/item_type",
+                {
+                    "name": "Comic",
+                    "icon": SimpleUploadedFile("c.png", image.getvalue()),
+                },
+            )
+        comic = ItemType.objects.get(user=self.user, slug="comic")
+        (stored,) = StoredIcon.objects.all()
+        self.assertEqual(stored.refcount, 2)
+        self.assertEqual(comic.icon.name, stored.name)
+        self.assertTrue(comic.icon.name.startswith("icons/"))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            comic.delete()
+        self.assertEqual(StoredIcon.objects.get(pk=stored.pk).refcount, 1)
+
+    def test_cascades_release(self):
+        (book,) = self.make_books(1)
+        self.upload(f"/api/item_type/{self.book_type.slug}/icon")
+        self.upload(f"/api/item_icon/{book.token}")
+        (stored,) = StoredIcon.objects.all()
+        self.assertEqual(stored.refcount, 2)
+        storage = book.icon.storage
+
+        # the book goes with its type, without its delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemType.objects.get(pk=self.book_type.pk).delete()
+        self.assertFalse(StoredIcon.objects.exists())
+        self.assertFalse(storage.exists(stored.name))
+
+    def test_uploaded_again_before_deletion(self):
+        (book,) = self.make_books(1)
+        self.upload(f"/api/item_icon/{book.token}")
+        (stored,) = StoredIcon.objects.all()
+        with self.captureOnCommitCallbacks(execute=True):
+            Item.objects.get(pk=book.pk).delete()
+            self.upload(f"/api/item_type/{self.book_type.slug}/icon")
+        self.assertEqual(StoredIcon.objects.get(pk=stored.pk).refcount, 1)
+        self.assertTrue(book.icon.storage.exists(stored.name))
+
+    def test_share_legacy_icons(self):
+        books = self.make_books(2)
+        image = io.BytesIO()
+        Image.new("RGB", (40, 40), "green").save(image, "PNG")
+        for book in books:
+            book.icon.save("legacy.png", ContentFile(image.getvalue()))
+        legacy = [book.icon.name for book in books]
+        StoredIcon.objects.create(sha256="0" * 64, name="icons/00/unused.png")
+
+        call_command("share_icons", stdout=io.StringIO())
+        (stored,) = StoredIcon.objects.all()
+        self.assertEqual(stored.refcount, 2)
+        self.assertEqual(
+            set(Item.objects.filter(pk__in=[b.pk for b in books]).values_list("icon")),
+            {(stored.name,)},
+        )
+        self.assertFalse(any(books[0].icon.storage.exists(n) for n in legacy))
+
+    def test_served_immutable(self):
+        self.upload(f"/api/item_type/{self.book_type.slug}/icon")
+        self.book_type.refresh_from_db()
+        res = serve_icon(RequestFactory().get("/"), self.book_type.icon.name)
+        self.assertEqual(res["Cache-Control"], "public, max-age=31536000, immutable")
+
+
+class ApiTokenTestCase(LibraryTestCase):
+    """Signed API tokens sign requests in without the session"""
+
+    def setUp(self):
+        super().setUp()
+        self.client.logout()
+        token_keys.clear()
+        self.api_token, token = issue_token(self.user, "extension")
+        self.auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    @override_settings(RESPONSE_CACHE=False)
+    def test_reads_and_writes(self):
+        (book,) = self.make_books(1)
+        # the session lookup is skipped, the user is still fetched for its versions
+        token_keys.refresh()
+        with CaptureQueriesContext(connection) as with_token:
+            res = self.client.get("/api/settings", **self.auth)
+        self.assertEqual(res.status_code, 200)
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as with_session:
+            self.client.get("/api/settings")
+        self.assertEqual(len(with_token), len(with_session) - 1)
+        self.client.logout()
+
+        # the async views too
+        res = self.client.get(f"/api/item/{book.token}", **self.auth)
+        self.assertEqual(res.json()["token"], book.token)
+        # and no csrf token needed
+        csrf_client = self.client_class(enforce_csrf_checks=True)
+        res = csrf_client.post(
+            "/api/batch",
+            {
+                "operations": [
+                    {
+                        "op": "create",
+                        "model": "activity",
+                        "data": {
+                            "itemDetails": {"token": book.token},
+                            "activityDetails": {"finished": True},
+                        },
+                    }
+                ]
+            },
+            content_type="application/json",
+            **self.auth,
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(book.activity_set.count(), 2)
+        # not that a session can do without one
+        csrf_client.force_login(self.user)
+        res = csrf_client.patch(
+            "/api/settings", {"settings": {}}, content_type="application/json"
+        )
+        self.assertEqual(res.status_code, 403)
+
+    def test_rejected(self):
+        expired, _ = issue_token(self.user)
+        expired.expires = timezone.now() - datetime.timedelta(seconds=1)
+        other_user = User.objects.create_user("other@example.com", "pw")
+        token = self.auth["HTTP_AUTHORIZATION"].split()[1]
+        for label, token in [
+            ("expired", encode_token(expired)),
+            ("tampered", token.replace(f"pb_{self.user.pk}.", f"pb_{other_user.pk}.")),
+            ("unsigned", f"pb_{self.user.pk}.{self.api_token.key}.9999999999"),
+        ]:
+            with self.subTest(label):
+                res = self.client.get(
+                    "/api/settings", HTTP_AUTHORIZATION=f"Bearer {token}"
+                )
+                self.assertEqual(res.status_code, 401)
+                self.assertEqual(res.json()["status_code"], 401)
+                self.assertIn("invalid_token", res["WWW-Authenticate"])
+        # other schemes are left alone
+        res = self.client.get("/api/settings", HTTP_AUTHORIZATION="Bearer metrics")
+        self.assertEqual(res.status_code, 403)
+
+    def test_manage_and_revoke(self):
+        self.client.force_login(self.user)
+        res = self.client.post("/api/tokens", {"name": "phone", "days": 7})
+        self.assertEqual(res.status_code, 201)
+        created = res.json()
+        self.assertEqual(created["name"], "phone")
+        self.assertEqual(
+            [t["name"] for t in self.client.get("/api/tokens").json()],
+            ["phone", "extension"],
+        )
+        self.assertEqual(
+            self.client.post("/api/tokens", {"days": 1000}).status_code, 400
+        )
+        phone = {"HTTP_AUTHORIZATION": f"Bearer {created['token']}"}
+        self.assertEqual(self.client.get("/api/settings", **phone).status_code, 200)
+
+        # straight away in this process
+        with self.captureOnCommitCallbacks(execute=True):
+            res = self.client.delete(f"/api/tokens/{created['key']}")
+        self.assertEqual(res.status_code, 204)
+        self.assertIsNotNone(
+            self.client.get(f"/api/tokens/{created['key']}").json()["revoked"]
+        )
+        self.client.logout()
+        self.assertEqual(self.client.get("/api/settings", **phone).status_code, 401)
+        self.assertEqual(self.client.get("/api/settings", **self.auth).status_code, 200)
+
+        # and in the others once they refresh
+        ApiToken.objects.filter(pk=self.api_token.pk).update(revoked=timezone.now())
+        self.assertEqual(self.client.get("/api/settings", **self.auth).status_code, 200)
+        token_keys.refreshed_at -= REVOCATION_REFRESH_SECONDS
+        self.assertEqual(self.client.get("/api/settings", **self.auth).status_code, 401)
+
+    def test_deleted_tokens(self):
+        self.assertEqual(self.client.get("/api/settings", **self.auth).status_code, 200)
+        ApiToken.objects.filter(pk=self.api_token.pk).delete()
+        token_keys.refreshed_at -= REVOCATION_REFRESH_SECONDS
+        self.assertEqual(self.client.get("/api/settings", **self.auth).status_code, 401)
+
+    def test_inactive_users(self):
+        with mock.patch.object(User, "is_active", False):
+            res = self.client.get("/api/settings", **self.auth)
+        self.assertEqual(res.status_code, 401)
+
+    def test_tokens_need_a_session(self):
+        # so a leaked token can't make itself more tokens, or outlive its revocation
+        self.assertEqual(self.client.get("/api/tokens", **self.auth).status_code, 403)
+        res = self.client.post("/api/tokens", {"name": "more"}, **self.auth)
+        self.assertEqual(res.status_code, 403)
+        res = self.client.delete(f"/api/tokens/{self.api_token.key}", **self.auth)
+        self.assertEqual(res.status_code, 403)
+        self.assertEqual(ApiToken.objects.filter(user=self.user).count(), 1)
+
+
+class ItemHierarchyTestCase(LibraryTestCase):
+    """Ancestors and descendants come from one recursive query, however deep"""
+
+    def setUp(self):
+        super().setUp()
+        self.books = self.make_books(3, depth=4)
+        self.series = list(reversed(self.books[0].ancestors))
+
+    def test_querysets(self):
+        root, *_, deepest = self.series
+        with self.assertNumQueries(1):
+            ancestors = set(Item.objects.ancestors_of([self.books[0].pk]))
+        self.assertEqual(ancestors, set(self.series))
+        with self.assertNumQueries(1):
+            descendants = set(Item.objects.descendants_of([root.pk]))
+        self.assertEqual(descendants, {*self.series[1:], *self.books})
+        self.assertFalse(Item.objects.descendants_of([self.books[0].pk]).exists())
+
+        # parents that loop don't loop forever
+        Item.objects.filter(pk=root.pk).update(parent=deepest)
+        self.assertEqual(set(Item.objects.ancestors_of([root.pk])), set(self.series))
+
+    def test_with_ancestors(self):
+        with self.assertNumQueries(2):
+            books = list(
+                Item.objects.filter(item_type=self.book_type)
+                .select_related("item_type")
+                .with_ancestors()
+            )
+            # walking up costs nothing more
+            for book in books:
+                self.assertEqual(book.ancestors, self.series[::-1])
+                self.assertEqual(book.parent.parent.parent.parent, self.series[0])
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                list(
+                    Item.objects.filter(pk=self.series[0].pk)
+                    .with_ancestors()[0]
+                    .ancestors
+                ),
+                [],
+            )
+        res = self.client.get(f"/api/item/{self.books[0].token}").json()
+        self.assertEqual(
+            [a["token"] for a in res["ancestors"]],
+            [s.token for s in reversed(self.series)],
+        )
+        res = self.client.get(f"/api/item?itemTypes={self.book_type.slug}").json()
+        self.assertEqual(
+            [a["name"] for a in res["results"][0]["ancestors"]],
+            [s.name for s in reversed(self.series)],
+        )
+
+    def test_ancestors_however_fetched(self):
+        books = Item.objects.filter(item_type=self.book_type).with_ancestors()
+        with self.assertNumQueries(3):
+            # one chunk and its ancestors, then the ancestors of the rest
+            fetched = list(books.iterator(chunk_size=2))
+            for book in fetched:
+                self.assertEqual(book.parent.parent.parent.parent, self.series[0])
+        # the parent, its books and their ancestors
+        with self.assertNumQueries(3):
+            (parent,) = Item.objects.filter(pk=self.series[-1].pk).prefetch_related(
+                Prefetch("item_set", queryset=books, to_attr="books")
+            )
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [b.ancestors for b in parent.books], [self.series[::-1]] * 3
+            )
+        self.assertEqual(books.values_list("pk", flat=True).count(), len(self.books))
+
+    async def test_ancestors_async(self):
+        books = Item.objects.filter(item_type=self.book_type).with_ancestors()
+        async for book in books.aiterator(chunk_size=2):
+            self.assertEqual(
+                [a.pk for a in book.ancestors], [s.pk for s in self.series[::-1]]
+            )
+
+    def test_tree(self):
+        with CaptureQueriesContext(connection) as shallow:
+            res = self.client.get(f"/api/item/{self.series[-1].token}/tree")
+        self.assertEqual(
+            [c["token"] for c in res.json()["children"]],
+            [b.token for b in self.books],
+        )
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get(f"/api/item/{self.series[1].token}/tree")
+        self.assertEqual(len(shallow), len(deep))
+
+        node = self.client.get(f"/api/item/{self.series[0].token}/tree").json()
+        self.assertEqual(node["ancestors"], [])
+        for series in self.series[1:]:
+            (node,) = node["children"]
+            self.assertEqual(node["token"], series.token)
+        self.assertEqual(len(node["children"]), 3)
+        self.assertEqual(node["children"][0]["children"], [])
+
+
+class SeriesTestCase(LibraryTestCase):
+    """A series and how far along each of its books is, from one grouped query"""
+
+    def series_queries(self, series: Item) -> int:
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(f"/api/item/{series.token}/series")
+        self.assertEqual(res.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_series(self):
+        first, second, unread = self.make_books(3)
+        series = first.parent
+        now = timezone.now()
+        Activity.objects.filter(item=first).update(rating=0.5, end_time=now)
+        latest = Activity.objects.create(
+            user=self.user,
+            item=first,
+            rating=1,
+            start_time=now + datetime.timedelta(days=1),
+        )
+        Activity.objects.filter(item=second).update(finished=False)
+        unread.activity_set.all().delete()
+
+        res = self.client.get(f"/api/item/{series.token}/series").json()
+        self.assertEqual(res["token"], series.token)
+        self.assertEqual(res["finished_count"], 1)
+        children = {c["token"]: c for c in res["children"]}
+        self.assertEqual(children[first.token]["activity_count"], 2)
+        self.assertTrue(children[first.token]["finished"])
+        self.assertEqual(children[first.token]["average_rating"], 0.75)
+        self.assertEqual(
+            children[first.token]["latest_activity"]["token"], latest.token
+        )
+        self.assertFalse(children[second.token]["finished"])
+        self.assertIsNone(children[second.token]["average_rating"])
+        self.assertEqual(
+            children[unread.token],
+            {
+                **children[unread.token],
+                "activity_count": 0,
+                "finished": False,
+                "latest_activity": None,
+            },
+        )
+
+    def test_flat(self):
+        (book,) = self.make_books(1)
+        small = self.series_queries(book.parent)
+        books = self.make_books(50)
+        for book in books[:10]:
+            Activity.objects.create(user=self.user, item=book, rating=0.4)
+        self.assertEqual(small, self.series_queries(books[0].parent))
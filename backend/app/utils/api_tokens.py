@@ -0,0 +1,142 @@
+import datetime
+import threading
+import time
+
+from django.core import signing
+from django.db import transaction
+from django.db.models import QuerySet
+from django.http import HttpRequest
+from django.utils import timezone
+
+from app.models import ApiToken, User
+
+TOKEN_PREFIX = "pb_"
+TOKEN_LIFETIME = datetime.timedelta(days=90)
+MAX_TOKEN_LIFETIME = datetime.timedelta(days=365)
+# how stale another process's view of revocations can be
+REVOCATION_REFRESH_SECONDS = 30
+
+_signer = signing.Signer(salt="app.api_tokens")
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenKeys:
+    """
+    Keys of the tokens still good for signing in - not revoked, not expired and still in the database -
+    read again from the database at most every `refresh_seconds`. A key it hasn't seen since (made by
+    another process, or deleted) is looked up on its own. Revoking through revoke() counts here
+    straight away, in other processes within `refresh_seconds`
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.live: set[str] = set()
+        self.dead: set[str] = set()
+        self.refreshed_at = float("-inf")
+        self.lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        if time.monotonic() - self.refreshed_at > self.refresh_seconds:
+            self.refresh()
+        if key in self.live:
+            return True
+        if key in self.dead:
+            return False
+        live = _live_tokens().filter(key=key).exists()
+        with self.lock:
+            if live:
+                self.live = self.live | {key}
+            else:
+                self.dead = self.dead | {key}
+        return live
+
+    def refresh(self) -> None:
+        keys = set(_live_tokens().values_list("key", flat=True))
+        with self.lock:
+            self.live = keys
+            self.dead = set()
+            self.refreshed_at = time.monotonic()
+
+    def revoke(self, key: str) -> None:
+        with self.lock:
+            self.live = self.live - {key}
+            self.dead = self.dead | {key}
+
+    def clear(self) -> None:
+        with self.lock:
+            self.live = set()
+            self.dead = set()
+            self.refreshed_at = float("-inf")
+
+
+def _live_tokens() -> QuerySet[ApiToken]:
+    return ApiToken.objects.filter(revoked__isnull=True, expires__gt=timezone.now())
+
+
+token_keys = TokenKeys(REVOCATION_REFRESH_SECONDS)
+
+
+def encode_token(api_token: ApiToken) -> str:
+    expires = int(api_token.expires.timestamp())
+    return TOKEN_PREFIX + _signer.sign(f"{api_token.user_id}.{api_token.key}.{expires}")
+
+
+def issue_token(
+    user: User, name: str = "", lifetime: datetime.timedelta = TOKEN_LIFETIME
+) -> tuple[ApiToken, str]:
+    """A new token for `user`, and the only time its signed form is seen"""
+    api_token = ApiToken.objects.create(
+        user=user, name=name, expires=timezone.now() + min(lifetime, MAX_TOKEN_LIFETIME)
+    )
+    return api_token, encode_token(api_token)
+
+
+def decode_token(token: str) -> tuple[int, str]:
+    """
+    The user pk and key of a token signed here that hasn't expired, been revoked or been deleted,
+    mostly without going to the database, see TokenKeys. Raises InvalidToken
+    """
+    if not token.startswith(TOKEN_PREFIX):
+        raise InvalidToken("Invalid token.")
+    try:
+        user_id, key, expires = _signer.unsign(token[len(TOKEN_PREFIX) :]).split(".")
+        user_id, expires = int(user_id), int(expires)
+    except (signing.BadSignature, ValueError):
+        raise InvalidToken("Invalid token.")
+    if expires <= time.time():
+        raise InvalidToken("Token has expired.")
+    if key not in token_keys:
+        raise InvalidToken("Token has been revoked.")
+    return user_id, key
+
+
+def user_for_token(token: str) -> User:
+    user_id, _ = decode_token(token)
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.is_active:
+        raise InvalidToken("Invalid token.")
+    return user
+
+
+def bearer_token(request: HttpRequest) -> str | None:
+    """The API token in the Authorization header, if that's what's there"""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token.startswith(TOKEN_PREFIX):
+        return token
+    return None
+
+
+def revoke(tokens: QuerySet[ApiToken]) -> int:
+    """Revokes `tokens`, returns how many weren't already"""
+    keys = list(tokens.filter(revoked__isnull=True).values_list("key", flat=True))
+    ApiToken.objects.filter(key__in=keys).update(revoked=timezone.now())
+
+    def remember():
+        for key in keys:
+            token_keys.revoke(key)
+
+    transaction.on_commit(remember)
+    return len(keys)
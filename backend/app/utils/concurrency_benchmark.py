@@ -0,0 +1,268 @@
+import asyncio
+import contextlib
+import datetime
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+
+from app.utils.route_benchmark import BENCHMARK_PASSWORD, Fixture
+from app.utils.synthetic_library import generate_users
+
+# the reads that have async versions, see app.api.async_views
+CONCURRENCY_PATHS: dict[str, Callable[[Fixture], str]] = {
+    "autocomplete": lambda f: f"/api/get_autocomplete_suggestions/{f.item_type.slug}?q={f.search_word[:2]}",
+    "static_filters": lambda f: "/api/get_activities_static_filters",
+    "item_types": lambda f: "/api/item_type",
+    "item": lambda f: f"/api/item/{f.item.token}",
+    "activity": lambda f: f"/api/activity/{f.activity.token}",
+    # still a sync DRF view, for comparison
+    "activity_list": lambda f: "/api/activity?page_size=20",
+}
+
+# gunicorn arguments after the shared ones, per interface
+SERVER_ARGUMENTS = {
+    "wsgi": ["backend.wsgi"],
+    "asgi": [
+        "--worker-class",
+        "uvicorn.workers.UvicornWorker",
+        "backend.asgi:application",
+    ],
+}
+
+REQUEST_TIMEOUT = 60
+
+
+@dataclass
+class LoadResult:
+    interface: str
+    path: str
+    requests: int
+    errors: int
+    seconds: float
+    latencies: list[float]
+
+    def as_dict(self) -> dict[str, Any]:
+        ms = sorted(latency * 1000 for latency in self.latencies) or [0.0]
+        return {
+            "interface": self.interface,
+            "path": self.path,
+            "requests": self.requests,
+            "errors": self.errors,
+            "requests_per_second": round(self.requests / self.seconds, 1)
+            if self.seconds
+            else None,
+            "median_ms": round(statistics.median(ms), 3),
+            "p95_ms": round(ms[min(int(len(ms) * 0.95), len(ms) - 1)], 3),
+            "max_ms": round(ms[-1], 3),
+        }
+
+
+def _request_bytes(path: str, cookie: str) -> bytes:
+    return (
+        f"GET {path} HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n"
+        "Connection: close\r\n\r\n"
+    ).encode()
+
+
+async def fetch(
+    port: int, path: str, cookie: str = "", drip_seconds: float = 0
+) -> tuple[int, float]:
+    """
+    One GET, its status and the seconds until the whole response was in. With `drip_seconds` the request
+    goes out a byte at a time over that long, like a phone on a bad connection
+    """
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        request = _request_bytes(path, cookie)
+        if drip_seconds:
+            pause = drip_seconds / len(request)
+            for i in range(len(request)):
+                writer.write(request[i : i + 1])
+                await writer.drain()
+                await asyncio.sleep(pause)
+        else:
+            writer.write(request)
+            await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+    status = int(response.split(b" ", 2)[1]) if response else 0
+    return status, time.perf_counter() - started
+
+
+async def load(
+    port: int,
+    path: str,
+    cookie: str,
+    requests: int,
+    concurrency: int,
+    slow_clients: int = 0,
+    slow_seconds: float = 0,
+) -> tuple[list[float], int, float]:
+    """
+    `requests` GETs of `path`, `concurrency` at a time, while `slow_clients` others trickle in
+    the same request. The latencies of the successful ones, how many failed and how long it took
+    """
+    slow = [
+        asyncio.create_task(fetch(port, path, cookie, slow_seconds))
+        for _ in range(slow_clients)
+    ]
+    if slow:
+        # let them connect and start tying things up
+        await asyncio.sleep(min(0.5, slow_seconds / 4))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> tuple[int, float]:
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(
+                    fetch(port, path, cookie), REQUEST_TIMEOUT
+                )
+            except (OSError, asyncio.TimeoutError, ValueError):
+                return 0, 0.0
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*[one() for _ in range(requests)])
+    seconds = time.perf_counter() - started
+    await asyncio.gather(*slow, return_exceptions=True)
+    latencies = [latency for status, latency in results if status == 200]
+    return latencies, len(results) - len(latencies), seconds
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_listening(port: int, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The server exited with {process.returncode}")
+        try:
+            status, _ = asyncio.run(fetch(port, "/api/version"))
+            if status:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Nothing listening on {port} after {timeout}s")
+
+
+@contextlib.contextmanager
+def serve(interface: str, workers: int) -> Iterator[int]:
+    """gunicorn serving this project through `interface` on a free port, stopped afterwards"""
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--workers",
+            str(workers),
+            "--bind",
+            f"127.0.0.1:{port}",
+            *SERVER_ARGUMENTS[interface],
+        ],
+        cwd=settings.BASE_DIR,
+        # every request should reach the database
+        env={**os.environ, "RESPONSE_CACHE": "False"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_listening(port, process)
+        yield port
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run_concurrency_benchmark(
+    interfaces: list[str],
+    items: int = 1000,
+    activities: int = 10000,
+    paths: list[str] | None = None,
+    requests: int = 200,
+    concurrency: int = 20,
+    slow_clients: int = 20,
+    slow_seconds: float = 5,
+    workers: int = 3,
+    seed: int = 0,
+    progress: Callable[[str], None] = lambda message: None,
+) -> dict[str, Any]:
+    """
+    Serves the project with gunicorn per interface - sync WSGI workers, or uvicorn workers on ASGI -
+    and times reads of one synthetic library while slow clients hold connections open.
+    The library is committed for the servers to see, and deleted afterwards
+    """
+    progress(f"generating {items} items, {activities} activities")
+    (user,), _ = generate_users(
+        1,
+        items,
+        activities,
+        seed=seed,
+        email_prefix="concurrency",
+        password=BENCHMARK_PASSWORD,
+    )
+    results = []
+    try:
+        fixture = Fixture.for_user(user)
+        client = Client()
+        client.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.session.session_key}"
+        for interface in interfaces:
+            progress(f"starting {workers} {interface} workers")
+            with serve(interface, workers) as port:
+                for name in paths or CONCURRENCY_PATHS:
+                    progress(f"  {name}")
+                    latencies, errors, seconds = asyncio.run(
+                        load(
+                            port,
+                            CONCURRENCY_PATHS[name](fixture),
+                            cookie,
+                            requests,
+                            concurrency,
+                            slow_clients,
+                            slow_seconds,
+                        )
+                    )
+                    results.append(
+                        LoadResult(
+                            interface, name, requests, errors, seconds, latencies
+                        ).as_dict()
+                    )
+    finally:
+        user.delete()
+    return {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": os.environ.get("COMMIT_HASH", "local"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "postgres": connection.pg_version,
+        "items": items,
+        "activities": activities,
+        "workers": workers,
+        "concurrency": concurrency,
+        "slow_clients": slow_clients,
+        "slow_seconds": slow_seconds,
+        "results": results,
+    }
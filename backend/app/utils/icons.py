@@ -0,0 +1,216 @@
+import hashlib
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, models, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.models import Item, ItemType, StoredIcon, User
+
+logger = logging.getLogger(__name__)
+
+# px, the longest side of each variant. Lists show 50px icons, the menu smaller, detail pages bigger
+ICON_SIZES = (32, 64, 256)
+ICON_QUALITY = 80
+# content addressed, so nothing under here ever changes - see prod.caddy and backend.urls
+ICON_DIRECTORY = "icons"
+ICON_MODELS = (ItemType, Item)
+IMAGE_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+# one at a time, so a burst of uploads can't eat every core the web workers need
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="icons")
+
+
+def icon_storage():
+    return Item._meta.get_field("icon").storage
+
+
+def render_icon_variants(file) -> dict[int, bytes]:
+    """WebP encodings of an image at each of ICON_SIZES, never scaled up"""
+    with Image.open(file) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert(
+            "RGBA" if image.mode in {"RGBA", "LA", "P", "PA"} else "RGB"
+        )
+        variants = {}
+        for size in sorted(ICON_SIZES, reverse=True):
+            # each from the last, the biggest first - shrinking a 256px copy is much cheaper
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            image.save(out, "WEBP", quality=ICON_QUALITY, method=4)
+            variants[size] = out.getvalue()
+    return variants
+
+
+def variant_name(original: str, size: int) -> str:
+    stem, _ = os.path.splitext(original)
+    return f"{stem}-{size}.webp"
+
+
+def delete_icon_variants(variants: dict[str, str], storage) -> None:
+    for name in variants.values():
+        storage.delete(name)
+
+
+def _save_once(name: str, file) -> str:
+    """
+    Write `file` as `name` unless it's there already - same name, same bytes. Call with its StoredIcon
+    row locked, or StoredIconQuerySet.delete_unused could remove a file just found here
+    """
+    storage = icon_storage()
+    if not storage.exists(name):
+        saved = storage.save(name, file)
+        if saved != name:
+            # written by someone else in the meantime, and given another name
+            storage.delete(saved)
+    return name
+
+
+def store_icon_file(file) -> StoredIcon:
+    """
+    The StoredIcon for an upload, writing the file the first time those bytes are seen.
+    Counts one more user of it. Raises UnidentifiedImageError for anything but an image
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    with Image.open(file) as image:
+        extension = IMAGE_EXTENSIONS.get(image.format, f".{image.format.lower()}")
+    file.seek(0)
+    sha256 = digest.hexdigest()
+    name = f"{ICON_DIRECTORY}/{sha256[:2]}/{sha256}{extension}"
+    # the row first - it's locked until we commit, and delete_unused waits for it
+    stored = StoredIcon.objects.acquire(sha256, name)
+    _save_once(name, file)
+    return stored
+
+
+def make_icon_variants(stored_icon_pk: int) -> dict[str, str] | None:
+    """
+    Writes the variants of a StoredIcon and hands them to every item and item type using it.
+    None if there's nothing to do
+    """
+    stored = StoredIcon.objects.filter(pk=stored_icon_pk).first()
+    if stored is None:
+        return None
+    try:
+        with icon_storage().open(stored.name) as file:
+            rendered = render_icon_variants(file)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning(f"Couldn't make icon variants of {stored.name}", exc_info=True)
+        return None
+
+    with transaction.atomic():
+        # held while the files are written, see _save_once
+        if not StoredIcon.objects.select_for_update().filter(pk=stored.pk).exists():
+            return None
+        variants = {
+            str(size): _save_once(variant_name(stored.name, size), ContentFile(content))
+            for size, content in rendered.items()
+        }
+        StoredIcon.objects.filter(pk=stored.pk).update(variants=variants)
+    user_ids = set()
+    for model in ICON_MODELS:
+        users = model.objects.filter(icon=stored.name)
+        user_ids.update(users.values_list("user_id", flat=True))
+        users.update(icon_variants=variants)
+    for user_id in user_ids:
+        # the icon urls in their lists change
+        User.objects.bump_versions(user_id, "library", "item_type")
+    return variants
+
+
+def set_icon(instance: Item | ItemType, file) -> None:
+    """
+    Swap the icon of an Item or ItemType for an upload (or None), sharing the file - and its variants -
+    with anyone who uploaded the same bytes. Raises UnidentifiedImageError for anything but an image
+    """
+    old_name, old_variants = instance.icon.name, instance.icon_variants
+    stored = store_icon_file(file) if file else None
+    instance.icon = stored.name if stored else None
+    instance.icon_variants = stored.variants if stored else {}
+    instance.save()
+    if old_name and not StoredIcon.objects.release(old_name):
+        # uploaded before icons were shared, so only ever this row's
+        storage = icon_storage()
+        transaction.on_commit(lambda: delete_icon_variants(old_variants, storage))
+    if stored and not stored.variants:
+        schedule_icon_variants(stored)
+
+
+def _make_icon_variants_in_background(pk: int):
+    try:
+        make_icon_variants(pk)
+    except Exception:
+        logger.exception(f"Making icon variants of stored icon {pk} failed")
+    finally:
+        close_old_connections()
+
+
+def schedule_icon_variants(stored: StoredIcon) -> None:
+    """
+    Make variants of a new icon once the transaction commits, off the request.
+    ICON_PROCESSING is "thread" (the default), "inline" to do it before returning,
+    or "off" to leave it to `manage.py make_icon_variants`
+    """
+    mode = settings.ICON_PROCESSING
+    if mode == "off":
+        return
+    pk = stored.pk
+    if mode == "inline":
+        transaction.on_commit(lambda: make_icon_variants(pk))
+    else:
+        transaction.on_commit(
+            lambda: _executor.submit(_make_icon_variants_in_background, pk)
+        )
+
+
+def share_legacy_icons() -> int:
+    """Moves icons uploaded before StoredIcon under their hashes, returns how many"""
+    storage = icon_storage()
+    moved = 0
+    for model in ICON_MODELS:
+        legacy = model.objects.exclude(icon="").exclude(icon__isnull=True)
+        for instance in legacy.exclude(icon__startswith=f"{ICON_DIRECTORY}/"):
+            old_name, old_variants = instance.icon.name, instance.icon_variants
+            try:
+                with storage.open(old_name) as file, transaction.atomic():
+                    stored = store_icon_file(ContentFile(file.read(), name=old_name))
+                    model.objects.filter(pk=instance.pk).update(
+                        icon=stored.name, icon_variants=stored.variants
+                    )
+            except (OSError, UnidentifiedImageError):
+                logger.warning(f"Couldn't move icon {old_name}", exc_info=True)
+                continue
+            delete_icon_variants({"": old_name, **old_variants}, storage)
+            if not stored.variants:
+                make_icon_variants(stored.pk)
+            moved += 1
+    return moved
+
+
+def recount_stored_icons() -> int:
+    """Fixes every StoredIcon's refcount from what uses it, dropping the unused ones. Returns how many went"""
+    counts: dict[str, int] = {}
+    for model in ICON_MODELS:
+        for name, count in (
+            model.objects.filter(icon__startswith=f"{ICON_DIRECTORY}/")
+            .values_list("icon")
+            .annotate(n=models.Count("pk"))
+            .order_by()
+        ):
+            counts[name] = counts.get(name, 0) + count
+    dropped = 0
+    for stored in StoredIcon.objects.all().iterator():
+        refcount = counts.get(stored.name, 0)
+        if refcount != stored.refcount:
+            StoredIcon.objects.filter(pk=stored.pk).update(refcount=refcount)
+        if not refcount:
+            StoredIcon.objects.delete_unused(stored.name)
+            dropped += 1
+    return dropped
@@ -0,0 +1,189 @@
+import csv
+import datetime
+import json
+from itertools import islice
+from typing import Any, AsyncIterator, Generator, Iterator
+
+from asgiref.sync import sync_to_async
+
+from app.models import Activity, Item, ItemType, User
+from app.utils.library_import import ACTIVITY_COLUMNS
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {"jsonl", "csv"}
+
+ITEM_TYPE_FIELDS = [
+    "slug",
+    "name",
+    "name_schema",
+    "item_schema",
+    "activity_schema",
+    "parent_slug",
+]
+ITEM_FIELDS = {
+    "token": "token",
+    "item_type": "item_type__slug",
+    "name": "name",
+    "info": "info",
+    "parent": "parent__token",
+    "notes": "notes",
+    "rating": "rating",
+    "pinned": "pinned",
+    "created": "created",
+    "modified": "modified",
+}
+ACTIVITY_FIELDS = {
+    "token": "token",
+    "item": "item__token",
+    "start_time": "start_time",
+    "end_time": "end_time",
+    "finished": "finished",
+    "pending": "pending",
+    "rating": "rating",
+    "notes": "notes",
+    "info": "info",
+    "created": "created",
+    "modified": "modified",
+}
+
+
+def _json_default(value: Any) -> str:
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    raise TypeError(f"Can't export {type(value)}")
+
+
+def _rows(queryset, fields: dict[str, str]) -> Iterator[dict[str, Any]]:
+    # a server side cursor, so only one chunk of rows is ever in memory
+    for values in queryset.values_list(*fields.values()).iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    ):
+        yield dict(zip(fields, values))
+
+
+def export_jsonl(user: User) -> Iterator[str]:
+    """
+    Everything in the library, one JSON object per line: item types, then items, then activities,
+    each with a `kind`. Items and activities point at each other by token
+    """
+    for item_type in (
+        ItemType.objects.filter(user=user).order_by("pk").values(*ITEM_TYPE_FIELDS)
+    ):
+        yield json.dumps({"kind": "item_type", **item_type}) + "\n"
+    for row in _rows(Item.objects.filter(user=user).order_by("pk"), ITEM_FIELDS):
+        yield json.dumps({"kind": "item", **row}, default=_json_default) + "\n"
+    for row in _rows(
+        Activity.objects.filter(user=user).order_by("pk"), ACTIVITY_FIELDS
+    ):
+        yield json.dumps({"kind": "activity", **row}, default=_json_default) + "\n"
+
+
+class _Echo:
+    """A file for csv.writer that hands back what it's given, see Django's streaming csv docs"""
+
+    def write(self, value: str) -> str:
+        return value
+
+
+def _csv_cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def export_csv(user: User) -> Iterator[str]:
+    """
+    One row per activity, plus one for each item without any, in the columns LibraryImporter reads -
+    so an export can be imported into another account. Parents are given by token, and items come
+    a level of the tree at a time from the top, so parents are always written before their children.
+    Items whose parents loop come last, without them
+    """
+    item_types = ItemType.objects.filter(user=user).values_list(
+        "item_schema", flat=True
+    )
+    reserved = {"token", "item_type", "parent", "notes", *ACTIVITY_COLUMNS}
+    info_columns = sorted(
+        {
+            field
+            for schema in item_types
+            for field in schema.get("properties", {})
+            if field not in reserved
+        }
+    )
+    columns = [
+        "token",
+        "item_type",
+        *info_columns,
+        "parent",
+        "notes",
+        *sorted(ACTIVITY_COLUMNS),
+    ]
+    rating_max = user.settings.get("ratingMax", 5)
+    fields = {
+        "token": "token",
+        "item_type": "item_type__slug",
+        "info": "info",
+        "parent": "parent__token",
+        "notes": "notes",
+        "activity": "activity__pk",
+        "start_time": "activity__start_time",
+        "end_time": "activity__end_time",
+        "finished": "activity__finished",
+        "pending": "activity__pending",
+        "rating": "activity__rating",
+        "activity_notes": "activity__notes",
+    }
+
+    writer = csv.writer(_Echo())
+
+    def write(row: dict[str, Any]) -> str:
+        info = row.pop("info")
+        if row.pop("activity") is None:
+            # no activities, so just the item
+            row.update({column: None for column in ACTIVITY_COLUMNS})
+        elif row["rating"] is not None:
+            row["rating"] = round(row["rating"] * rating_max, 6)
+        row.update({field: info.get(field) for field in info_columns})
+        return writer.writerow([_csv_cell(row[column]) for column in columns])
+
+    yield writer.writerow(columns)
+    depth = 0
+    while True:
+        level = Item.objects.at_depth(user.pk, depth).order_by("pk", "activity__pk")
+        written = False
+        for row in _rows(level, fields):
+            written = True
+            yield write(row)
+        if not written:
+            break
+        depth += 1
+    # parents that loop never reach the top, and no order writes them first - so these go without
+    stranded = Item.objects.outside_trees(user.pk).order_by("pk", "activity__pk")
+    for row in _rows(stranded, fields):
+        yield write({**row, "parent": None})
+
+
+async def read_in_thread(lines: Generator[str, None, None]) -> AsyncIterator[str]:
+    """
+    `lines` for a response under ASGI, which would read a plain iterator to the end before sending
+    anything. Read EXPORT_CHUNK_SIZE at a time on the ORM's thread, so the server side cursors stay on
+    their connection
+    """
+    read = sync_to_async(lambda: "".join(islice(lines, EXPORT_CHUNK_SIZE)))
+    try:
+        while chunk := await read():
+            yield chunk
+    finally:
+        await sync_to_async(lines.close)()
+
+
+def export_library(user: User, export_format: str) -> Iterator[str]:
+    if export_format == "csv":
+        return export_csv(user)
+    return export_jsonl(user)
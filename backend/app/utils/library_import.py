@@ -0,0 +1,484 @@
+import csv
+import datetime
+import json
+import time
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Iterable, Iterator, TextIO
+
+from django.db import DatabaseError, connection, models, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from app.models import (
+    Activity,
+    ActivityRollup,
+    AutocompleteSuggestion,
+    Item,
+    ItemType,
+    RollupDeltas,
+    User,
+    rollup_key,
+    suggestion_values,
+)
+from app.utils.name_templates import get_tz
+
+IMPORT_CHUNK_SIZE = 1000
+FILE_FORMATS = {"csv": "csv", "jsonl": "jsonl", "ndjson": "jsonl"}
+
+ACTIVITY_COLUMNS = {
+    "start_time",
+    "end_time",
+    "finished",
+    "pending",
+    "rating",
+    "activity_notes",
+}
+TRUE_STRINGS = {"true", "t", "yes", "y", "1"}
+FALSE_STRINGS = {"false", "f", "no", "n", "0", ""}
+
+
+class RowError(ValueError):
+    pass
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    items_created: int = 0
+    activities_created: int = 0
+    errors: list[dict[str, Any]] = field(default_factory=list)
+    seconds: float = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            **asdict(self),
+            "rows_per_second": round(self.rows / self.seconds)
+            if self.seconds
+            else None,
+        }
+
+
+@dataclass
+class ImportRow:
+    number: int
+    item_type: ItemType
+    token: str | None
+    info: dict[str, Any]
+    parent: str | None
+    notes: str
+    activity: dict[str, Any] | None
+
+
+def file_format_for(filename: str) -> str | None:
+    return FILE_FORMATS.get(filename.rpartition(".")[2].lower())
+
+
+def read_rows(file: TextIO, file_format: str) -> Iterator[tuple[int, dict | RowError]]:
+    """(line number, row) for every row of the file, RowError for lines that don't parse"""
+    if file_format == "csv":
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(file, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, RowError(f"Invalid JSON: {e}")
+            continue
+        if not isinstance(row, dict):
+            yield line_num, RowError("Each line must be a JSON object")
+            continue
+        yield line_num, row
+
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in TRUE_STRINGS | FALSE_STRINGS:
+        return value.strip().lower() in TRUE_STRINGS
+    raise RowError(f"{value!r} is not a boolean")
+
+
+def _parse_number(value: str, integer: bool = False) -> int | float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise RowError(f"{value!r} is not a number")
+    if number.is_integer() and (integer or "." not in value):
+        return int(number)
+    return number
+
+
+def _coerce_csv_value(value: str, prop_type: str | None) -> Any:
+    # csv cells are all text, the schema says what they should have been
+    if prop_type == "number":
+        return _parse_number(value)
+    if prop_type == "integer":
+        return _parse_number(value, integer=True)
+    if prop_type == "boolean":
+        return _parse_bool(value)
+    return value
+
+
+def copy_insert(model: type[models.Model], objs: list[models.Model]):
+    """
+    bulk_create through COPY, which skips building one huge INSERT per batch.
+    pks are taken from the table's sequence up front, so related objects in `objs`
+    can point at each other whatever order they're in - foreign keys are checked at commit
+    """
+    if not objs:
+        return
+    opts = model._meta
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            [opts.db_table, opts.pk.column, len(objs)],
+        )
+        for obj, (pk,) in zip(objs, cursor.fetchall()):
+            obj.pk = pk
+        fields = opts.concrete_fields
+        columns = ", ".join(connection.ops.quote_name(f.column) for f in fields)
+        with cursor.cursor.copy(
+            f"COPY {connection.ops.quote_name(opts.db_table)} ({columns}) FROM STDIN"
+        ) as copy:
+            for obj in objs:
+                for field in fields:
+                    related = field.is_relation and field.get_cached_value(obj, None)
+                    if related:
+                        # assigned before the related object had a pk
+                        setattr(obj, field.attname, related.pk)
+                copy.write_row(
+                    [
+                        field.get_db_prep_save(field.pre_save(obj, True), cursor.db)
+                        for field in fields
+                    ]
+                )
+    for obj in objs:
+        obj._state.adding = False
+        obj._state.db = cursor.db.alias
+
+
+class LibraryImporter:
+    """
+    Writes rows of items - and optionally an activity each - for a user, a chunk at a time.
+
+    A row has `item_type` (a slug, or the importer's default), either `token` for an existing item
+    or `info` for a new one (in csv, one column per schema property), `parent` (a token,
+    or the name of an item of the parent type), `notes`, and the activity columns
+    `start_time`, `end_time`, `finished`, `pending`, `rating` (out of the user's ratingMax)
+    and `activity_notes`. A `token` that isn't in the library, given with `info`, names the new item
+    for the rows after it - that's how an export from another account keeps its parents.
+    Rows with the same item type and info share one item, also with items already in the library,
+    so re-running an import only adds activities. Parents named by the import have to come before
+    their children. Bad rows are reported and skipped, each chunk is written in its own transaction.
+    """
+
+    def __init__(
+        self,
+        user: User,
+        default_item_type: str | None = None,
+        chunk_size: int = IMPORT_CHUNK_SIZE,
+    ):
+        self.user = user
+        self.default_item_type = default_item_type
+        self.chunk_size = chunk_size
+        self.item_types = {t.slug: t for t in ItemType.objects.filter(user=user)}
+        self.rating_max = user.settings.get("ratingMax", 5)
+        self.tz = get_tz(user.display_timezone) or datetime.timezone.utc
+        templates = [t.name_template for t in self.item_types.values()]
+        self.ancestor_path = "__".join(
+            ["parent"] * max((t.max_depth for t in templates), default=0)
+        )
+        # what's read from the library's items: enough to match rows against and to name
+        # new children under them, so of their ancestors just the columns those names use
+        self.item_columns = [
+            "token",
+            "item_type",
+            "info",
+            "name",
+            "created",
+            "parent",
+            *sorted(
+                {
+                    c.removeprefix("parent__")
+                    for t in templates
+                    for c in t.columns
+                    if c.startswith("parent__parent__")
+                }
+            ),
+        ]
+        # items known to this import, by (item type pk, info), by (item type pk, name)
+        # and by the token rows gave them
+        self.items_by_info: dict[tuple[int, str], Item] = {}
+        self.items_by_name: dict[tuple[int, str], Item] = {}
+        self.items_by_token: dict[str, Item] = {}
+        self.report = ImportReport()
+
+    def run(self, rows: Iterable[tuple[int, dict | RowError]]) -> ImportReport:
+        started = time.perf_counter()
+        chunk: list[tuple[int, dict | RowError]] = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        self.report.errors.sort(key=lambda e: e["row"])
+        self.report.seconds = round(time.perf_counter() - started, 3)
+        return self.report
+
+    def error(self, row_number: int, message: str):
+        self.report.errors.append({"row": row_number, "error": message})
+
+    def import_chunk(self, chunk: list[tuple[int, dict | RowError]]):
+        self.report.rows += len(chunk)
+        rows = []
+        for number, raw in chunk:
+            try:
+                if isinstance(raw, RowError):
+                    raise raw
+                rows.append(self.parse_row(number, raw))
+            except RowError as e:
+                self.error(number, str(e))
+
+        self.lookup_tokens(rows)
+        self.lookup_existing(rows)
+        self.lookup_parents(rows)
+
+        new_items: list[Item] = []
+        activities: list[Activity] = []
+        for row in rows:
+            try:
+                item = self.resolve_item(row, new_items)
+            except RowError as e:
+                self.error(row.number, str(e))
+                continue
+            if row.activity is not None:
+                activities.append(Activity(user=self.user, item=item, **row.activity))
+
+        try:
+            with transaction.atomic():
+                self.write(new_items, activities)
+        except DatabaseError as e:
+            for row in rows:
+                self.error(row.number, f"Not imported, the chunk failed: {e}")
+            # forget what never made it to the database
+            rolled_back = {id(item) for item in new_items}
+            for known in (self.items_by_info, self.items_by_name, self.items_by_token):
+                for key, item in list(known.items()):
+                    if id(item) in rolled_back:
+                        del known[key]
+            return
+        self.report.items_created += len(new_items)
+        self.report.activities_created += len(activities)
+
+    def parse_row(self, number: int, raw: dict[str, Any]) -> ImportRow:
+        slug = raw.get("item_type") or self.default_item_type
+        if not slug:
+            raise RowError("No item_type")
+        item_type = self.item_types.get(slug)
+        if item_type is None:
+            raise RowError(f"Unknown item type {slug!r}")
+
+        properties = item_type.item_schema.get("properties", {})
+        if isinstance(raw.get("info"), dict):
+            info = raw["info"]
+        else:
+            info = {}
+            for column, value in raw.items():
+                if column in properties and value not in ("", None):
+                    info[column] = (
+                        _coerce_csv_value(value, properties[column].get("type"))
+                        if isinstance(value, str)
+                        else value
+                    )
+
+        activity = None
+        if any(raw.get(column) not in ("", None) for column in ACTIVITY_COLUMNS):
+            activity = {
+                "start_time": self.parse_time(raw.get("start_time")),
+                "end_time": self.parse_time(raw.get("end_time")),
+                "finished": _parse_bool(raw.get("finished") or False),
+                "pending": _parse_bool(raw.get("pending") or False),
+                "rating": self.parse_rating(raw.get("rating")),
+                "notes": raw.get("activity_notes") or "",
+            }
+
+        return ImportRow(
+            number=number,
+            item_type=item_type,
+            token=raw.get("token") or None,
+            info=info,
+            parent=raw.get("parent") or None,
+            notes=raw.get("notes") or "",
+            activity=activity,
+        )
+
+    def parse_time(self, value: Any) -> datetime.datetime | None:
+        if value in ("", None):
+            return None
+        value = str(value).strip()
+        parsed = parse_datetime(value)
+        if parsed is None:
+            day = parse_date(value.replace("/", "-"))
+            if day is None:
+                raise RowError(f"{value!r} is not a date")
+            parsed = datetime.datetime.combine(day, datetime.time())
+        if timezone.is_naive(parsed):
+            parsed = parsed.replace(tzinfo=self.tz)
+        return parsed
+
+    def parse_rating(self, value: Any) -> float | None:
+        if value in ("", None):
+            return None
+        rating = _parse_number(value) if isinstance(value, str) else value
+        if not isinstance(rating, (int, float)) or not 0 <= rating <= self.rating_max:
+            raise RowError(f"Rating must be between 0 and {self.rating_max}")
+        return rating / self.rating_max
+
+    def lookup_tokens(self, rows: list[ImportRow]):
+        tokens = {row.token for row in rows if row.token}
+        tokens |= {
+            row.parent for row in rows if row.parent and row.parent.startswith("I_")
+        }
+        tokens -= self.items_by_token.keys()
+        if not tokens:
+            return
+        for item in self.existing_items(token__in=tokens):
+            self.items_by_token[item.token] = item
+
+    def lookup_existing(self, rows: list[ImportRow]):
+        """Load the library's items matching new rows, so they aren't created twice"""
+        wanted = [
+            row
+            for row in rows
+            if row.token not in self.items_by_token
+            and (row.info or not row.token)
+            and self.info_key(row) not in self.items_by_info
+        ]
+        if not wanted:
+            return
+        # a hashed IN list, the item type is checked when the matches are remembered
+        for item in self.existing_items(
+            item_type_id__in={row.item_type.pk for row in wanted},
+            info__in=[row.info for row in wanted],
+        ):
+            self.remember(item)
+
+    def lookup_parents(self, rows: list[ImportRow]):
+        names = defaultdict(set)
+        for row in rows:
+            if row.parent and not row.parent.startswith("I_"):
+                parent_type = self.item_types.get(row.item_type.parent_slug)
+                if (
+                    parent_type is not None
+                    and (parent_type.pk, row.parent) not in self.items_by_name
+                ):
+                    names[parent_type.pk].add(row.parent)
+        if not names:
+            return
+        wanted = Q(pk__in=[])
+        for item_type_id, type_names in names.items():
+            wanted |= Q(item_type_id=item_type_id, name__in=type_names)
+        for parent in self.existing_items(wanted):
+            self.items_by_name.setdefault((parent.item_type_id, parent.name), parent)
+
+    def existing_items(self, *args, **kwargs) -> QuerySet[Item]:
+        items = Item.objects.filter(*args, user=self.user, **kwargs)
+        if self.ancestor_path:
+            items = items.select_related(self.ancestor_path)
+        return items.only(*self.item_columns)
+
+    def info_key(self, row: ImportRow) -> tuple[int, str]:
+        return (row.item_type.pk, json.dumps(row.info, sort_keys=True))
+
+    def remember(self, item: Item):
+        key = (item.item_type_id, json.dumps(item.info, sort_keys=True))
+        self.items_by_info.setdefault(key, item)
+        self.items_by_name.setdefault((item.item_type_id, item.name), item)
+
+    def resolve_item(self, row: ImportRow, new_items: list[Item]) -> Item:
+        if row.token in self.items_by_token:
+            return self.items_by_token[row.token]
+        if row.token and not row.info:
+            raise RowError(f"No item {row.token!r}")
+        item = self.items_by_info.get(self.info_key(row))
+        if item is None:
+            item = self.new_item(row, new_items)
+        if row.token:
+            self.items_by_token[row.token] = item
+        return item
+
+    def new_item(self, row: ImportRow, new_items: list[Item]) -> Item:
+        error = row.item_type.info_validator.error_message(row.info)
+        if error is not None:
+            raise RowError(error)
+        item = Item(
+            user=self.user,
+            item_type=row.item_type,
+            info=row.info,
+            notes=row.notes,
+            parent=self.resolve_parent(row),
+        )
+        item.name = row.item_type.name_template.render(item, self.user.display_timezone)
+        self.remember(item)
+        new_items.append(item)
+        return item
+
+    def resolve_parent(self, row: ImportRow) -> Item | None:
+        if not row.parent:
+            return None
+        if row.parent.startswith("I_"):
+            parent = self.items_by_token.get(row.parent)
+        else:
+            parent_type = self.item_types.get(row.item_type.parent_slug)
+            if parent_type is None:
+                raise RowError(f"{row.item_type.slug} items don't have parents")
+            parent = self.items_by_name.get((parent_type.pk, row.parent))
+        if parent is None:
+            raise RowError(f"No parent {row.parent!r}")
+        return parent
+
+    def write(self, new_items: list[Item], activities: list[Activity]):
+        copy_insert(Item, new_items)
+
+        timed = [i for i in new_items if i.item_type.name_template.uses_time]
+        for item in timed:
+            # `created` is only filled in by the insert
+            item.name = item.item_type.name_template.render(
+                item, self.user.display_timezone
+            )
+        Item.objects.bulk_update(timed, ["name"], batch_size=self.chunk_size)
+
+        copy_insert(Activity, activities)
+        rollups = RollupDeltas()
+        for activity in activities:
+            key = rollup_key(
+                self.user.pk,
+                activity.item.item_type_id,
+                self.user.display_timezone,
+                activity.created,
+                **{f: getattr(activity, f) for f in Activity.tracked_fields},
+            )
+            rollups.add(key, 1, activity.rating)
+        ActivityRollup.objects.record(rollups)
+
+        if new_items:
+            Item.objects.filter(pk__in=[i.pk for i in new_items]).refresh_search_index(
+                self.user.pk, self.user.search_fields
+            )
+            deltas = defaultdict(Counter)
+            for item in new_items:
+                deltas[item.item_type_id].update(suggestion_values(item.info))
+            for item_type_id, type_deltas in deltas.items():
+                AutocompleteSuggestion.objects.record(
+                    self.user.pk, item_type_id, type_deltas
+                )
+        if new_items or activities:
+            User.objects.bump_versions(self.user.pk, "library", "activity")
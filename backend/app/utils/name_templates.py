@@ -0,0 +1,130 @@
+import datetime
+import re
+import zoneinfo
+from dataclasses import dataclass
+from functools import cached_property, lru_cache
+from typing import Any
+
+from dateutil.tz import gettz
+
+from app.utils.request_timing import timed_function
+
+# `{{title}}`, `{{parent.title}}`, `{{created!%Y}}`, `{{parent.parent.created}}`...
+NAME_TEMPLATE_REGEX = re.compile(r"{{([\w\-\.!%]+)}}")
+PARENT_STRIPPER_REGEX = re.compile(r"(parent\.)*(.*)")
+TIME_FIELDS = {"created"}
+
+
+@dataclass(frozen=True)
+class Placeholder:
+    depth: int  # 0 is the item itself, 1 its parent, ...
+    field: str  # info key, or the time field when is_time
+    is_time: bool = False
+    time_format: str | None = None  # strftime format, isoformat when None
+
+
+@lru_cache(maxsize=128)
+def get_tz(name: str) -> datetime.tzinfo | None:
+    return gettz(name)
+
+
+@lru_cache(maxsize=128)
+def get_zone(name: str) -> zoneinfo.ZoneInfo:
+    """
+    The IANA zone `name`, UTC for anything else. Unlike get_tz this doesn't read POSIX strings
+    like "EST+5", so Python and Postgres (AT TIME ZONE) agree on what a name means
+    """
+    try:
+        return zoneinfo.ZoneInfo(name)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError, TypeError):
+        return zoneinfo.ZoneInfo("UTC")
+
+
+def _parse_placeholder(spec: str) -> Placeholder:
+    match = PARENT_STRIPPER_REGEX.search(spec)
+    depth = match.start(2) // len("parent.")
+    actual_field = match.group(2)
+    base, _, time_format = actual_field.partition("!")
+    if base in TIME_FIELDS:
+        return Placeholder(depth, base, True, time_format or None)
+    return Placeholder(depth, actual_field)
+
+
+class NameTemplate:
+    """A name_schema parsed once into literal chunks and placeholders"""
+
+    def __init__(self, schema: str):
+        self.schema = schema
+        self.parts: list[str | Placeholder] = []
+        pos = 0
+        for match in NAME_TEMPLATE_REGEX.finditer(schema):
+            if match.start() > pos:
+                self.parts.append(schema[pos : match.start()])
+            self.parts.append(_parse_placeholder(match.group(1)))
+            pos = match.end()
+        if pos < len(schema):
+            self.parts.append(schema[pos:])
+
+    @cached_property
+    def placeholders(self) -> list[Placeholder]:
+        return [p for p in self.parts if isinstance(p, Placeholder)]
+
+    @cached_property
+    def max_depth(self) -> int:
+        return max((p.depth for p in self.placeholders), default=0)
+
+    @cached_property
+    def uses_time(self) -> bool:
+        return any(p.is_time for p in self.placeholders)
+
+    @cached_property
+    def related_path(self) -> str | None:
+        """select_related path covering every ancestor the template reads"""
+        return "__".join(["parent"] * self.max_depth) or None
+
+    @cached_property
+    def columns(self) -> list[str]:
+        """Item columns (as `.only()` paths) read while rendering"""
+        columns = set()
+        for p in self.placeholders:
+            prefix = "parent__" * p.depth
+            columns.add(prefix + ("created" if p.is_time else "info"))
+        return sorted(columns)
+
+    @timed_function("names")
+    def render(self, item: Any, tz_name: str = "UTC") -> str:
+        if not self.placeholders:
+            return self.schema
+
+        ancestors = [item]
+        for _ in range(self.max_depth):
+            ancestors.append(ancestors[-1].parent if ancestors[-1] else None)
+
+        tz = get_tz(tz_name) if self.uses_time else None
+        chunks = []
+        for part in self.parts:
+            if isinstance(part, str):
+                chunks.append(part)
+                continue
+            ancestor = ancestors[part.depth]
+            if not ancestor:
+                continue
+            if part.is_time:
+                val = getattr(ancestor, part.field)
+                if val is None:
+                    # not inserted yet
+                    continue
+                val = val.astimezone(tz)
+                chunks.append(
+                    val.strftime(part.time_format)
+                    if part.time_format
+                    else val.isoformat()
+                )
+            else:
+                chunks.append(str(ancestor.info.get(part.field, "")))
+        return "".join(chunks)
+
+
+@lru_cache(maxsize=1024)
+def compile_name_schema(schema: str) -> NameTemplate:
+    return NameTemplate(schema)
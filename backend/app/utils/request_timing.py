@@ -0,0 +1,189 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Iterator
+
+# Server-Timing names and what they cover
+TIMED_PHASES = {
+    "db": "database",
+    "serialize": "serializers",
+    "names": "item name rendering",
+}
+
+# seconds, the upper bounds of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# anything else is counted as "other", so made up methods can't grow the series
+HTTP_METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+
+@dataclass
+class RequestTimings:
+    """Where one request's time went, in seconds. Filled in while the request runs, see timed"""
+
+    queries: int = 0
+    seconds: dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    # how deep in timed() blocks we are, per phase, so nested blocks aren't counted twice
+    depth: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def server_timing(self, total: float) -> str:
+        descriptions = {**TIMED_PHASES, "db": f"{self.queries} queries"}
+        metrics = [
+            f'{phase};dur={self.seconds.get(phase, 0) * 1000:.2f};desc="{descriptions[phase]}"'
+            for phase in TIMED_PHASES
+        ]
+        return ", ".join([*metrics, f"total;dur={total * 1000:.2f}"])
+
+
+_current: ContextVar[RequestTimings | None] = ContextVar(
+    "request_timings", default=None
+)
+
+
+@contextmanager
+def collect_timings() -> Iterator[RequestTimings]:
+    """Times `timed` blocks run inside it - the request, for ServerTimingMiddleware"""
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    timings = _current.get()
+    if timings is None or timings.depth[phase]:
+        # not collecting, or already being timed further out
+        yield
+        return
+    timings.depth[phase] += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.seconds[phase] += time.perf_counter() - started
+        timings.depth[phase] -= 1
+
+
+def timed_function(phase: str) -> Callable:
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return fn(*args, **kwargs)
+            with timed(phase):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def time_query(execute, sql, params, many, context):
+    """A connection.execute_wrapper counting queries and their time"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    timings.queries += 1
+    with timed("db"):
+        return execute(sql, params, many, context)
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """
+    connection_created receiver putting time_query on every connection for good - the async ORM
+    runs queries on other threads' connections, which the request's context still reaches
+    """
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+class RouteMetrics:
+    """
+    Per route and method latency histograms and phase totals, for the Prometheus text format.
+    Per process - every worker answers /metrics with its own numbers
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.buckets: dict[tuple[str, str], list[int]] = defaultdict(
+            lambda: [0] * (len(LATENCY_BUCKETS) + 1)
+        )
+        self.totals: dict[tuple[str, str], dict[str, float]] = defaultdict(
+            lambda: defaultdict(float)
+        )
+
+    def observe(self, route: str, method: str, seconds: float, timings: RequestTimings):
+        key = (route, method if method in HTTP_METHODS else "other")
+        with self.lock:
+            self.buckets[key][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            totals = self.totals[key]
+            totals["count"] += 1
+            totals["seconds"] += seconds
+            totals["queries"] += timings.queries
+            for phase in TIMED_PHASES:
+                totals[phase] += timings.seconds.get(phase, 0)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP pillowbook_request_duration_seconds Time to build the response, by route",
+            "# TYPE pillowbook_request_duration_seconds histogram",
+        ]
+        with self.lock:
+            series = sorted(self.buckets.items())
+            totals = {key: dict(value) for key, value in self.totals.items()}
+
+        def labels(route: str, method: str, **extra: str) -> str:
+            pairs = {"route": route, "method": method, **extra}
+            escaped = {
+                k: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                for k, v in pairs.items()
+            }
+            return "{" + ",".join(f'{k}="{v}"' for k, v in escaped.items()) + "}"
+
+        for (route, method), counts in series:
+            cumulative = 0
+            for bound, count in zip([*LATENCY_BUCKETS, "+Inf"], counts):
+                cumulative += count
+                lines.append(
+                    f"pillowbook_request_duration_seconds_bucket{labels(route, method, le=str(bound))} {cumulative}"
+                )
+            total = totals[(route, method)]
+            lines.append(
+                f"pillowbook_request_duration_seconds_sum{labels(route, method)} {total['seconds']}"
+            )
+            lines.append(
+                f"pillowbook_request_duration_seconds_count{labels(route, method)} {int(total['count'])}"
+            )
+
+        lines += [
+            "# HELP pillowbook_request_db_queries_total Database queries run, by route",
+            "# TYPE pillowbook_request_db_queries_total counter",
+        ]
+        for (route, method), total in sorted(totals.items()):
+            lines.append(
+                f"pillowbook_request_db_queries_total{labels(route, method)} {int(total['queries'])}"
+            )
+        lines += [
+            "# HELP pillowbook_request_phase_seconds_total Time spent in the database, serializers and name rendering, by route",
+            "# TYPE pillowbook_request_phase_seconds_total counter",
+        ]
+        for (route, method), total in sorted(totals.items()):
+            for phase in TIMED_PHASES:
+                lines.append(
+                    f"pillowbook_request_phase_seconds_total{labels(route, method, phase=phase)} {total[phase]}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+route_metrics = RouteMetrics()
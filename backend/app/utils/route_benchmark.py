@@ -0,0 +1,434 @@
+import datetime
+import importlib
+import io
+import json
+import platform
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass, field
+from os import environ
+from typing import Any, Callable
+
+import django
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from app.models import Activity, ApiToken, Item, ItemType, User
+from app.utils.api_tokens import issue_token
+from app.utils.common_utils import TOKEN_REGEX
+from app.utils.synthetic_library import generate_users
+
+BENCHMARK_PASSWORD = "benchmark"
+# the urlconfs whose routes are timed
+BENCHMARKED_URLCONFS = ["app.api.urls", "app.auth.urls"]
+
+
+@dataclass
+class Fixture:
+    """What the requests can point at in one user's synthetic library"""
+
+    user: User
+    item_type: ItemType
+    item: Item
+    parent: Item
+    activity: Activity
+    search_word: str
+    api_token: ApiToken
+
+    @classmethod
+    def for_user(cls, user: User) -> "Fixture":
+        activity = (
+            Activity.objects.filter(user=user, item__parent__isnull=False)
+            .select_related("item__item_type", "item__parent")
+            .order_by("pk")
+            .first()
+        )
+        return cls(
+            user=user,
+            item_type=activity.item.item_type,
+            item=activity.item,
+            parent=activity.item.parent,
+            activity=activity,
+            search_word=activity.item.info["title"].split()[0],
+            api_token=issue_token(user, "benchmark")[0],
+        )
+
+
+@dataclass
+class RouteRequest:
+    """One way of calling a route. `data` may be a callable, so uploads are fresh each run"""
+
+    label: str
+    method: str
+    path: Callable[[Fixture], str]
+    data: Callable[[Fixture], Any] = lambda f: None
+    content_type: str | None = None
+
+
+def _icon() -> SimpleUploadedFile:
+    from PIL import Image
+
+    image = io.BytesIO()
+    Image.new("RGB", (512, 512), (200, 120, 40)).save(image, "PNG")
+    return SimpleUploadedFile("icon.png", image.getvalue(), "image/png")
+
+
+def _import_file(f: Fixture) -> dict:
+    rows = "\n".join(
+        json.dumps(
+            {
+                "item_type": f.item_type.slug,
+                "info": {**f.item.info, "title": f"Import {n}"},
+            }
+        )
+        for n in range(50)
+    )
+    return {"file": SimpleUploadedFile("import.jsonl", rows.encode())}
+
+
+def _batch(f: Fixture) -> dict:
+    return {
+        "operations": [
+            {
+                "op": "create",
+                "model": "activity",
+                "data": {
+                    "itemDetails": {"token": f.item.token},
+                    "activityDetails": {"finished": True},
+                },
+            }
+            for _ in range(20)
+        ]
+    }
+
+
+JSON = "application/json"
+
+# route pattern -> the requests timed for it. Writes are rolled back after every run
+ROUTE_REQUESTS: dict[str, list[RouteRequest]] = {
+    "^item_type/(?P<slug>[\\w_-]+)/icon": [
+        RouteRequest(
+            "upload",
+            "post",
+            lambda f: f"/api/item_type/{f.item_type.slug}/icon",
+            lambda f: {"file": _icon()},
+        )
+    ],
+    "^item_type/(?P<slug>[\\w_-]+)": [
+        RouteRequest("get", "get", lambda f: f"/api/item_type/{f.item_type.slug}")
+    ],
+    "item_type": [RouteRequest("list", "get", lambda f: "/api/item_type")],
+    "activity": [
+        RouteRequest("list", "get", lambda f: "/api/activity"),
+        RouteRequest(
+            "filtered",
+            "get",
+            lambda f: f"/api/activity?itemTypes={f.item_type.slug}&completed=true",
+        ),
+        RouteRequest(
+            "search", "get", lambda f: f"/api/activity?search={f.search_word}"
+        ),
+        RouteRequest("cursor", "get", lambda f: "/api/activity?cursor="),
+    ],
+    "activity/timeline": [
+        RouteRequest(
+            "month",
+            "get",
+            lambda f: f"/api/activity/timeline?from={datetime.date.today() - datetime.timedelta(days=30)}",
+        ),
+        RouteRequest(
+            "day", "get", lambda f: f"/api/activity/timeline?at={datetime.date.today()}"
+        ),
+    ],
+    f"^activity/(?P<token>A_{TOKEN_REGEX})/concurrent": [
+        RouteRequest(
+            "get", "get", lambda f: f"/api/activity/{f.activity.token}/concurrent"
+        )
+    ],
+    f"^activity/(?P<token>A_{TOKEN_REGEX})": [
+        RouteRequest("get", "get", lambda f: f"/api/activity/{f.activity.token}"),
+        RouteRequest(
+            "update",
+            "patch",
+            lambda f: f"/api/activity/{f.activity.token}",
+            lambda f: {"finished": True, "rating": 0.5},
+            JSON,
+        ),
+    ],
+    "item": [
+        RouteRequest("list", "get", lambda f: "/api/item"),
+        RouteRequest("search", "get", lambda f: f"/api/item?search={f.search_word}"),
+        RouteRequest(
+            "filtered",
+            "get",
+            lambda f: f"/api/item?itemTypes={f.item_type.slug}&ordering=name",
+        ),
+    ],
+    "batch": [
+        RouteRequest("20 activities", "post", lambda f: "/api/batch", _batch, JSON)
+    ],
+    f"^item/(?P<token>I_{TOKEN_REGEX})/tree": [
+        RouteRequest("series", "get", lambda f: f"/api/item/{f.parent.token}/tree")
+    ],
+    f"^item/(?P<token>I_{TOKEN_REGEX})/series": [
+        RouteRequest("get", "get", lambda f: f"/api/item/{f.parent.token}/series")
+    ],
+    f"^item/(?P<token>I_{TOKEN_REGEX})": [
+        RouteRequest("get", "get", lambda f: f"/api/item/{f.item.token}"),
+        RouteRequest(
+            "update",
+            "patch",
+            lambda f: f"/api/item/{f.parent.token}",
+            lambda f: {"info": {**f.parent.info, "title": "Renamed"}},
+            JSON,
+        ),
+    ],
+    "^settings": [RouteRequest("get", "get", lambda f: "/api/settings")],
+    "^get_autocomplete_suggestions/(?P<item_slug>[\\w_-]+)": [
+        RouteRequest(
+            "all",
+            "get",
+            lambda f: f"/api/get_autocomplete_suggestions/{f.item_type.slug}",
+        ),
+        RouteRequest(
+            "prefix",
+            "get",
+            lambda f: f"/api/get_autocomplete_suggestions/{f.item_type.slug}?q={f.search_word[:2]}&limit=10",
+        ),
+    ],
+    "get_activities_static_filters": [
+        RouteRequest("get", "get", lambda f: "/api/get_activities_static_filters")
+    ],
+    "get_activities_static_filter_items": [
+        RouteRequest(
+            "prefix",
+            "get",
+            lambda f: f"/api/get_activities_static_filter_items?q={f.search_word[:2]}",
+        )
+    ],
+    "get_items_static_filters": [
+        RouteRequest("get", "get", lambda f: "/api/get_items_static_filters")
+    ],
+    "fuzzy_match_items": [
+        RouteRequest(
+            "typo",
+            "get",
+            lambda f: f"/api/fuzzy_match_items?q={f.search_word[:-1]}x",
+        )
+    ],
+    "stats": [RouteRequest("all", "get", lambda f: "/api/stats")],
+    "import": [RouteRequest("50 rows", "post", lambda f: "/api/import", _import_file)],
+    "export": [
+        RouteRequest("jsonl", "get", lambda f: "/api/export?format=jsonl"),
+        RouteRequest("csv", "get", lambda f: "/api/export?format=csv"),
+    ],
+    f"^item_icon/(?P<item_token>I_{TOKEN_REGEX})": [
+        RouteRequest(
+            "upload",
+            "post",
+            lambda f: f"/api/item_icon/{f.item.token}",
+            lambda f: {"file": _icon()},
+        )
+    ],
+    "version": [RouteRequest("get", "get", lambda f: "/api/version")],
+    "metrics": [RouteRequest("get", "get", lambda f: "/api/metrics")],
+    "tokens": [
+        RouteRequest("list", "get", lambda f: "/api/tokens"),
+        RouteRequest(
+            "create", "post", lambda f: "/api/tokens", lambda f: {"name": "new"}, JSON
+        ),
+    ],
+    "^tokens/(?P<key>\\w+)": [
+        RouteRequest("get", "get", lambda f: f"/api/tokens/{f.api_token.key}"),
+        RouteRequest("revoke", "delete", lambda f: f"/api/tokens/{f.api_token.key}"),
+    ],
+    "login": [
+        RouteRequest(
+            "password",
+            "post",
+            lambda f: "/auth/login",
+            lambda f: {"email": f.user.email, "password": BENCHMARK_PASSWORD},
+            JSON,
+        )
+    ],
+    "logout": [RouteRequest("get", "get", lambda f: "/auth/logout")],
+    "user_is_logged_in": [
+        RouteRequest("get", "get", lambda f: "/auth/user_is_logged_in")
+    ],
+}
+
+
+def benchmarked_routes() -> list[str]:
+    """Every route pattern in BENCHMARKED_URLCONFS, so new routes without requests show up"""
+    return [
+        str(pattern.pattern)
+        for urlconf in BENCHMARKED_URLCONFS
+        for pattern in importlib.import_module(urlconf).urlpatterns
+    ]
+
+
+@dataclass
+class Timing:
+    route: str
+    request: str
+    method: str
+    status: int | None = None
+    runs: list[float] = field(default_factory=list)
+    queries: int | None = None
+    bytes: int | None = None
+
+    def as_dict(self) -> dict:
+        runs = sorted(self.runs)
+        return {
+            "route": self.route,
+            "request": self.request,
+            "method": self.method.upper(),
+            "status": self.status,
+            "queries": self.queries,
+            "bytes": self.bytes,
+            "runs": len(runs),
+            "min_ms": runs and round(runs[0], 3),
+            "median_ms": runs and round(statistics.median(runs), 3),
+            "p95_ms": runs
+            and round(runs[min(int(len(runs) * 0.95), len(runs) - 1)], 3),
+            "max_ms": runs and round(runs[-1], 3),
+        }
+
+
+def time_request(
+    client: Client, fixture: Fixture, route: str, request: RouteRequest, repeat: int
+) -> Timing:
+    timing = Timing(route, request.label, request.method)
+    call = getattr(client, request.method)
+    # one untimed run first, so caches are warm the same way for every size
+    for run in range(repeat + 1):
+        kwargs = {}
+        data = request.data(fixture)
+        if data is not None:
+            kwargs["data"] = json.dumps(data) if request.content_type else data
+        if request.content_type:
+            kwargs["content_type"] = request.content_type
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                res = call(request.path(fixture), **kwargs)
+                body = b"".join(res.streaming_content) if res.streaming else res.content
+                elapsed = (time.perf_counter() - started) * 1000
+            transaction.set_rollback(True)
+        # logging in and out swaps the session
+        client.force_login(fixture.user)
+        if run:
+            timing.runs.append(elapsed)
+            # savepoints aren't the view's
+            timing.queries = len(
+                [q for q in ctx.captured_queries if "SAVEPOINT" not in q["sql"]]
+            )
+        timing.status = res.status_code
+        timing.bytes = len(body)
+    return timing
+
+
+def run_benchmarks(
+    sizes: list[tuple[int, int]],
+    repeat: int = 5,
+    depth: int = 2,
+    seed: int = 0,
+    routes: list[str] | None = None,
+    progress: Callable[[str], None] = lambda message: None,
+) -> dict[str, Any]:
+    """
+    Times every request in ROUTE_REQUESTS against a fresh synthetic library per (items, activities) size.
+    Everything is written in a transaction that's rolled back at the end, icons go to a temporary MEDIA_ROOT
+    """
+    results = []
+    all_routes = benchmarked_routes()
+    missing = [route for route in all_routes if route not in ROUTE_REQUESTS]
+    for items, activities in sizes:
+        with transaction.atomic(), tempfile.TemporaryDirectory() as media_root:
+            # every repeat is timed doing the work, not served from the response cache
+            with override_settings(MEDIA_ROOT=media_root, RESPONSE_CACHE=False):
+                progress(f"generating {items} items, {activities} activities")
+                started = time.perf_counter()
+                (user,), _ = generate_users(
+                    1,
+                    items,
+                    activities,
+                    depth=depth,
+                    seed=seed,
+                    email_prefix="benchmark",
+                    password=BENCHMARK_PASSWORD,
+                )
+                generated = time.perf_counter() - started
+                fixture = Fixture.for_user(user)
+                # a 500 is a result too
+                client = Client(SERVER_NAME="localhost", raise_request_exception=False)
+                client.force_login(user)
+                timings = []
+                for route in all_routes:
+                    if routes and route not in routes:
+                        continue
+                    for request in ROUTE_REQUESTS.get(route, []):
+                        progress(
+                            f"  {request.method.upper()} {route} ({request.label})"
+                        )
+                        timings.append(
+                            time_request(client, fixture, route, request, repeat)
+                        )
+            transaction.set_rollback(True)
+        results.append(
+            {
+                "items": items,
+                "activities": activities,
+                "generate_seconds": round(generated, 3),
+                "timings": [t.as_dict() for t in timings],
+            }
+        )
+    return {
+        "started": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": environ.get("COMMIT_HASH", "local"),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "postgres": connection.pg_version,
+        "repeat": repeat,
+        "seed": seed,
+        "missing_routes": missing,
+        "sizes": results,
+    }
+
+
+def compare_benchmarks(
+    baseline: dict[str, Any], current: dict[str, Any], threshold: float = 1.2
+) -> list[dict[str, Any]]:
+    """Requests whose median got more than `threshold` times slower than in `baseline`, at the same size"""
+    before = {
+        (size["items"], size["activities"], t["route"], t["request"]): t
+        for size in baseline["sizes"]
+        for t in size["timings"]
+    }
+    regressions = []
+    for size in current["sizes"]:
+        for t in size["timings"]:
+            old = before.get(
+                (size["items"], size["activities"], t["route"], t["request"])
+            )
+            if (
+                old
+                and old["median_ms"]
+                and t["median_ms"] > old["median_ms"] * threshold
+            ):
+                regressions.append(
+                    {
+                        "items": size["items"],
+                        "activities": size["activities"],
+                        "route": t["route"],
+                        "request": t["request"],
+                        "before_ms": old["median_ms"],
+                        "after_ms": t["median_ms"],
+                        "before_queries": old["queries"],
+                        "after_queries": t["queries"],
+                    }
+                )
+    return regressions
@@ -0,0 +1,130 @@
+import copy
+import hashlib
+import json
+import numbers
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+
+from backend.env import ITEM_SCHEMA_FAST_PATH
+
+# keywords that don't constrain anything
+ANNOTATION_KEYWORDS = {"title", "description", "default", "examples", "$comment"}
+
+# same semantics as jsonschema's type checker
+SIMPLE_TYPE_CHECKS: dict[str, Callable[[Any], bool]] = {
+    "string": lambda v: isinstance(v, str),
+    "number": lambda v: isinstance(v, numbers.Number) and not isinstance(v, bool),
+    "integer": lambda v: not isinstance(v, bool)
+    and (isinstance(v, int) or (isinstance(v, float) and v.is_integer())),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _compile_fast_check(schema: dict[str, Any]) -> Callable[[Any], bool] | None:
+    """
+    A plain python check for flat object schemas like the ones in app.schemas -
+    typed properties, `required` and `additionalProperties`.
+    None when the schema uses anything else.
+    """
+    if schema.get("type") != "object" or not set(schema) <= {
+        "type",
+        "properties",
+        "required",
+        "additionalProperties",
+        *ANNOTATION_KEYWORDS,
+    }:
+        return None
+    property_checks = {}
+    for field, subschema in schema.get("properties", {}).items():
+        if (
+            not isinstance(subschema, dict)
+            or not set(subschema) <= {"type", *ANNOTATION_KEYWORDS}
+            # lists of types, like ["string", "null"], are left to jsonschema
+            or not isinstance(subschema.get("type"), str)
+            or subschema["type"] not in SIMPLE_TYPE_CHECKS
+        ):
+            return None
+        property_checks[field] = SIMPLE_TYPE_CHECKS[subschema["type"]]
+    additional_allowed = schema.get("additionalProperties", True)
+    required = schema.get("required", [])
+    if not isinstance(additional_allowed, bool) or not isinstance(required, list):
+        return None
+
+    def check(instance: Any) -> bool:
+        if not isinstance(instance, dict):
+            return False
+        if any(field not in instance for field in required):
+            return False
+        for field, value in instance.items():
+            type_check = property_checks.get(field)
+            if type_check is None:
+                if not additional_allowed:
+                    return False
+            elif not type_check(value):
+                return False
+        return True
+
+    return check
+
+
+class InfoValidator:
+    """
+    An item schema, checked against its metaschema once.
+    Valid instances go through the fast check when the schema allows one,
+    errors always come from jsonschema so the messages match jsonschema.validate
+    """
+
+    def __init__(self, schema: dict[str, Any]):
+        cls = validator_for(schema)
+        cls.check_schema(schema)
+        self.validator = cls(schema)
+        self.fast_check = _compile_fast_check(schema) if ITEM_SCHEMA_FAST_PATH else None
+
+    def error_message(self, instance: Any) -> str | None:
+        if self.fast_check is not None and self.fast_check(instance):
+            return None
+        error = best_match(self.validator.iter_errors(instance))
+        return error.message if error is not None else None
+
+
+def schema_hash(schema: dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(schema, sort_keys=True).encode()).hexdigest()
+
+
+# the least recently used go first past this many
+MAX_CACHED_VALIDATORS = 1000
+
+# item type pk -> (schema hash, validator), least recently used first
+_validators: OrderedDict[int, tuple[str, InfoValidator]] = OrderedDict()
+_validators_lock = threading.Lock()
+
+
+def get_info_validator(item_type) -> InfoValidator:
+    """
+    The compiled validator for an item type's item_schema, cached per item type
+    and rebuilt whenever the schema hashes differently. Raises SchemaError for bad schemas
+    """
+    key = schema_hash(item_type.item_schema)
+    with _validators_lock:
+        cached = _validators.get(item_type.pk)
+        if cached is not None:
+            _validators.move_to_end(item_type.pk)
+    if cached is None or cached[0] != key:
+        cached = (key, InfoValidator(copy.deepcopy(item_type.item_schema)))
+        if item_type.pk is not None:
+            with _validators_lock:
+                _validators[item_type.pk] = cached
+                _validators.move_to_end(item_type.pk)
+                while len(_validators) > MAX_CACHED_VALIDATORS:
+                    _validators.popitem(last=False)
+    return cached[1]
+
+
+def forget_info_validator(item_type_pk: int) -> None:
+    with _validators_lock:
+        _validators.pop(item_type_pk, None)
@@ -0,0 +1,64 @@
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchVector,
+    SearchVectorCombinable,
+    SearchVectorField,
+)
+from django.db.models import F, Func, OuterRef, Subquery, TextField, Value
+from django.db.models.fields.json import KT
+
+# titles and people's names, so no stemming or stop words
+SEARCH_CONFIG = "simple"
+
+
+class JSONBSearchVector(SearchVectorCombinable, Func):
+    """Weighted tsvector over every string and number value of a jsonb column"""
+
+    template = (
+        "setweight(jsonb_to_tsvector('%(config)s'::regconfig, "
+        "COALESCE(%(expressions)s, '{}'::jsonb), '[\"string\", \"numeric\"]'), "
+        "'%(weight)s')"
+    )
+    output_field = SearchVectorField()
+
+    def __init__(self, expression, weight: str):
+        super().__init__(expression, config=SEARCH_CONFIG, weight=weight)
+
+
+def item_search_document(item_model):
+    """
+    Expression for Item.search_document: the rendered name, the info values,
+    the parent's name and the notes, weighted in that order.
+    Takes the model so migrations can build it from historical models.
+    """
+    parent_name = Subquery(
+        item_model.objects.filter(pk=OuterRef("parent_id")).values("name")[:1]
+    )
+    return (
+        SearchVector("name", weight="A", config=SEARCH_CONFIG)
+        + JSONBSearchVector(F("info"), weight="B")
+        + SearchVector(parent_name, weight="C", config=SEARCH_CONFIG)
+        + SearchVector("notes", weight="D", config=SEARCH_CONFIG)
+    )
+
+
+def item_search_text(search_fields: list[str]) -> Func:
+    """Expression for Item.search_text: the name plus the values of the user's key info fields"""
+    return Func(
+        Value(" "),
+        F("name"),
+        *[KT(f"info__{field}") for field in search_fields],
+        function="concat_ws",
+        output_field=TextField(),
+    )
+
+
+def build_search_query(terms: list[str]) -> SearchQuery | None:
+    """Every word has to match as a prefix, so results show up while typing"""
+    words = [w for term in terms for w in re.findall(r"\w+", term)]
+    if not words:
+        return None
+    raw = " & ".join(f"{w}:*" for w in words)
+    return SearchQuery(raw, search_type="raw", config=SEARCH_CONFIG)
@@ -0,0 +1,259 @@
+import datetime
+import random
+from collections import Counter, defaultdict
+from dataclasses import asdict, dataclass
+
+from django.db import transaction
+
+from app.models import (
+    Activity,
+    ActivityRollup,
+    AutocompleteSuggestion,
+    Item,
+    ItemType,
+    User,
+    refresh_search_fields,
+    suggestion_values,
+)
+from app.schemas import default_item_types
+from app.utils.library_import import copy_insert
+
+SYNTHETIC_CHUNK_SIZE = 10000
+
+# a few name_schema per default item type, picked per user so libraries don't all render alike
+NAME_SCHEMAS = {
+    "book-series": ["{{title}}", "{{title}} ({{parent.title}})"],
+    "book": [
+        "{{title}}",
+        "{{title}} ({{parent.title}})",
+        "{{title}} - {{author}}",
+        "{{parent.title}} #{{series_num}}: {{title}}",
+    ],
+    "movie": ["{{title}}", "{{title}} ({{series}} {{series_num}})"],
+    "video_game": ["{{title}}", "{{title}} [{{console}}]"],
+}
+
+WORDS = (
+    "ash autumn blue bright broken city cold crown dark dawn deep dragon dream dust echo "
+    "ember empire fall fire frost garden ghost glass gold harbor hollow iron island king "
+    "last light long lost moon night north ocean quiet rain red river road salt sea "
+    "shadow silent silver sky snow song star stone storm summer sun tide tower twilight "
+    "veil war water white wild wind winter wolf world"
+).split()
+AUTHORS = [f"{first} {last}" for first in WORDS[:12] for last in WORDS[-12:]]
+CONSOLES = ["Switch", "PS5", "PC", "Xbox", "Game Boy", "SNES"]
+TIMEZONES = ["UTC", "America/New_York", "Europe/London", "Asia/Tokyo"]
+
+
+@dataclass
+class SyntheticReport:
+    users: int = 0
+    items: int = 0
+    activities: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class SyntheticLibrary:
+    """
+    A made up library for one user, for benchmarks: the default item types with varied name_schemas,
+    book series nested `depth` deep with books under the innermost ones, movies and games,
+    and activities spread over the last few years - some ongoing, some unfinished, most rated.
+    Written with COPY a chunk at a time, then the derived tables are brought up to date.
+    The same `seed` always makes the same library
+    """
+
+    def __init__(
+        self,
+        user: User,
+        items: int,
+        activities: int,
+        depth: int = 2,
+        seed: int | str = 0,
+        chunk_size: int = SYNTHETIC_CHUNK_SIZE,
+    ):
+        self.user = user
+        self.item_count = items
+        self.activity_count = activities
+        self.depth = max(depth, 1)
+        self.random = random.Random(seed)
+        self.chunk_size = chunk_size
+
+    def title(self) -> str:
+        return " ".join(
+            self.random.choice(WORDS) for _ in range(self.random.randint(1, 4))
+        ).title()
+
+    def when(self) -> datetime.datetime:
+        return datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+            minutes=self.random.randint(0, 4 * 365 * 24 * 60)
+        )
+
+    def make_item_types(self) -> dict[str, ItemType]:
+        item_types = {}
+        for item_type in default_item_types:
+            slug = item_type["slug"]
+            item_types[slug] = ItemType.objects.create(
+                user=self.user,
+                **{
+                    **item_type,
+                    # slugs are unique across users
+                    "slug": f"{slug}-{self.user.pk}",
+                    "parent_slug": item_type.get("parent_slug")
+                    and f"{item_type['parent_slug']}-{self.user.pk}",
+                    "name_schema": self.random.choice(NAME_SCHEMAS[slug]),
+                    "activity_schema": item_type.get("activity_schema") or {},
+                },
+            )
+        return item_types
+
+    def info(self, slug: str) -> dict:
+        info = {"title": self.title()}
+        if slug == "book":
+            info["author"] = self.random.choice(AUTHORS)
+            info["series_num"] = self.random.randint(1, 12)
+        elif slug == "movie" and self.random.random() < 0.3:
+            info["series"] = self.title()
+            info["series_num"] = self.random.randint(1, 5)
+        elif slug == "video_game":
+            info["console"] = self.random.choice(CONSOLES)
+        return info
+
+    def make_items(self, item_types: dict[str, ItemType]) -> list[int]:
+        """Item pks, parents before their children"""
+        tz = self.user.display_timezone
+        # a tenth of the library is series, most of the rest books
+        series_count = max(self.item_count // 10, self.depth)
+        series_levels: list[list[Item]] = []
+        for level in range(self.depth):
+            parents = series_levels[-1] if series_levels else [None]
+            count = max(series_count // self.depth, 1)
+            series_levels.append(
+                [
+                    Item(
+                        user=self.user,
+                        item_type=item_types["book-series"],
+                        info=self.info("book-series"),
+                        parent=self.random.choice(parents),
+                    )
+                    for _ in range(count)
+                ]
+            )
+        items = [series for level in series_levels for series in level]
+        while len(items) < self.item_count:
+            slug = self.random.choices(
+                ["book", "movie", "video_game"], weights=[6, 2, 2]
+            )[0]
+            items.append(
+                Item(
+                    user=self.user,
+                    item_type=item_types[slug],
+                    info=self.info(slug),
+                    parent=self.random.choice(series_levels[-1])
+                    if slug == "book"
+                    else None,
+                    pinned=self.random.random() < 0.01,
+                )
+            )
+        items = items[: self.item_count]
+        for item in items:
+            item.name = item.item_type.name_template.render(item, tz)
+
+        suggestions = defaultdict(Counter)
+        for start in range(0, len(items), self.chunk_size):
+            chunk = items[start : start + self.chunk_size]
+            copy_insert(Item, chunk)
+            for item in chunk:
+                suggestions[item.item_type_id].update(suggestion_values(item.info))
+        for item_type_id, deltas in suggestions.items():
+            AutocompleteSuggestion.objects.record(self.user.pk, item_type_id, deltas)
+        return [item.pk for item in items]
+
+    def make_activity(self, item_pk: int) -> Activity:
+        start = self.when()
+        ongoing = self.random.random() < 0.05
+        finished = not ongoing and self.random.random() < 0.8
+        return Activity(
+            user=self.user,
+            item_id=item_pk,
+            start_time=start if self.random.random() < 0.9 else None,
+            end_time=None
+            if ongoing
+            else start + datetime.timedelta(hours=self.random.randint(1, 24 * 60)),
+            finished=finished,
+            pending=ongoing and self.random.random() < 0.5,
+            rating=round(self.random.random(), 2)
+            if finished and self.random.random() < 0.8
+            else None,
+        )
+
+    def make_activities(self, item_pks: list[int]):
+        for start in range(0, self.activity_count, self.chunk_size):
+            count = min(self.chunk_size, self.activity_count - start)
+            copy_insert(
+                Activity,
+                [
+                    self.make_activity(self.random.choice(item_pks))
+                    for _ in range(count)
+                ],
+            )
+
+    @transaction.atomic
+    def run(self) -> SyntheticReport:
+        item_types = self.make_item_types()
+        item_pks = self.make_items(item_types)
+        if item_pks:
+            self.make_activities(item_pks)
+        Item.objects.refresh_search_index(
+            self.user.pk, refresh_search_fields(self.user.pk)
+        )
+        ActivityRollup.objects.rebuild(self.user)
+        User.objects.bump_versions(self.user.pk, "library", "activity")
+        return SyntheticReport(
+            users=1,
+            items=len(item_pks),
+            activities=self.activity_count if item_pks else 0,
+        )
+
+
+def generate_users(
+    count: int,
+    items: int,
+    activities: int,
+    *,
+    depth: int = 2,
+    seed: int = 0,
+    email_prefix: str = "synthetic",
+    password: str | None = None,
+) -> tuple[list[User], SyntheticReport]:
+    """
+    `count` new users, each with their own synthetic library of `items` items and `activities` activities.
+    The emails follow from the seed, so a seed and email prefix that were used before raise ValueError
+    before anything is written
+    """
+    rngs = [random.Random(f"{seed}-{n}") for n in range(count)]
+    emails = [
+        f"{email_prefix}-{n}-{rng.getrandbits(32):08x}@example.com"
+        for n, rng in enumerate(rngs)
+    ]
+    taken = list(User.objects.filter(email__in=emails).values_list("email", flat=True))
+    if taken:
+        raise ValueError(
+            f"{', '.join(sorted(taken))} already exist, use another seed or email prefix"
+        )
+
+    report = SyntheticReport()
+    users = []
+    for n, (rng, email) in enumerate(zip(rngs, emails)):
+        user = User.objects.create_user(email, password)
+        user.settings["displayTimezone"] = rng.choice(TIMEZONES)
+        user.save()
+        user_report = SyntheticLibrary(
+            user, items, activities, depth, f"{seed}-{n}"
+        ).run()
+        report.users += 1
+        report.items += user_report.items
+        report.activities += user_report.activities
+        users.append(user)
+    return users, report
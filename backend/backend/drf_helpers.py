@@ -33,18 +33,25 @@ class SessionAuthentication(DrfSessionAuthentication):
             raise CsrfException(reason)
 
 
+class SessionOnlyAuthentication(SessionAuthentication):
+    def authenticate(self, request):
+        # request.user is already the token's user for API token requests, see
+        # backend.middleware.ApiTokenMiddleware - turn those away
+        if hasattr(request._request, "wt_info"):
+            return None
+        return super().authenticate(request)
+
+
 class ExtensionSessionAuthentication(SessionAuthentication):
     def authenticate(self, request):
-        super_user = super().authenticate(request)
-        if super_user is not None:
-            return super_user
+        # set from an API token by backend.middleware.ApiTokenMiddleware, no session or csrf needed
         try:
             u = request.wt_info["ext"]["user"]
-            if not u.is_active:
-                return None
-            return (u, None)
+            if u.is_active:
+                return (u, None)
         except:
-            return None
+            pass
+        return super().authenticate(request)
 
     def enforce_csrf(self, request):
         try:
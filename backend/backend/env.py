@@ -12,3 +12,19 @@ DB_PORT = os.environ.get("DB_PORT", "5432")
 SESSION_COOKIE_SECURE = os.environ.get("SESSION_COOKIE_SECURE", "True") == "True"
 WEB_HOST = os.environ.get("WEB_HOST", "http://localhost:8000")
 STATIC_URL = os.environ.get("STATIC_URL", "/static/")
+
+# set to False to validate item info with jsonschema alone, see app.utils.schema_validation
+ITEM_SCHEMA_FAST_PATH = os.environ.get("ITEM_SCHEMA_FAST_PATH", "True") == "True"
+
+# set to False to skip the per request timings, see backend.middleware.ServerTimingMiddleware
+REQUEST_METRICS = os.environ.get("REQUEST_METRICS", "True") == "True"
+# lets a scraper read /api/metrics with `Authorization: Bearer <token>`, staff sessions can always
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# "thread", "inline" or "off", see app.utils.icons.schedule_icon_variants
+ICON_PROCESSING = os.environ.get("ICON_PROCESSING", "thread")
+
+# set to False to build every read from the database, see app.api.conditional
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "True") == "True"
+# a directory shared by the workers, or each keeps its own in memory
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "")
@@ -0,0 +1,18 @@
+"""
+gunicorn settings for serving backend.asgi from uvicorn workers, where the async read views
+(app.api.async_views, the static filters and autocomplete) wait on the database without holding
+a worker. Sync views still run, each request on a thread of its own.
+
+    gunicorn -c backend/gunicorn_asgi.py backend.asgi:application
+
+scripts/serve.sh picks this over the WSGI workers when SERVER_INTERFACE=asgi
+"""
+
+import os
+
+bind = "0.0.0.0:8000"
+workers = int(os.environ.get("WEB_CONCURRENCY", 3))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+accesslog = "guni_access.log"
+errorlog = "guni_error.log"
@@ -0,0 +1,135 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from corsheaders.middleware import CorsMiddleware as BaseCorsMiddleware
+from django.http import JsonResponse
+from django.utils.functional import LazyObject, empty
+
+from app.utils.api_tokens import InvalidToken, bearer_token, user_for_token
+from app.utils.request_timing import RequestTimings, collect_timings, route_metrics
+from backend.env import REQUEST_METRICS
+
+
+def loaded_user(request):
+    """The user if something already looked them up - request.user or request.auser() - without looking here"""
+    if getattr(request, "_acached_user", None) is not None:
+        # where AuthenticationMiddleware's auser keeps it
+        return request._acached_user
+    user = getattr(request, "user", None)
+    if isinstance(user, LazyObject):
+        return None if user._wrapped is empty else user._wrapped
+    return user
+
+
+class CorsMiddleware(BaseCorsMiddleware):
+    """
+    django-cors-headers' middleware, marked as a coroutine when it's given one. 4.3.0 marks itself
+    the way Python 3.12 no longer recognises, so under ASGI Django wouldn't await it
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+
+class ServerTimingMiddleware:
+    """
+    Counts each request's queries and times its database, serializer and name rendering work.
+    Staff get the numbers back as a Server-Timing header, and every request goes into the
+    per route histograms on /api/metrics. Streamed bodies are built after this returns, so only
+    the time to start them is counted. Queries are seen through time_query, which the app puts
+    on every connection
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not REQUEST_METRICS:
+            return self.get_response(request)
+        started = time.perf_counter()
+        with collect_timings() as timings:
+            response = self.get_response(request)
+        total = time.perf_counter() - started
+        self.record(request, response, total, timings, loaded_user(request))
+        return response
+
+    async def __acall__(self, request):
+        if not REQUEST_METRICS:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with collect_timings() as timings:
+            response = await self.get_response(request)
+        total = time.perf_counter() - started
+        self.record(request, response, total, timings, loaded_user(request))
+        return response
+
+    def record(self, request, response, total: float, timings: RequestTimings, user):
+        match = getattr(request, "resolver_match", None)
+        route_metrics.observe(
+            match.route if match else "unmatched", request.method, total, timings
+        )
+        if user is not None and user.is_staff:
+            response["Server-Timing"] = timings.server_timing(total)
+
+
+class ApiTokenMiddleware:
+    """
+    Signs in requests with an API token - `Authorization: Bearer pb_...`, see app.utils.api_tokens -
+    without reading the session: the user goes on request.user and on request.wt_info["ext"]["user"]
+    for ExtensionSessionAuthentication. Browsers never send the header on their own, so these
+    requests skip CSRF checks. A bad token is a 401. Goes after AuthenticationMiddleware
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = bearer_token(request)
+        if token is None:
+            return self.get_response(request)
+        try:
+            self.sign_in(request, user_for_token(token))
+        except InvalidToken as e:
+            return self.rejected(e)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        token = bearer_token(request)
+        if token is None:
+            return await self.get_response(request)
+        try:
+            self.sign_in(request, await sync_to_async(user_for_token)(token))
+        except InvalidToken as e:
+            return self.rejected(e)
+        return await self.get_response(request)
+
+    def sign_in(self, request, user):
+        async def auser():
+            return user
+
+        request.user = user
+        request.auser = auser
+        request.wt_info = {"ext": {"user": user}}
+        request._dont_enforce_csrf_checks = True
+
+    def rejected(self, error: InvalidToken) -> JsonResponse:
+        # shaped like backend.drf_helpers.exception_handler's errors
+        response = JsonResponse({"detail": str(error), "status_code": 401}, status=401)
+        response["WWW-Authenticate"] = 'Bearer error="invalid_token"'
+        return response
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "app",
     "django_filters",
     "corsheaders",
@@ -48,12 +49,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its total covers the rest
+    "backend.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
-    "corsheaders.middleware.CorsMiddleware",
+    "backend.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "backend.middleware.ApiTokenMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -94,6 +98,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # keys carry the user's versions, so nothing here is ever invalidated - it just ages out
+    "responses": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache"
+        if env.RESPONSE_CACHE_DIR
+        else "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": env.RESPONSE_CACHE_DIR or "responses",
+        "TIMEOUT": 24 * 60 * 60,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+}
+RESPONSE_CACHE = env.RESPONSE_CACHE
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -166,6 +190,7 @@ CSRF_TRUSTED_ORIGINS = ["http://localhost:3000"] + [
 
 MEDIA_ROOT = "/app/media"
 MEDIA_URL = "media/"
+ICON_PROCESSING = env.ICON_PROCESSING
 
 
 STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
@@ -1,11 +1,30 @@
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 
 from django.conf.urls.static import static
 from django.conf import settings
+from django.views.static import serve
+
+from app.utils.icons import ICON_DIRECTORY
+
+
+def serve_icon(request, path):
+    # named after their content, so they never change - as prod.caddy serves them
+    res = serve(request, path, document_root=settings.MEDIA_ROOT)
+    res["Cache-Control"] = "public, max-age=31536000, immutable"
+    return res
+
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("app.api.urls")),
     path("auth/", include("app.auth.urls")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+]
+if settings.DEBUG:
+    urlpatterns.append(
+        re_path(
+            rf"^{settings.MEDIA_URL.lstrip('/')}(?P<path>{ICON_DIRECTORY}/.*)$",
+            serve_icon,
+        )
+    )
+urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,6 @@
+#!/bin/sh
+# gunicorn for production - sync WSGI workers, or uvicorn workers on backend.asgi with SERVER_INTERFACE=asgi
+if [ "$SERVER_INTERFACE" = "asgi" ]; then
+    exec gunicorn -c backend/gunicorn_asgi.py backend.asgi:application
+fi
+exec gunicorn -b "0.0.0.0:8000" --workers=3 --preload --access-logfile guni_access.log --error-logfile guni_error.log backend.wsgi